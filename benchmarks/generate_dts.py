@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+DTS Generator - Generates synthetic Device Tree Source corpora for benchmarking
+
+Usage:
+    python generate_dts.py <output_dir> [--nodes N] [--depth N] [--properties N]
+                           [--overrides RATIO] [--include-depth N] [--seed N]
+"""
+
+import os
+import sys
+import random
+import argparse
+from typing import List
+
+# Device kinds placed on the SoC bus: (node name, compatible, extra properties)
+DEVICE_KINDS = [
+    ('serial', 'vendor,soc-uart', ['clock-names = "baud", "apb";', 'current-speed = <115200>;']),
+    ('i2c', 'vendor,soc-i2c', ['#address-cells = <1>;', '#size-cells = <0>;', 'clock-frequency = <400000>;']),
+    ('spi', 'vendor,soc-spi', ['#address-cells = <1>;', '#size-cells = <0>;', 'num-cs = <4>;']),
+    ('gpio', 'vendor,soc-gpio', ['gpio-controller;', '#gpio-cells = <2>;', 'interrupt-controller;']),
+    ('mmc', 'vendor,soc-mmc', ['bus-width = <8>;', 'max-frequency = <200000000>;', 'non-removable;']),
+    ('ethernet', 'vendor,soc-gmac', ['phy-mode = "rgmii-id";', 'local-mac-address = [00 11 22 33 44 55];']),
+    ('usb', 'vendor,soc-dwc3', ['dr_mode = "host";', 'phys = <&usbphy 0>, <&usbphy 1>;']),
+    ('pwm', 'vendor,soc-pwm', ['#pwm-cells = <3>;']),
+]
+
+# Properties added to every override block, cycled through; the delete drops
+# the ``interrupts`` cell every generated device carries
+OVERRIDE_PROPERTIES = [
+    'status = "okay";',
+    'pinctrl-names = "default";',
+    'assigned-clock-rates = <24000000>;',
+    '/delete-property/ interrupts;',
+]
+
+class DTSGenerator:
+    """Generates a synthetic but realistic SoC device tree.
+
+    ``nodes`` devices are spread over the SoC bus, nested up to ``depth``
+    levels below it, each with about ``properties`` properties. A fraction
+    ``overrides`` of the labelled devices gets an ``&label { ... };`` block,
+    and with ``include_depth`` > 0 the tree is split into a chain of that many
+    included .dtsi files, each overriding labels of the files it includes.
+    """
+    def __init__(self, nodes: int = 1000, depth: int = 3, properties: int = 6,
+                 overrides: float = 0.1, include_depth: int = 0, seed: int = 1):
+        self.nodes = nodes
+        self.depth = depth
+        self.properties = properties
+        self.overrides = overrides
+        self.include_depth = include_depth
+        self.random = random.Random(seed)
+        self.labels = []  # Labels of the generated devices, in generation order
+    
+    def generate(self, output_dir: str, name: str = 'board') -> str:
+        """Write the corpus to a directory and return the path of the top-level .dts file."""
+        os.makedirs(output_dir, exist_ok=True)
+        self.labels = []
+        
+        # The SoC file holds the devices, then every include level overrides some of them
+        files = [(f'{name}-soc.dtsi', self._soc_file())]
+        for level in range(1, self.include_depth):
+            files.append((f'{name}-level{level}.dtsi', self._override_file(files[-1][0], level)))
+        
+        if self.include_depth > 0:
+            files.append((f'{name}.dts', self._override_file(files[-1][0], self.include_depth, top_level=True)))
+        else:
+            # Everything in one file
+            files = [(f'{name}.dts', '/dts-v1/;\n\n' + files[0][1] + '\n' + self._overrides(0))]
+        
+        for filename, content in files:
+            with open(os.path.join(output_dir, filename), 'w') as f:
+                f.write(content)
+        return os.path.join(output_dir, files[-1][0])
+    
+    def generate_string(self) -> str:
+        """Return a single self-contained DTS file."""
+        self.labels = []
+        return '/dts-v1/;\n\n' + self._soc_file() + '\n' + self._overrides(0)
+    
+    def _soc_file(self) -> str:
+        """The base SoC tree: cpus, memory, clocks and the device bus."""
+        lines = [
+            '/ {',
+            '\tcompatible = "vendor,board", "vendor,soc";',
+            '\tmodel = "Synthetic Benchmark Board";',
+            '\t#address-cells = <2>;',
+            '\t#size-cells = <2>;',
+            '',
+            '\tcpus {',
+            '\t\t#address-cells = <1>;',
+            '\t\t#size-cells = <0>;',
+        ]
+        for cpu in range(4):
+            lines += [
+                f'\t\tcpu{cpu}: cpu@{cpu} {{',
+                '\t\t\tcompatible = "arm,cortex-a55";',
+                '\t\t\tdevice_type = "cpu";',
+                f'\t\t\treg = <{cpu}>;',
+                '\t\t\tenable-method = "psci";',
+                '\t\t};',
+            ]
+        lines += [
+            '\t};',
+            '',
+            '\tmemory@40000000 {',
+            '\t\tdevice_type = "memory";',
+            '\t\treg = <0x0 0x40000000 0x0 0x80000000>;',
+            '\t};',
+            '',
+            '\tsoc {',
+            '\t\tcompatible = "simple-bus";',
+            '\t\t#address-cells = <2>;',
+            '\t\t#size-cells = <2>;',
+            '\t\tranges;',
+            '',
+            '\t\tclkc: clock-controller@10000000 {',
+            '\t\t\tcompatible = "vendor,soc-clk";',
+            '\t\t\treg = <0x0 0x10000000 0x0 0x10000>;',
+            '\t\t\t#clock-cells = <1>;',
+            '\t\t};',
+            '',
+        ]
+        
+        count = 0
+        while count < self.nodes:
+            count = self._device(lines, 2, 0, count)
+        
+        lines += ['\t};', '};', '']
+        return '\n'.join(lines)
+    
+    def _device(self, lines: List[str], indent: int, level: int, count: int) -> int:
+        """Append one device node and its sub-devices; return the new device count."""
+        count += 1
+        kind, compatible, extra = DEVICE_KINDS[count % len(DEVICE_KINDS)]
+        tabs = '\t' * indent
+        label = f'{kind}{count}'
+        self.labels.append(label)
+        address = 0x20000000 + count * 0x1000
+        
+        properties = [
+            f'compatible = "{compatible}";',
+            f'reg = <0x0 0x{address:08x} 0x0 0x1000>;',
+            f'interrupts = <0 {count % 480} 4>;',
+            f'clocks = <&clkc {count % 256}>, <&clkc {(count + 1) % 256}>;',
+            'status = "disabled";',
+        ] + extra
+        while len(properties) < self.properties:
+            properties.append(f'vendor,param-{len(properties)} = <{self.random.randrange(1 << 16)}>;')
+        
+        lines.append(f'{tabs}{label}: {kind}@{address:x} {{')
+        for prop in properties[:self.properties]:
+            lines.append(f'{tabs}\t{prop}')
+        
+        # Nest sub-devices below this one, up to the configured depth
+        if level + 1 < self.depth:
+            for _ in range(self.random.randint(0, 3)):
+                if count >= self.nodes:
+                    break
+                lines.append('')
+                count = self._device(lines, indent + 1, level + 1, count)
+        
+        lines.append(f'{tabs}}};')
+        lines.append('')
+        return count
+    
+    def _override_file(self, included: str, level: int, top_level: bool = False) -> str:
+        """A file including the previous one in the chain and overriding some of its labels."""
+        header = '/dts-v1/;\n\n' if top_level else ''
+        return f'{header}#include "{included}"\n\n' + self._overrides(level)
+    
+    def _overrides(self, level: int) -> str:
+        """``&label`` blocks for a fraction of the devices, varying with the include level."""
+        if not self.labels or self.overrides <= 0:
+            return ''
+        count = max(1, int(len(self.labels) * self.overrides))
+        lines = []
+        for label in self.random.sample(self.labels, min(count, len(self.labels))):
+            lines.append(f'&{label} {{')
+            for i in range(2):
+                lines.append('\t' + OVERRIDE_PROPERTIES[(level + i) % len(OVERRIDE_PROPERTIES)])
+            lines += ['};', '']
+        return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic DTS corpora for benchmarking")
+    parser.add_argument("output_dir", help="Directory to write the generated files to")
+    parser.add_argument("--nodes", type=int, default=1000, help="Number of device nodes (default: 1000)")
+    parser.add_argument("--depth", type=int, default=3, help="Maximum nesting of devices below the SoC bus (default: 3)")
+    parser.add_argument("--properties", type=int, default=6, help="Properties per device node (default: 6)")
+    parser.add_argument("--overrides", type=float, default=0.1, help="Fraction of devices overridden by &label blocks (default: 0.1)")
+    parser.add_argument("--include-depth", type=int, default=0, help="Length of the .dtsi include chain (default: 0, a single file)")
+    parser.add_argument("--name", default="board", help="Base name of the generated files (default: board)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default: 1)")
+    args = parser.parse_args()
+    
+    generator = DTSGenerator(args.nodes, args.depth, args.properties, args.overrides,
+                             args.include_depth, args.seed)
+    path = generator.generate(args.output_dir, args.name)
+    print(f"Generated {args.nodes} nodes in {path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+DTS Benchmarks - Times and memory-profiles parsing, resolving and exporting DTS trees
+
+Usage:
+    python run_benchmarks.py [--nodes N [N ...]] [--output results.json]
+    python run_benchmarks.py --compare baseline.json [--output results.json]
+"""
+
+import os
+import sys
+import io
+import gc
+import json
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+from generate_dts import DTSGenerator
+
+# Add parent directory to sys.path to import dts_visualizer
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_DIR)
+from dts_visualizer.dts_visualizer import MultiFileDTSParser, DTSParser, DTSVisualizer
+from rich.console import Console
+
+# Format of the results file; bump it when its layout changes
+RESULTS_VERSION = 1
+
+def measure(run: Callable[..., object], setup: Optional[Callable[[], object]] = None,
+            repeat: int = 5) -> Dict[str, float]:
+    """Time a benchmark over several runs, then trace one more for its peak memory.
+
+    ``setup`` runs untimed before every run and its result is passed to ``run``.
+    """
+    times = []
+    for _ in range(repeat):
+        state = (setup(),) if setup else ()
+        gc.collect()
+        start = time.perf_counter()
+        run(*state)
+        times.append(time.perf_counter() - start)
+    
+    # tracemalloc slows everything down, so it gets a run of its own
+    state = (setup(),) if setup else ()
+    gc.collect()
+    tracemalloc.start()
+    run(*state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    return {
+        'min_s': min(times),
+        'median_s': statistics.median(times),
+        'peak_bytes': peak,
+    }
+
+def parsed_corpus(main_file: str) -> MultiFileDTSParser:
+    """Parse a generated corpus without resolving its references."""
+    multi_parser = MultiFileDTSParser()
+    multi_parser.parse_file(main_file)
+    return multi_parser
+
+def resolved_corpus(main_file: str) -> MultiFileDTSParser:
+    """Parse a generated corpus and resolve its references."""
+    multi_parser = parsed_corpus(main_file)
+    multi_parser.resolve_all_references()
+    return multi_parser
+
+def web_benchmark(corpus_dir: str):
+    """Return a function posting the corpus to /api/visualize, or None without Flask."""
+    sys.path.append(os.path.join(REPO_DIR, 'web_dashboard'))
+    try:
+        import app as web_app
+    except ImportError as e:
+        print(f"Skipping /api/visualize: {e}")
+        return None
+    
+    # Always parse in the request, not in a background job
+    web_app.BACKGROUND_BYTES = float('inf')
+    client = web_app.app.test_client()
+    files = []
+    for filename in sorted(os.listdir(corpus_dir)):
+        with open(os.path.join(corpus_dir, filename), 'rb') as f:
+            files.append((filename, f.read()))
+    
+    def run():
+        # A fresh result cache, so every request parses the upload
+        web_app.result_cache = web_app.ResultCache()
+        data = {'dts_file': [(io.BytesIO(content), filename) for filename, content in files]}
+        response = client.post('/api/visualize', data=data, content_type='multipart/form-data')
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/visualize returned {response.status_code}: {response.get_data(as_text=True)}")
+        response.get_data()
+    return run
+
+def run_scale(nodes: int, args, work_dir: str) -> List[dict]:
+    """Generate a corpus with a number of nodes and run every benchmark on it."""
+    corpus_dir = os.path.join(work_dir, f'nodes-{nodes}')
+    generator = DTSGenerator(nodes, args.depth, args.properties, args.overrides,
+                             args.include_depth, args.seed)
+    main_file = generator.generate(corpus_dir)
+    
+    contents = []
+    for filename in sorted(os.listdir(corpus_dir)):
+        with open(os.path.join(corpus_dir, filename), encoding='utf-8') as f:
+            contents.append(f.read())
+    corpus = {
+        'nodes': nodes,
+        'files': len(contents),
+        'lines': sum(content.count('\n') for content in contents),
+        'bytes': sum(len(content) for content in contents),
+    }
+    print(f"Corpus: {corpus['nodes']} nodes, {corpus['files']} file(s), {corpus['lines']} lines")
+    
+    # Quiet visualizer for exports; a resolved tree shared by the export benchmarks
+    tree = resolved_corpus(main_file).root
+    visualizer = DTSVisualizer(tree)
+    visualizer.console = Console(file=io.StringIO())
+    export_file = os.path.join(work_dir, 'export.json')
+    
+    benchmarks = [
+        ('parse', lambda: [DTSParser(content).parse(resolve_references=False) for content in contents], None),
+        ('resolve', lambda multi_parser: multi_parser.resolve_all_references(), lambda: parsed_corpus(main_file)),
+        ('to_dict', tree.to_dict, None),
+        ('export_json', lambda: visualizer.export_json(export_file), None),
+    ]
+    if not args.skip_web:
+        run_web = web_benchmark(corpus_dir)
+        if run_web is not None:
+            benchmarks.append(('api_visualize', run_web, None))
+    
+    results = []
+    for name, run, setup in benchmarks:
+        if args.only and name not in args.only:
+            continue
+        result = {'benchmark': name, **corpus, **measure(run, setup, args.repeat)}
+        result['lines_per_s'] = corpus['lines'] / result['min_s'] if result['min_s'] else None
+        results.append(result)
+        print(f"  {name:<14} min {result['min_s'] * 1000:9.2f} ms   "
+              f"median {result['median_s'] * 1000:9.2f} ms   peak {result['peak_bytes'] / 1024 / 1024:8.2f} MB")
+    return results
+
+def git_commit() -> Optional[str]:
+    """The commit the benchmarks ran on, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(baseline: dict, current: dict, threshold: float) -> bool:
+    """Print the change of every result against a baseline; return False on a regression.
+
+    A result regresses when its minimum time or peak memory grows by more than
+    ``threshold`` (a fraction) over the baseline with the same benchmark and
+    node count.
+    """
+    baseline_results = {(result['benchmark'], result['nodes']): result for result in baseline['results']}
+    print(f"\nComparing against {baseline.get('commit') or 'baseline'}:")
+    ok = True
+    for result in current['results']:
+        key = (result['benchmark'], result['nodes'])
+        if key not in baseline_results:
+            continue
+        old = baseline_results[key]
+        changes = []
+        for metric in ('min_s', 'peak_bytes'):
+            change = (result[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+            regressed = change > threshold
+            ok = ok and not regressed
+            changes.append(f"{metric} {change:+7.1%}{' REGRESSION' if regressed else ''}")
+        print(f"  {key[0]:<14} {key[1]:>8} nodes   " + '   '.join(changes))
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DTS parsing, resolving and exporting")
+    parser.add_argument("--nodes", type=int, nargs='+', default=[1000, 10000], help="Corpus sizes in nodes (default: 1000 10000)")
+    parser.add_argument("--depth", type=int, default=3, help="Maximum nesting of devices (default: 3)")
+    parser.add_argument("--properties", type=int, default=6, help="Properties per device node (default: 6)")
+    parser.add_argument("--overrides", type=float, default=0.1, help="Fraction of devices overridden by &label blocks (default: 0.1)")
+    parser.add_argument("--include-depth", type=int, default=2, help="Length of the .dtsi include chain (default: 2)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed of the generator (default: 1)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark (default: 5)")
+    parser.add_argument("--only", nargs='+', choices=['parse', 'resolve', 'to_dict', 'export_json', 'api_visualize'],
+                        help="Only run these benchmarks")
+    parser.add_argument("--skip-web", action="store_true", help="Skip the /api/visualize benchmark")
+    parser.add_argument("--output", "-o", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare against a results file from an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Allowed slowdown or memory growth over the baseline (default: 0.1, i.e. 10%%)")
+    args = parser.parse_args()
+    
+    report = {
+        'version': RESULTS_VERSION,
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'depth': args.depth,
+            'properties': args.properties,
+            'overrides': args.overrides,
+            'include_depth': args.include_depth,
+            'seed': args.seed,
+            'repeat': args.repeat,
+        },
+        'results': [],
+    }
+    
+    with tempfile.TemporaryDirectory(prefix='dts-bench-') as work_dir:
+        for nodes in args.nodes:
+            report['results'].extend(run_scale(nodes, args, work_dir))
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote results to {args.output}")
+    
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('parameters') != report['parameters']:
+            print("Warning: the baseline was generated with different parameters")
+        if not compare(baseline, report, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
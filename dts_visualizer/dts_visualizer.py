@@ -11,55 +11,634 @@ import re
 import argparse
 from typing import Dict, List, Any, Tuple, Optional
 import os
+import io
 import json
+import hashlib
+import marshal
+import pickle
+import tempfile
+import time
+import ast
+import bisect
+import codecs
+import fnmatch
+import operator
+import mmap
+import struct
+import subprocess
+import threading
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from array import array
+from sys import intern
+from types import MappingProxyType
 from rich.tree import Tree
 from rich.console import Console
 from rich.panel import Panel
+from rich.table import Table
 from rich.syntax import Syntax
 
+# Version of the parse output; part of DTSParseCache keys, bump it when parsing changes
+PARSER_VERSION = 2
+
+# Directives removing what earlier blocks defined. The parser keeps each one as
+# a boolean property named "/delete-node/ <name or &ref>" or
+# "/delete-property/ <name>" on the node it appears in (the file's container
+# node for top-level ones), and DTSTreeMerger applies them.
+DELETE_DIRECTIVES = ('delete-node', 'delete-property')
+_DELETE_PREFIXES = tuple(f"/{directive}/ " for directive in DELETE_DIRECTIVES)
+
+# Shared placeholders returned by DTSNode for containers that were never allocated
+_NO_ITEMS = ()
+_NO_PROPERTIES = MappingProxyType({})
+
 class DTSNode:
-    """Represents a node in the device tree."""
+    """Represents a node in the device tree.
+
+    Nodes are slotted and only allocate their children, properties, labels
+    and references containers once the first item is added; until then the
+    attributes return shared empty placeholders. Node and property names are
+    interned, so the many repeated names (``compatible``, ``reg``, ...) share
+    one string object.
+
+    Property values are kept as raw strings; ``get_typed`` decodes one lazily
+    (see ``decode_property_value``) and caches the result per property.
+    ``subtree_hash`` likewise caches a hash of the node's whole subtree.
+    """
+    __slots__ = ('name', 'parent', '_children', '_properties', '_labels', '_references', '_typed', '_hash')
+
     def __init__(self, name: str, parent=None):
-        self.name = name
+        self.name = intern(name)
         self.parent = parent
-        self.children = []
-        self.properties = {}
-        self.labels = []
-        self.references = []  # References created with &name
+        self._children = None
+        self._properties = None
+        self._labels = None
+        self._references = None  # References created with &name
+        self._typed = None  # Decoded property values, filled by get_typed
+        self._hash = None  # Subtree hash, filled by subtree_hash
+
+    @property
+    def children(self):
+        return self._children if self._children is not None else _NO_ITEMS
+
+    @children.setter
+    def children(self, children):
+        self._children = list(children) or None
+        self._clear_hash()
+
+    @property
+    def properties(self):
+        return self._properties if self._properties is not None else _NO_PROPERTIES
+
+    @properties.setter
+    def properties(self, properties):
+        self._properties = {intern(name): value for name, value in properties.items()} or None
+        self._typed = None
+        self._clear_hash()
+
+    @property
+    def labels(self):
+        return self._labels if self._labels is not None else _NO_ITEMS
+
+    @labels.setter
+    def labels(self, labels):
+        self._labels = list(labels) or None
+        self._clear_hash()
+
+    @property
+    def references(self):
+        return self._references if self._references is not None else _NO_ITEMS
+
+    @references.setter
+    def references(self, references):
+        self._references = list(references) or None
+        self._clear_hash()
         
     def add_child(self, child: 'DTSNode'):
         """Add a child node to this node."""
-        self.children.append(child)
+        if self._children is None:
+            self._children = [child]
+        else:
+            self._children.append(child)
+        if self._hash is not None:
+            self._clear_hash()
         
     def add_property(self, name: str, value):
         """Add a property to this node."""
-        self.properties[name] = value
+        if self._properties is None:
+            self._properties = {}
+        self._properties[intern(name)] = value
+        if self._typed is not None:
+            self._typed.pop(name, None)
+        if self._hash is not None:
+            self._clear_hash()
+        
+    def remove_property(self, name: str):
+        """Remove a property from this node, if it has it."""
+        if self._properties is None or name not in self._properties:
+            return
+        del self._properties[name]
+        if self._typed is not None:
+            self._typed.pop(name, None)
+        if self._hash is not None:
+            self._clear_hash()
+        
+    def remove_child(self, child: 'DTSNode'):
+        """Remove a child node from this node."""
+        self._children = [node for node in self.children if node is not child] or None
+        if self._hash is not None:
+            self._clear_hash()
         
     def add_label(self, label: str):
         """Add a label to this node."""
-        self.labels.append(label)
+        if self._labels is None:
+            self._labels = [label]
+        else:
+            self._labels.append(label)
+        if self._hash is not None:
+            self._clear_hash()
         
     def add_reference(self, reference: str):
         """Add a reference (using &name syntax) to this node."""
-        self.references.append(reference)
+        if self._references is None:
+            self._references = [reference]
+        else:
+            self._references.append(reference)
+        if self._hash is not None:
+            self._clear_hash()
         
+    def get_typed(self, name: str):
+        """Return the decoded value of a property, decoding it on first access."""
+        if self._typed is None:
+            self._typed = {}
+        elif name in self._typed:
+            return self._typed[name]
+        value = self._typed[name] = decode_property_value(self.properties[name])
+        return value
+    
+    def typed_properties(self):
+        """Iterate over (name, decoded value) pairs for all properties."""
+        for name in self.properties:
+            yield name, self.get_typed(name)
+        
+    def subtree_hash(self) -> bytes:
+        """Return a Merkle hash of this node: its name, labels, references,
+        properties and the hashes of its children.
+
+        Equal hashes mean equal subtrees, whatever order their properties and
+        children are in. Hashes are computed bottom-up on first use and cached
+        on every node of the subtree, so comparing against the same tree again
+        only hashes what changed. Changes made through this class clear the
+        cached hash of the node and its ancestors; children shared by several
+        parents (see ``DTSParser._resolve_references``) only clear the
+        ancestors along ``parent``.
+        """
+        stack = [(self, False)]
+        while stack:
+            node, ready = stack.pop()
+            if node._hash is not None:
+                continue
+            if not ready:
+                stack.append((node, True))
+                stack.extend([(child, False) for child in node.children if child._hash is None])
+                continue
+            # marshal writes binary (memoryview) values as bytes
+            children = node.children
+            fields = (
+                node.name,
+                sorted(node.labels),
+                list(node.references),
+                sorted(node.properties.items()),
+                sorted([child._hash for child in children]) if children else None,
+            )
+            node._hash = hashlib.blake2b(marshal.dumps(fields), digest_size=16).digest()
+        return self._hash
+    
+    def _clear_hash(self):
+        """Drop the cached subtree hashes of this node and its ancestors."""
+        node = self
+        while node is not None and node._hash is not None:
+            node._hash = None
+            node = node.parent
+    
     def __str__(self):
         return self.name
     
     def to_dict(self):
         """Convert node to dictionary for JSON export."""
-        result = {
+        result = self._to_dict_entry()
+        # Walk iteratively so deep trees do not hit the recursion limit
+        stack = [(self, result)]
+        while stack:
+            node, entry = stack.pop()
+            for child in node.children:
+                child_entry = child._to_dict_entry()
+                entry["children"].append(child_entry)
+                stack.append((child, child_entry))
+        return result
+    
+    def _to_dict_entry(self):
+        """Dictionary for this node alone, with an empty children list."""
+        return {
             "name": self.name,
-            "labels": self.labels,
-            "references": self.references,
-            "properties": self.properties,
-            "children": [child.to_dict() for child in self.children]
+            "labels": self._labels if self._labels is not None else [],
+            "references": self._references if self._references is not None else [],
+            "properties": display_properties(self._properties) if self._properties is not None else {},
+            "children": []
         }
-        return result
+
+def iter_json(root: DTSNode, indent: Optional[int] = 2, chunk_size: int = 65536, links=None):
+    """Yield the JSON encoding of a tree in chunks of roughly chunk_size characters.
+
+    The output matches ``json.dumps(root.to_dict(), indent=indent)``; with
+    ``indent=None`` it is compact (no whitespace at all). ``links``, a
+    function returning a JSON-ready list for a node (such as
+    ``DTSReferenceGraph.describe_links``), adds that list to every node as
+    ``"links"``. The tree is walked
+    iteratively, so deep trees do not hit the recursion limit and memory
+    stays proportional to the depth of the tree rather than its size.
+    """
+    if indent is None:
+        separators = (',', ':')
+        pads = None
+    else:
+        separators = (',', ': ')
+        pads = ['\n']  # pads[level] is the newline and indentation for a level
+    item_sep, key_sep = separators
+    dumps = json.dumps
+    
+    def pad(level):
+        if pads is None:
+            return ''
+        while len(pads) <= level:
+            pads.append('\n' + ' ' * (indent * len(pads)))
+        return pads[level]
+    
+    def encode(value, level):
+        text = dumps(value, indent=indent, separators=separators)
+        return text.replace('\n', pad(level)) if pads is not None and '\n' in text else text
+    
+    def open_node(node, level):
+        # Everything up to and including the '[' that opens the children
+        inner = pad(level + 1)
+        return ('{' + inner + '"name"' + key_sep + dumps(node.name) + item_sep +
+                inner + '"labels"' + key_sep + encode(list(node.labels), level + 1) + item_sep +
+                inner + '"references"' + key_sep + encode(list(node.references), level + 1) + item_sep +
+                inner + '"properties"' + key_sep + encode(dict(display_properties(node.properties)), level + 1) + item_sep +
+                (inner + '"links"' + key_sep + encode(links(node), level + 1) + item_sep if links is not None else '') +
+                inner + '"children"' + key_sep + '[')
+    
+    buffer = [open_node(root, 0)]
+    size = len(buffer[0])
+    # Each frame: node, level of the node's object, index of the next child
+    stack = [[root, 0, 0]]
+    while stack:
+        frame = stack[-1]
+        node, level, index = frame
+        children = node.children
+        if index == len(children):
+            stack.pop()
+            chunk = (pad(level + 1) + ']' if children else ']') + pad(level) + '}'
+        else:
+            child = children[index]
+            frame[2] = index + 1
+            chunk = (item_sep if index else '') + pad(level + 2) + open_node(child, level + 2)
+            stack.append([child, level + 2, 0])
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+class DTSMetrics:
+    """Phase timers and counters for parsing, resolving and exporting trees.
+
+    Phases accumulate wall-clock seconds and a call count; counters are
+    plain totals (nodes, properties, references resolved, bytes in and out).
+    Pass one instance to the parsers and visualizers to profile; they skip
+    all bookkeeping when none is given. Updates are thread-safe, so a
+    long-running server can share one instance between requests.
+    """
+    def __init__(self):
+        self.phases = {}    # phase -> [seconds, calls]
+        self.counters = {}  # counter -> total
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def phase(self, name: str):
+        """Time the enclosed block as one call of a phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+    
+    def add_phase(self, name: str, seconds: float, calls: int = 1):
+        """Record time spent in a phase."""
+        with self._lock:
+            entry = self.phases.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+    
+    def count(self, name: str, amount: int = 1):
+        """Add to a counter."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+    
+    def count_tree(self, root: DTSNode):
+        """Count the nodes and properties of a freshly parsed tree."""
+        nodes = properties = 0
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            nodes += 1
+            properties += len(node.properties)
+            stack.extend(node.children)
+        self.count('nodes', nodes)
+        self.count('properties', properties)
+    
+    def time_chunks(self, name: str, chunks, counter: Optional[str] = 'bytes_out'):
+        """Pass chunks through, timing how long they take to produce and counting their size.
+
+        Only the time spent producing chunks is counted, not the time the
+        consumer spends writing or sending them. With ``counter`` None the
+        size is not counted.
+        """
+        seconds = 0.0
+        size = 0
+        iterator = iter(chunks)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    seconds += time.perf_counter() - start
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.add_phase(name, seconds)
+            if counter is not None:
+                self.count(counter, size)
+    
+    def merge(self, snapshot: Dict[str, Dict[str, Any]]):
+        """Add the phases and counters of a snapshot, e.g. one taken in another process."""
+        for name, phase in snapshot['phases'].items():
+            self.add_phase(name, phase['seconds'], phase['calls'])
+        for name, value in snapshot['counters'].items():
+            self.count(name, value)
+    
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Return a copy of the phases ({name: {'seconds', 'calls'}}) and counters."""
+        with self._lock:
+            return {
+                'phases': {name: {'seconds': seconds, 'calls': calls}
+                           for name, (seconds, calls) in self.phases.items()},
+                'counters': dict(self.counters),
+            }
+
+def _phase(metrics: Optional[DTSMetrics], name: str):
+    """Time a phase when profiling, else do nothing."""
+    return metrics.phase(name) if metrics is not None else nullcontext()
+
+
+# Binary property values that are lists of printable NUL-terminated strings
+_STRING_LIST_RE = re.compile(rb'(?:[\x20-\x7e\t\n\r]+\x00)+')
+
+def _binary_strings(data: bytes) -> Optional[Tuple[str, ...]]:
+    """Return the strings of a NUL-terminated string list, or None if data is not one."""
+    if not _STRING_LIST_RE.fullmatch(data):
+        return None
+    return tuple(data[:-1].decode('ascii').split('\0'))
+
+def _decode_binary(value):
+    """Decode a binary property value the way dtc guesses types when decompiling.
+
+    Empty values are booleans (``True``), lists of printable strings become
+    tuples of ``str``, values whose length is a multiple of four become
+    ``array('I')`` cells and anything else stays ``bytes``.
+    """
+    data = bytes(value)
+    if not data:
+        return True
+    strings = _binary_strings(data)
+    if strings is not None:
+        return strings
+    if len(data) % 4 == 0:
+        cells = array('I', data)
+        if sys.byteorder == 'little':
+            cells.byteswap()
+        return cells
+    return data
+
+def format_property_value(value):
+    """Format a property value for display and JSON export.
+
+    Raw DTS values and booleans are returned unchanged; binary values read
+    from a DTB are written in DTS syntax: a string list, a cell list or a
+    byte string, as ``_decode_binary`` types them.
+    """
+    if isinstance(value, (str, bool)):
+        return value
+    decoded = _decode_binary(value)
+    if decoded is True:
+        return True
+    if isinstance(decoded, tuple):
+        return ', '.join(json.dumps(string) for string in decoded)
+    if isinstance(decoded, array):
+        return '<' + ' '.join(f'0x{cell:x}' for cell in decoded) + '>'
+    return '[' + decoded.hex(' ') + ']'
+
+def display_properties(properties):
+    """Return properties with binary values formatted; the mapping itself if it has none."""
+    for value in properties.values():
+        if not isinstance(value, (str, bool)):
+            return {name: format_property_value(value) for name, value in properties.items()}
+    return properties
+
+
+# Patterns used by decode_property_value
+_VALUE_COMPONENT_RE = re.compile(r'''
+    \s*(?:
+        (?:/bits/\s*(?P<bits>\d+)\s*)?<(?P<cells>[^>]*)>
+      | "(?P<string>(?:\\.|[^"\\])*)"
+      | \[(?P<bytes>[^\]]*)\]
+      | (?P<ref>&\{[^}]*\}|&[\w,.+@-]+)
+    )\s*(?:,|$)
+''', re.VERBOSE)
+_CELL_TOKEN_RE = re.compile(r"&\{[^}]*\}|&[\w,.+@-]+|'(?:\\.|[^'\\])'|\([^()]*(?:\([^()]*\)[^()]*)*\)|[^\s()]+")
+_INT_LITERAL_RE = re.compile(r'(0[xX][0-9a-fA-F]+|0[0-7]*|[1-9][0-9]*)[uUlL]*$')
+_EXPRESSION_LITERAL_RE = re.compile(r"'(?:\\.|[^'\\])'|\b(?:0[xX][0-9a-fA-F]+|0[0-7]*|[1-9][0-9]*)[uUlL]*\b")
+_ARRAY_TYPECODES = {8: 'B', 16: 'H', 32: 'I', 64: 'Q'}
+_EXPRESSION_OPERATORS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod,
+    ast.LShift: lambda a, b: a << b if b < 64 else 0, ast.RShift: operator.rshift,
+    ast.BitAnd: operator.and_, ast.BitOr: operator.or_, ast.BitXor: operator.xor,
+    ast.USub: operator.neg, ast.UAdd: operator.pos, ast.Invert: operator.invert,
+}
+
+def _unescape(text: str) -> str:
+    """Expand the C escape sequences allowed in DTS strings and characters."""
+    if '\\' not in text:
+        return text
+    return codecs.decode(text.encode('latin-1', 'backslashreplace'), 'unicode_escape')
+
+def _evaluate(node) -> int:
+    """Evaluate an integer expression tree with 64-bit wraparound."""
+    if isinstance(node, ast.Constant) and type(node.value) is int:
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in _EXPRESSION_OPERATORS:
+        result = _EXPRESSION_OPERATORS[type(node.op)](_evaluate(node.left), _evaluate(node.right))
+    elif isinstance(node, ast.UnaryOp) and type(node.op) in _EXPRESSION_OPERATORS:
+        result = _EXPRESSION_OPERATORS[type(node.op)](_evaluate(node.operand))
+    else:
+        raise ValueError("unsupported expression")
+    return result & 0xFFFFFFFFFFFFFFFF
+
+def _decode_cell(token: str):
+    """Decode one cell to an int, leaving references and macros as strings."""
+    m = _INT_LITERAL_RE.match(token)
+    if m:
+        literal = m.group(1)
+        return int(literal, 8) if len(literal) > 1 and literal[0] == '0' and literal[1] not in 'xX' else int(literal, 0)
+    if token[0] == "'":
+        return ord(_unescape(token[1:-1]))
+    if token[0] == '(':
+        # Integer expression, e.g. (1 << 4); '/' is integer division in DTS
+        expression = _EXPRESSION_LITERAL_RE.sub(
+            lambda m: str(_decode_cell(m.group(0))), token).replace('/', '//')
+        try:
+            return _evaluate(ast.parse(expression, mode='eval').body)
+        except (SyntaxError, ArithmeticError, ValueError):
+            pass
+    elif token[0] == '-' and _INT_LITERAL_RE.match(token, 1):
+        return -_decode_cell(token[1:])
+    return token
+
+def _decode_cells(cells: str, bits: int):
+    """Decode a cell list to an array, or a tuple if it holds references or macros."""
+    values = [_decode_cell(token) for token in _CELL_TOKEN_RE.findall(cells)]
+    if not all(isinstance(value, int) for value in values):
+        return tuple(values)
+    # Truncate to the cell size as dtc does
+    mask = (1 << bits) - 1
+    return array(_ARRAY_TYPECODES[bits], [value & mask for value in values])
+
+def decode_property_value(value):
+    """Decode a raw property value into typed Python values.
+
+    Cell lists (``<...>``) become ``array('I')`` (or ``'B'``/``'H'``/``'Q'``
+    with ``/bits/``), byte strings (``[...]``) become ``bytes`` and string
+    lists become tuples of ``str``. Adjacent components of the same kind are
+    concatenated, as they are in the compiled tree; mixed values become a
+    tuple of decoded components. Cells holding references or macros are
+    returned as a tuple of ints and strings. Boolean properties stay ``True``
+    and values that cannot be decoded are returned unchanged. Binary values
+    read from a DTB are decoded with ``_decode_binary``.
+    """
+    if isinstance(value, (bytes, memoryview)):
+        return _decode_binary(value)
+    if not isinstance(value, str):
+        return value
+    components = []
+    pos = 0
+    end = len(value)
+    while pos < end:
+        m = _VALUE_COMPONENT_RE.match(value, pos)
+        if not m or m.end() == pos:
+            return value
+        pos = m.end()
+        cells, string, data, ref = m.group('cells', 'string', 'bytes', 'ref')
+        if cells is not None:
+            bits = int(m.group('bits') or 32)
+            if bits not in _ARRAY_TYPECODES:
+                return value
+            components.append(_decode_cells(cells, bits))
+        elif string is not None:
+            components.append(_unescape(string))
+        elif data is not None:
+            try:
+                components.append(bytes.fromhex(data))
+            except ValueError:
+                return value
+        else:
+            components.append(ref)
+    
+    if not components:
+        return value
+    if all(isinstance(component, str) for component in components):
+        return tuple(components)
+    first = components[0]
+    if len(components) == 1:
+        return first
+    if isinstance(first, array) and all(isinstance(component, array) and component.typecode == first.typecode
+                                        for component in components):
+        return array(first.typecode, b''.join(component.tobytes() for component in components))
+    if isinstance(first, bytes) and all(isinstance(component, bytes) for component in components):
+        return b''.join(components)
+    return tuple(components)
+
+# Patterns used by the single-pass DTSParser.parse. _STATEMENT_RE matches one
+# complete statement (with any leading whitespace and comments) per call; the
+# remaining patterns cover the rarer constructs it hands off as "other".
+_VALUE_PATTERN = r'''(?:[^;"'/]+|"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|/(?![*/]))*'''
+_STATEMENT_RE = re.compile(r'''
+    (?:\s+|/\*.*?\*/|//[^\n]*)*
+    (?:
+        (?P<close>\})(?:\s*;)?
+      | (?P<labels>(?:[A-Za-z_]\w*\s*:\s*)*)
+        (?:
+            (?P<prop>[\w,.+@\#?-]+)\s*=(?P<value>''' + _VALUE_PATTERN + r''')(?P<semi>;)?
+          | (?:&\{(?P<path_ref>[^}]*)\}|(?P<ref>&)?(?P<node>[\w,.+@/\#?-]+))\s*\{
+          | (?P<boolean>[\w,.+@\#?-]+)\s*;
+        )
+      | (?P<other>\S|\Z)
+    )
+''', re.VERBOSE | re.DOTALL)
+_SKIP_RE = re.compile(r'(?:\s+|/\*.*?\*/|//[^\n]*)+', re.DOTALL)
+_COMMENT_RE = re.compile(r'/\*.*?\*/|//[^\n]*', re.DOTALL)
+_DIRECTIVE_RE = re.compile(
+    r'#[ \t]*(include|define|undef|if|ifdef|ifndef|elif|else|endif|error|warning|pragma|line)'
+    r'(?![\w-])((?:\\\n|[^\n])*)')
+_INCLUDE_ARG_RE = re.compile(r'\s*"([^"]+)"')
+_KEYWORD_RE = re.compile(r'/([a-z0-9-]+)/')
+_STRING_RE = re.compile(r'"((?:\\.|[^"\\])*)"')
+_LABEL_RE = re.compile(r'([A-Za-z_]\w*)\s*:')
+_NAME_RE = re.compile(r'&\{([^}]*)\}|(&)?([\w,.+@/#?-]+)')
+_INCLUSION_RE = re.compile(r'<\s*&(\w+)\s*>\s*;')
+_DELETE_ARG_RE = re.compile(r'(&\{[^}]*\}|&?[\w,.+@#?-]+)\s*;')
+_VALUE_RE = re.compile(_VALUE_PATTERN)
+_LINE_BREAK_RE = re.compile(r'\s*\n\s*')
+_SYNC_RE = re.compile(r'[;{}]')
+
+def _skip_statement(text: str, pos: int) -> int:
+    """Skip an unrecognised statement, including any braced block it opens."""
+    depth = 0
+    for m in _SYNC_RE.finditer(text, pos):
+        c = m.group()
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            if depth == 0:
+                return m.start()
+            depth -= 1
+            if depth == 0:
+                return m.end()
+        elif depth == 0:
+            return m.end()
+    return len(text)
 
 class DTSParser:
     """Parser for DTS files."""
-    def __init__(self, content: str, references=None, includes=None):
+    def __init__(self, content: str, references=None, includes=None, overlays=None,
+                 metrics: Optional[DTSMetrics] = None):
         self.content = content
         self.root = DTSNode("root")
         self.current_node = self.root
@@ -67,185 +646,1951 @@ class DTSParser:
         self.references = references or {}  
         # Initialize or use provided includes dictionary
         self.includes = includes or {}
+        # Every &name block in parse order, keyed by reference; shared when provided
+        self.overlays = overlays if overlays is not None else {}
+        # Includes found in this content, in order
+        self.file_includes = []
+        # Optional DTSMetrics to record parse time and counts in
+        self.metrics = metrics
         
-    def parse(self) -> DTSNode:
-        """Parse the DTS content and return the root node."""
-        # Remove comments
-        content = re.sub(r'/\*.*?\*/', '', self.content, flags=re.DOTALL)
-        content = re.sub(r'//.*?$', '', content, flags=re.MULTILINE)
-        
-        # Extract includes for potential processing
-        include_pattern = r'^\s*#include\s+"([^"]+)"\s*$'
-        includes = re.finditer(include_pattern, content, re.MULTILINE)
-        for include in includes:
-            include_file = include.group(1)
-            self.includes[include_file] = True
-        
-        # Remove include directives from content for now
-        content = re.sub(include_pattern, '', content, flags=re.MULTILINE)
-        content = re.sub(r'^\s*/dts-v1/;.*$', '', content, flags=re.MULTILINE)
-        
-        # Track node depth
-        depth = 0
-        current_node = self.root
-        node_stack = [current_node]
-        
-        # Process line by line
-        lines = content.split('\n')
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
+    def parse(self, resolve_references: bool = True) -> DTSNode:
+        """Parse the DTS content and return the root node.
+
+        The content is tokenized in a single pass: comments, preprocessor
+        directives and ``/dts-v1/;`` are skipped as they are encountered, so
+        several statements may share a line (``node { prop; };``).
+        """
+        text = self.content
+        match_statement = _STATEMENT_RE.match
+        start = time.perf_counter()
+        
+        # Track open nodes; the root is never popped
+        node_stack = [self.root]
+        
+        pos = 0
+        while True:
+            m = match_statement(text, pos)
+            close, labels, prop, value, semi, path_ref, ref, name, boolean, other = m.groups()
+            pos = m.end()
+            
+            # Handle properties, which may span several lines
+            if prop is not None:
+                if semi is None:
+                    value, pos = self._parse_value_tail(text, pos, value)
+                value = value.strip()
+                if '\n' in value:
+                    value = _LINE_BREAK_RE.sub(' ', value)
+                node_stack[-1].add_property(prop, value)
             
-            if not line:
-                i += 1
-                continue
-                
             # Handle node opening with possible reference
-            node_match = re.match(r'([a-zA-Z0-9_,+.:-]+:)?\s*(&)?([a-zA-Z0-9_,@.+/-]+)\s*{', line)
-            if node_match:
-                label = node_match.group(1)
-                is_reference = node_match.group(2) is not None
-                name = node_match.group(3)
-                
-                # Create new node
-                new_node = DTSNode(name, current_node)
-                if label:
-                    new_node.add_label(label.rstrip(':'))
-                
-                # Handle reference (&name)
-                if is_reference:
-                    new_node.add_reference('&' + name)
-                    self.references['&' + name] = new_node
-                
-                current_node.add_child(new_node)
-                current_node = new_node
-                node_stack.append(current_node)
-                depth += 1
+            elif name is not None:
+                self._open_node(node_stack, _LABEL_RE.findall(labels) if labels else (),
+                                name, '&' + name if ref else None)
             
-            # Handle node additions/inclusions with <&name> syntax
-            elif re.match(r'\s*<&[a-zA-Z0-9_]+>\s*;', line):
-                ref_match = re.search(r'<&([a-zA-Z0-9_]+)>', line)
-                if ref_match:
-                    ref_name = '&' + ref_match.group(1)
-                    # Store reference to resolve after full parsing
-                    current_node.add_property('__node_inclusion__', ref_name)
-                
-            # Handle properties
-            elif ':' in line and '{' not in line:
-                parts = line.split('=', 1)
-                if len(parts) == 2:
-                    prop_name = parts[0].strip().rstrip(':')
-                    prop_value = parts[1].strip().rstrip(';')
-                    current_node.add_property(prop_name, prop_value)
-                else:
-                    # Handle boolean properties
-                    prop_name = line.strip().rstrip(';').rstrip(':')
-                    current_node.add_property(prop_name, True)
+            # Handle node closing
+            elif close is not None:
+                if len(node_stack) > 1:
+                    node_stack.pop()
             
-            # Handle properties with = but no :
-            elif '=' in line and '{' not in line and ';' in line:
-                parts = line.split('=', 1)
-                prop_name = parts[0].strip()
-                prop_value = parts[1].strip().rstrip(';')
-                current_node.add_property(prop_name, prop_value)
+            # Handle boolean properties
+            elif boolean is not None:
+                node_stack[-1].add_property(boolean, True)
             
-            # Handle node closing
-            elif '}' in line:
-                count = line.count('}')
-                for _ in range(count):
-                    if len(node_stack) > 1:  # Don't pop the root
-                        node_stack.pop()
-                    depth -= 1
-                current_node = node_stack[-1]
+            elif path_ref is not None:
+                self._open_node(node_stack, _LABEL_RE.findall(labels) if labels else (),
+                                path_ref, '&{' + path_ref + '}')
             
-            # Handle multi-line properties
-            elif '=' in line and ';' not in line:
-                # Collect multi-line property
-                prop_parts = line.split('=', 1)
-                prop_name = prop_parts[0].strip()
-                prop_value = prop_parts[1].strip()
-                
-                # Continue collecting until we find a semicolon
-                j = i + 1
-                while j < len(lines) and ';' not in lines[j]:
-                    prop_value += ' ' + lines[j].strip()
-                    j += 1
-                
-                if j < len(lines):
-                    prop_value += ' ' + lines[j].strip().rstrip(';')
-                    i = j  # Skip processed lines
-                
-                current_node.add_property(prop_name, prop_value)
+            elif other:
+                pos = self._parse_other(text, pos - 1, node_stack)
             
-            i += 1
+            else:
+                break
         
-        # We'll still resolve the references for this file
-        # but the MultiFileDTSParser will do a global resolution later
-        self._resolve_references(self.root)
+        self.current_node = node_stack[-1]
+        # The tree holds copies of everything it needs from the source
+        self.content = None
+        if self.metrics is not None:
+            self.metrics.add_phase('parse', time.perf_counter() - start)
+            self.metrics.count_tree(self.root)
+        
+        # MultiFileDTSParser skips this and resolves all files in one global pass
+        if resolve_references:
+            with _phase(self.metrics, 'resolve'):
+                self._resolve_references(self.root)
             
         return self.root
     
-    def _resolve_references(self, node: DTSNode):
-        """Resolve node references recursively."""
-        # Check if this node has inclusions
-        if '__node_inclusion__' in node.properties:
-            ref_name = node.properties['__node_inclusion__']
-            if ref_name in self.references:
-                # Copy properties and children from referenced node
-                ref_node = self.references[ref_name]
-                for prop_name, prop_value in ref_node.properties.items():
-                    if prop_name not in node.properties:
-                        node.add_property(prop_name, prop_value)
-                
-                # Add children from referenced node
-                for child in ref_node.children:
-                    # Create a copy of the child with current node as parent
-                    copy_child = DTSNode(child.name, node)
-                    for label in child.labels:
-                        copy_child.add_label(label)
-                    for ref in child.references:
-                        copy_child.add_reference(ref)
-                    for prop_name, prop_value in child.properties.items():
-                        copy_child.add_property(prop_name, prop_value)
-                    
-                    # Recursively add children
-                    self._copy_children(child, copy_child)
-                    
-                    # Add this copy to current node
-                    node.add_child(copy_child)
+    def _open_node(self, node_stack: List[DTSNode], labels, name: str, reference: Optional[str]):
+        """Create a node below the innermost open node and make it current."""
+        current_node = node_stack[-1]
+        new_node = DTSNode(name, current_node)
+        for label in labels:
+            new_node.add_label(label)
+        
+        # Handle reference (&name)
+        if reference:
+            new_node.add_reference(reference)
+            self.references[reference] = new_node
+            self.overlays.setdefault(reference, []).append(new_node)
+        
+        current_node.add_child(new_node)
+        node_stack.append(new_node)
+    
+    def _parse_value_tail(self, text: str, pos: int, value: str) -> Tuple[str, int]:
+        """Continue a property value interrupted by a comment, up to its ';'."""
+        parts = [value]
+        end = len(text)
+        while pos < end:
+            c = text[pos]
+            if c == ';':
+                return ''.join(parts), pos + 1
+            m = _COMMENT_RE.match(text, pos)
+            if m:
+                pos = m.end()
+            else:
+                # Unterminated quote or comment
+                parts.append(c)
+                pos += 1
+            m = _VALUE_RE.match(text, pos)
+            parts.append(m.group())
+            pos = m.end()
+        return ''.join(parts), pos
+    
+    def _parse_other(self, text: str, pos: int, node_stack: List[DTSNode]) -> int:
+        """Handle a statement _STATEMENT_RE does not match, returning the new position."""
+        c = text[pos]
+        
+        # Handle preprocessor directives, recording includes
+        if c == '#':
+            m = _DIRECTIVE_RE.match(text, pos)
+            if m:
+                if m.group(1) == 'include':
+                    include = _INCLUDE_ARG_RE.match(m.group(2))
+                    if include:
+                        self._add_include(include.group(1))
+                return m.end()
+        
+        # Handle node additions/inclusions with <&name> syntax
+        elif c == '<':
+            m = _INCLUSION_RE.match(text, pos)
+            if m:
+                # Store reference to resolve after full parsing
+                node_stack[-1].add_property('__node_inclusion__', '&' + m.group(1))
+                return m.end()
+        
+        # Handle /keyword/ directives (/dts-v1/, /include/, /delete-node/, ...)
+        elif c == '/':
+            m = _KEYWORD_RE.match(text, pos)
+            if m:
+                keyword = m.group(1)
+                pos = self._skip(text, m.end())
+                if keyword == 'include':
+                    include = _STRING_RE.match(text, pos)
+                    if include:
+                        self._add_include(include.group(1))
+                        return include.end()
+                elif keyword == 'omit-if-no-ref':
+                    # Prefix of the node that follows
+                    return pos
+                elif keyword in DELETE_DIRECTIVES:
+                    # Kept as a marker property, applied in order by DTSTreeMerger
+                    argument = _DELETE_ARG_RE.match(text, pos)
+                    if argument:
+                        node_stack[-1].add_property(f"/{keyword}/ {argument.group(1)}", True)
+                        return argument.end()
+                return _skip_statement(text, pos)
+        
+        # Labels, names and '{' / '=' separated by comments
+        labels = []
+        m = _LABEL_RE.match(text, pos)
+        while m:
+            labels.append(m.group(1))
+            pos = self._skip(text, m.end())
+            m = _LABEL_RE.match(text, pos)
+        
+        m = _NAME_RE.match(text, pos)
+        if not m:
+            return _skip_statement(text, pos)
+        path_ref, ref, name = m.groups()
+        pos = self._skip(text, m.end())
+        c = text[pos:pos + 1]
+        
+        if c == '{':
+            if path_ref is not None:
+                self._open_node(node_stack, labels, path_ref, '&{' + path_ref + '}')
+            else:
+                self._open_node(node_stack, labels, name, '&' + name if ref else None)
+            return pos + 1
+        elif c == '=':
+            m = _VALUE_RE.match(text, pos + 1)
+            value, pos = self._parse_value_tail(text, m.end(), m.group())
+            value = _LINE_BREAK_RE.sub(' ', value.strip())
+            node_stack[-1].add_property(name, value)
+            return pos
+        elif c == ';':
+            node_stack[-1].add_property(name, True)
+            return pos + 1
+        return _skip_statement(text, pos)
+    
+    def _add_include(self, include_file: str):
+        """Record an include directive."""
+        self.includes[include_file] = True
+        self.file_includes.append(include_file)
+    
+    @staticmethod
+    def _skip(text: str, pos: int) -> int:
+        """Skip whitespace and comments."""
+        m = _SKIP_RE.match(text, pos)
+        return m.end() if m else pos
+    
+    def _resolve_references(self, node: DTSNode, resolved: Optional[set] = None):
+        """Resolve <&name> node inclusions in a tree without copying subtrees.
+
+        An including node takes the properties it does not set itself from
+        every ``&name`` block (later blocks win) and shares their children, so
+        an included subtree is referenced from several places rather than
+        duplicated. ``resolved`` holds the ids of nodes already visited; pass
+        the same set to resolve several trees that share subtrees in one pass.
+
+        Shared children keep the ``parent`` of the block that defines them, so
+        walking parents from one gives its defining location, not the path it
+        is reached by; the indexes work out paths top-down instead. An
+        inclusion that would place a node inside itself is skipped with a
+        warning, keeping the tree acyclic.
+        """
+        if resolved is None:
+            resolved = set()
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if id(node) in resolved:
+                continue
+            resolved.add(id(node))
+            if '__node_inclusion__' in node.properties:
+                self._resolve_inclusion(node)
+            stack.extend(node.children)
+    
+    def _resolve_inclusion(self, node: DTSNode):
+        """Merge the blocks named by a node's <&name> inclusion into the node."""
+        ref_name = node.properties['__node_inclusion__']
+        
+        # Remove the temporary property first, so inclusion cycles terminate
+        del node.properties['__node_inclusion__']
+        
+        blocks = self.overlays.get(ref_name)
+        if not blocks:
+            blocks = [self.references[ref_name]] if ref_name in self.references else []
+        if self.metrics is not None:
+            self.metrics.count('references_resolved' if blocks else 'references_unresolved')
+        for block in blocks:
+            # Blocks may include other blocks themselves
+            if '__node_inclusion__' in block.properties:
+                self._resolve_inclusion(block)
+        if any(self._contains(block, node) for block in blocks):
+            print(f"Warning: <{ref_name}> in node {node.name} would include the node in itself, skipped")
+            return
+        
+        for block in reversed(blocks):
+            for prop_name, prop_value in block.properties.items():
+                if prop_name not in node.properties:
+                    node.add_property(prop_name, prop_value)
+        for block in blocks:
+            for child in block.children:
+                node.add_child(child)
+    
+    @staticmethod
+    def _contains(root: DTSNode, node: DTSNode) -> bool:
+        """Whether node is root or reachable from it through children, shared ones included."""
+        seen = set()
+        stack = [root]
+        while stack:
+            current = stack.pop()
+            if current is node:
+                return True
+            if id(current) not in seen:
+                seen.add(id(current))
+                stack.extend(current.children)
+        return False
+
+# Patterns used by DTSPreprocessor
+_PP_DIRECTIVE_RE = re.compile(
+    r'^[ \t]*#[ \t]*(include|define|undef|if|ifdef|ifndef|elif|else|endif|error|warning|pragma|line)'
+    r'(?![\w-])[ \t]*([^\n]*)', re.MULTILINE)
+_PP_COMMENT_RE = re.compile(r'''"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|(/\*.*?\*/|//[^\n]*)''', re.DOTALL)
+_PP_LITERAL_PATTERN = r'"(?:\\.|[^"\\\n])*"' r"|'(?:\\.|[^'\\\n])*'"
+_PP_NAME_RE = re.compile(r'[A-Za-z_]\w*')
+_PP_BODY_TOKEN_RE = re.compile(r'''"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|\.?\d(?:[eEpP][+-]|[\w.])*|[A-Za-z_]\w*|##|\s+|.''', re.DOTALL)
+_PP_DEFINE_RE = re.compile(r'([A-Za-z_]\w*)(?:\(([^)]*)\))?(.*)', re.DOTALL)
+_PP_ARGUMENT_RE = re.compile(r'''"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|[(),]''')
+_PP_INCLUDE_RE = re.compile(r'"([^"]+)"|<([^>]+)>')
+_PP_DEFINED_RE = re.compile(r'\bdefined\s*(?:\(\s*([A-Za-z_]\w*)\s*\)|([A-Za-z_]\w*))')
+_PP_EXPRESSION_TOKEN_RE = re.compile(
+    r"\s*(?:(0[xX][0-9a-fA-F]+|\d+)[uUlL]*|'((?:\\.|[^'\\])+)'|([A-Za-z_]\w*)"
+    r"|(\|\||&&|==|!=|<=|>=|<<|>>|[-+*/%<>&|^!~?:()]))")
+_PP_BINARY_PRECEDENCE = {
+    '||': 1, '&&': 2, '|': 3, '^': 4, '&': 5, '==': 6, '!=': 6,
+    '<': 7, '>': 7, '<=': 7, '>=': 7, '<<': 8, '>>': 8, '+': 9, '-': 9, '*': 10, '/': 10, '%': 10,
+}
+
+def _pp_arguments(text: str, pos: int) -> Tuple[Optional[List[str]], int]:
+    """Split the arguments of a function-like macro call starting at pos.
+
+    Returns the stripped arguments and the position after the closing
+    parenthesis, or None if no argument list follows.
+    """
+    m = _SKIP_RE.match(text, pos)
+    if m:
+        pos = m.end()
+    if text[pos:pos + 1] != '(':
+        return None, pos
+    args = []
+    depth = 0
+    start = pos + 1
+    for m in _PP_ARGUMENT_RE.finditer(text, pos):
+        c = m.group()
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                args.append(text[start:m.start()].strip())
+                return args, m.end()
+        elif c == ',' and depth == 1:
+            args.append(text[start:m.start()].strip())
+            start = m.end()
+    return None, pos
+
+def _pp_evaluate(expression: str) -> int:
+    """Evaluate a macro-expanded #if expression; unknown identifiers are 0."""
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        m = _PP_EXPRESSION_TOKEN_RE.match(expression, pos)
+        if not m or m.end() == pos:
+            raise ValueError(f"unexpected {expression[pos:]!r}")
+        pos = m.end()
+        number, char, name, op = m.groups()
+        if number is not None:
+            tokens.append(int(number, 8) if len(number) > 1 and number[0] == '0' and number[1] not in 'xX'
+                          else int(number, 0))
+        elif char is not None:
+            tokens.append(ord(_unescape(char)[0]))
+        elif name is not None:
+            tokens.append(0)
+        else:
+            tokens.append(op)
+    tokens.append(None)
+    index = 0
+    
+    def unary() -> int:
+        nonlocal index
+        token = tokens[index]
+        index += 1
+        if token == '(':
+            value = ternary()
+            if tokens[index] != ')':
+                raise ValueError("missing ')'")
+            index += 1
+            return value
+        if token == '!':
+            return int(not unary())
+        if token == '~':
+            return ~unary()
+        if token == '-':
+            return -unary()
+        if token == '+':
+            return unary()
+        if isinstance(token, int):
+            return token
+        raise ValueError(f"unexpected {token!r}")
+    
+    def binary(level: int) -> int:
+        nonlocal index
+        left = unary()
+        while True:
+            op = tokens[index]
+            precedence = _PP_BINARY_PRECEDENCE.get(op) if isinstance(op, str) else None
+            if precedence is None or precedence < level:
+                return left
+            index += 1
+            right = binary(precedence + 1)
+            if op in ('/', '%'):
+                if right == 0:
+                    raise ValueError("division by zero")
+                quotient = abs(left) // abs(right) * (1 if (left < 0) == (right < 0) else -1)
+                left = quotient if op == '/' else left - quotient * right
+            elif op in ('&&', '||'):
+                left = int(bool(left) and bool(right)) if op == '&&' else int(bool(left) or bool(right))
+            elif op in ('==', '!=', '<', '>', '<=', '>='):
+                left = int(_PP_COMPARISONS[op](left, right))
+            else:
+                left = _EXPRESSION_OPERATORS[_PP_ARITHMETIC[op]](left, right)
+    
+    def ternary() -> int:
+        nonlocal index
+        condition = binary(1)
+        if tokens[index] != '?':
+            return condition
+        index += 1
+        if_true = ternary()
+        if tokens[index] != ':':
+            raise ValueError("missing ':'")
+        index += 1
+        if_false = ternary()
+        return if_true if condition else if_false
+    
+    value = ternary()
+    if tokens[index] is not None:
+        raise ValueError(f"unexpected {tokens[index]!r}")
+    return value
+
+_PP_COMPARISONS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '>': operator.gt,
+                   '<=': operator.le, '>=': operator.ge}
+_PP_ARITHMETIC = {'|': ast.BitOr, '^': ast.BitXor, '&': ast.BitAnd, '<<': ast.LShift, '>>': ast.RShift,
+                  '+': ast.Add, '-': ast.Sub, '*': ast.Mult}
+
+class _PreprocessedFile:
+    """The memoised result of preprocessing one file in one macro environment."""
+    __slots__ = ('content', 'deps', 'effect', 'text', 'sources', 'headers', 'files')
+    
+    def __init__(self, content: str):
+        self.content = content  # Source it was produced from
+        self.deps = {}          # Macro name -> definition it had to have (None: undefined)
+        self.effect = {}        # Macro name -> definition left behind (None: undefined)
+        self.text = ''          # Output with directives removed and macros expanded
+        self.sources = []       # Included files holding DTS content
+        self.headers = []       # Included files holding only directives
+        self.files = set()      # Every file included, directly or not
+
+class DTSPreprocessor:
+    """C preprocessor for DTS sources, as kernel builds run cpp before dtc.
+
+    Handles ``#include "..."`` (searched next to the including file, then in
+    ``include_dirs``) and ``#include <...>`` (``include_dirs`` only),
+    object-like and function-like ``#define`` (with ``#`` and ``##``),
+    ``#undef`` and ``#if``/``#ifdef``/``#ifndef``/``#elif``/``#else``/
+    ``#endif``. ``defines`` are ``NAME`` or ``NAME=VALUE`` strings, as for
+    ``cpp -D``. DTS lines starting with ``#`` (``#address-cells``) are left
+    alone. ``read_file`` and ``exists`` let a caller supply files from
+    elsewhere than the file system; files are read once, until
+    ``invalidate`` is called for them.
+
+    Included files are preprocessed where they are included, but each one
+    is kept as a file of its own: ``preprocess`` returns a file's own text
+    and the included files with DTS content separately from headers
+    holding only directives. Every result is memoised together with the
+    macros it read, so a header is processed once per run and reused by
+    every includer seeing the same definitions of those macros.
+    """
+    def __init__(self, include_dirs=(), defines=(), read_file=None, exists=None,
+                 metrics: Optional[DTSMetrics] = None):
+        self.include_dirs = list(include_dirs)
+        self.defines = {}
+        for define in defines:
+            name, _, value = define.partition('=')
+            self._define(self.defines, f"{name} {value or '1'}")
+        self.read_file = read_file or self._read_file
+        self.exists = exists or os.path.isfile
+        self.metrics = metrics  # Optional DTSMetrics to count processed and reused files in
+        self._contents = {}     # path -> decoded content
+        self._memo = {}         # path -> [_PreprocessedFile]
+        self._entry_envs = {}   # path -> macros where the file was last included
+    
+    def preprocess(self, filepath: str, content: str) -> Tuple[str, List[str], List[str]]:
+        """Preprocess one file; return its text, included DTS files and included headers.
+
+        A file that was included by a file processed earlier starts with the
+        macros defined at that point, otherwise with ``defines``.
+        """
+        filepath = os.path.normpath(filepath)
+        self._contents[filepath] = content
+        macros = dict(self._entry_envs.get(filepath, self.defines))
+        result = self._process(filepath, content, macros, set())
+        return result.text, result.sources, result.headers
+    
+    def invalidate(self, paths):
+        """Forget changed files and every result that included them, so they are read again."""
+        changed = {os.path.normpath(path) for path in paths}
+        for path in changed:
+            self._contents.pop(path, None)
+            self._memo.pop(path, None)
+        for path, results in self._memo.items():
+            results[:] = [result for result in results if result.files.isdisjoint(changed)]
+    
+    @staticmethod
+    def _read_file(filepath: str) -> Optional[str]:
+        """Return a file's text, or None if it cannot be read."""
+        try:
+            with open(filepath, encoding='utf-8', errors='replace') as f:
+                return f.read()
+        except OSError:
+            return None
+    
+    def _process(self, filepath: str, content: str, macros: dict, active_files: set) -> _PreprocessedFile:
+        """Preprocess a file with the given macros, updating them with its definitions."""
+        for result in self._memo.get(filepath, ()):
+            if result.content is content or result.content == content:
+                if all(macros.get(name) == definition for name, definition in result.deps.items()):
+                    self._apply(macros, result.effect)
+                    if self.metrics is not None:
+                        self.metrics.count('preprocess_reused')
+                    return result
+        
+        result = _PreprocessedFile(content)
+        deps = result.deps
+        defined = set()  # Names (re)defined or undefined by this file and its includes
+        
+        def lookup(name):
+            if name not in defined and name not in deps:
+                deps[name] = macros.get(name)
+            return macros.get(name)
+        
+        expansions = {}  # Memoised expansions, valid until the macros change
+        active_files.add(filepath)
+        base_dir = os.path.dirname(filepath)
+        
+        # Join continued lines and blank out comments
+        text = content.replace('\\\r\n', '').replace('\\\n', '')
+        if '/*' in text or '//' in text:
+            text = _PP_COMMENT_RE.sub(lambda m: m.group() if m.group(1) is None else ' ' + '\n' * m.group(1).count('\n'),
+                                      text)
+        # Expand the text between directives; directive lines and skipped text become empty lines
+        output = []
+        conditions = []  # [enclosing block active, branch taken] per open #if
+        active = True
+        pos = 0
+        for m in _PP_DIRECTIVE_RE.finditer(text):
+            chunk = text[pos:m.start()]
+            output.append(self._expand(chunk, lookup, expansions) if active else '\n' * chunk.count('\n'))
+            pos = m.end()
+            directive, argument = m.groups()
+            argument = argument.strip()
             
-            # Remove the temporary property
-            del node.properties['__node_inclusion__']
-        
-        # Process children recursively
-        for child in node.children:
-            self._resolve_references(child)
-    
-    def _copy_children(self, source_node: DTSNode, target_node: DTSNode):
-        """Helper method to recursively copy children from source to target node."""
-        for child in source_node.children:
-            # Create a copy of the child with target node as parent
-            copy_child = DTSNode(child.name, target_node)
-            for label in child.labels:
-                copy_child.add_label(label)
-            for ref in child.references:
-                copy_child.add_reference(ref)
-            for prop_name, prop_value in child.properties.items():
-                copy_child.add_property(prop_name, prop_value)
+            if directive in ('if', 'ifdef', 'ifndef'):
+                condition = active and self._condition(directive, argument, lookup, expansions, filepath)
+                conditions.append([active, condition])
+                active = condition
+            elif directive in ('elif', 'else'):
+                if not conditions:
+                    continue
+                enclosing, taken = conditions[-1]
+                active = enclosing and not taken and (
+                    directive == 'else' or self._condition('if', argument, lookup, expansions, filepath))
+                conditions[-1][1] = taken or active
+            elif directive == 'endif':
+                if conditions:
+                    active = conditions.pop()[0]
+            elif not active:
+                continue
+            elif directive == 'define':
+                defined.add(self._define(macros, argument))
+                expansions.clear()
+            elif directive == 'undef':
+                macros.pop(argument.split()[0] if argument else '', None)
+                defined.add(argument.split()[0] if argument else '')
+                expansions.clear()
+            elif directive == 'include':
+                self._include(argument, base_dir, macros, active_files, result, defined, lookup, expansions)
+                expansions.clear()
+            elif directive in ('error', 'warning'):
+                print(f"Warning: {filepath}: #{directive} {argument}")
+        chunk = text[pos:]
+        output.append(self._expand(chunk, lookup, expansions) if active else '\n' * chunk.count('\n'))
+        
+        active_files.discard(filepath)
+        result.text = ''.join(output)
+        result.effect = {name: macros.get(name) for name in defined}
+        self._memo.setdefault(filepath, []).append(result)
+        if self.metrics is not None:
+            self.metrics.count('preprocessed_files')
+        return result
+    
+    def _include(self, argument: str, base_dir: str, macros: dict, active_files: set,
+                 result: _PreprocessedFile, defined: set, lookup, expansions: dict):
+        """Process an #include directive of the file being preprocessed."""
+        m = _PP_INCLUDE_RE.match(argument)
+        if not m:
+            # Computed include, e.g. #include FILE
+            m = _PP_INCLUDE_RE.match(self._expand(argument, lookup, expansions).strip())
+            if not m:
+                return
+        quoted, system = m.groups()
+        name = quoted or system
+        
+        path = None
+        for directory in ([base_dir] if quoted else []) + self.include_dirs:
+            candidate = os.path.normpath(os.path.join(directory, name))
+            if self.exists(candidate):
+                path = candidate
+                break
+        if path is None:
+            print(f"Warning: Could not find include file {name}")
+            return
+        if path in active_files:
+            # Include cycle; as if guarded
+            return
+        content = self._contents.get(path)
+        if content is None:
+            content = self.read_file(path)
+            if content is None:
+                return
+            if not isinstance(content, str):
+                raw, content = content, str(content, 'utf-8', 'replace')
+                if isinstance(raw, mmap.mmap):
+                    raw.close()
+            self._contents[path] = content
+        
+        entry_macros = dict(macros)
+        included = self._process(path, content, macros, active_files)
+        for name, definition in included.deps.items():
+            if name not in defined and name not in result.deps:
+                result.deps[name] = definition
+        defined.update(included.effect)
+        result.files.add(path)
+        result.files.update(included.files)
+        if included.text.strip() or included.sources:
+            self._entry_envs[path] = entry_macros
+            result.sources.append(path)
+        else:
+            # The headers a header includes are the includer's headers too
+            result.headers.extend(header for header in [path] + included.headers
+                                  if header not in result.headers)
+    
+    def _condition(self, directive: str, argument: str, lookup, expansions: dict, filepath: str) -> bool:
+        """Evaluate the condition of an #if, #ifdef, #ifndef or #elif."""
+        if directive != 'if':
+            name = argument.split()[0] if argument else ''
+            return (lookup(name) is not None) == (directive == 'ifdef')
+        expression = _PP_DEFINED_RE.sub(
+            lambda m: '1' if lookup(m.group(1) or m.group(2)) is not None else '0', argument)
+        try:
+            return bool(_pp_evaluate(self._expand(expression, lookup, expansions)))
+        except ValueError as e:
+            print(f"Warning: {filepath}: cannot evaluate #if {argument}: {e}")
+            return False
+    
+    @staticmethod
+    def _define(macros: dict, argument: str) -> str:
+        """Add a #define to a macro table and return its name."""
+        m = _PP_DEFINE_RE.match(argument)
+        if not m:
+            return ''
+        name, params, body = m.groups()
+        if params is not None:
+            params = tuple(param.strip() for param in params.split(',')) if params.strip() else ()
+        macros[name] = (params, body.strip())
+        return name
+    
+    @staticmethod
+    def _apply(macros: dict, effect: dict):
+        """Apply the definitions a memoised file leaves behind."""
+        for name, definition in effect.items():
+            if definition is None:
+                macros.pop(name, None)
+            else:
+                macros[name] = definition
+    
+    def _expand(self, text: str, lookup, expansions: dict, disabled: frozenset = frozenset()) -> str:
+        """Expand the macros in text; names in ``disabled`` are being expanded already."""
+        # Only stop at the macros the text names, skipping string and character literals
+        names = sorted(name for name in set(_PP_NAME_RE.findall(text))
+                       if name not in disabled and lookup(name) is not None)
+        if not names:
+            return text
+        search = re.compile(_PP_LITERAL_PATTERN + r'|\b(?P<name>' + '|'.join(names) + r')\b').search
+        
+        output = []
+        pos = 0
+        while True:
+            m = search(text, pos)
+            if m is None:
+                break
+            name = m.group('name')
+            if name is None:
+                output.append(text[pos:m.end()])
+                pos = m.end()
+                continue
             
-            # Recursively add children
-            self._copy_children(child, copy_child)
+            params, body = lookup(name)
+            if params is None:
+                key = (name, disabled)
+                end = m.end()
+            else:
+                args, end = _pp_arguments(text, m.end())
+                if args is None:
+                    # A function-like macro's name without arguments is left alone
+                    output.append(text[pos:m.end()])
+                    pos = m.end()
+                    continue
+                key = (name, disabled, tuple(args))
             
-            # Add this copy to target node
-            target_node.add_child(copy_child)
+            replacement = expansions.get(key)
+            if replacement is None:
+                if params is not None:
+                    body = self._substitute(params, body, args, lookup, expansions, disabled)
+                replacement = expansions[key] = self._expand(body, lookup, expansions, disabled | {name})
+            output.append(text[pos:m.start()])
+            output.append(replacement)
+            pos = end
+        output.append(text[pos:])
+        return ''.join(output)
+    
+    def _substitute(self, params: tuple, body: str, args: List[str], lookup, expansions: dict,
+                    disabled: frozenset) -> str:
+        """Replace the parameters of a function-like macro body by its arguments."""
+        if params and params[-1] == '...':
+            values = dict(zip(params[:-1], args))
+            values['__VA_ARGS__'] = ', '.join(args[len(params) - 1:])
+        else:
+            values = dict(zip(params, args))
+        tokens = _PP_BODY_TOKEN_RE.findall(body)
+        
+        def neighbour(index: int, step: int) -> Optional[str]:
+            index += step
+            while 0 <= index < len(tokens) and tokens[index].isspace():
+                index += step
+            return tokens[index] if 0 <= index < len(tokens) else None
+        
+        output = []
+        skip_space = False
+        for index, token in enumerate(tokens):
+            if skip_space and token.isspace():
+                continue
+            skip_space = False
+            if token == '##':
+                while output and output[-1].isspace():
+                    output.pop()
+                skip_space = True
+            elif token == '#' and neighbour(index, 1) in values:
+                skip_space = True
+            elif token in values:
+                if neighbour(index, -1) == '#':
+                    value = values[token]
+                    output.append('"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"')
+                elif '##' in (neighbour(index, -1), neighbour(index, 1)):
+                    output.append(values[token])
+                else:
+                    output.append(self._expand(values[token], lookup, expansions, disabled))
+            else:
+                output.append(token)
+        return ''.join(output)
+
+class DTSTreeIndex:
+    """Lookup tables over parsed trees for O(1) node access.
+
+    Indexes nodes by label, by full path (``/soc/i2c@13460000``), by each
+    ``compatible`` string and by ``phandle``. Nodes below ``&label``
+    override blocks have no path of their own and are left out of the path
+    table. When the same path or label is defined more than once, the last
+    indexed definition wins. Selector queries (see ``DTSQuery``) are answered
+    from a ``DTSQueryIndex`` built on first use, and reference checks from a
+    ``DTSReferenceGraph`` over it.
+    """
+    def __init__(self, root: Optional[DTSNode] = None):
+        self.labels = {}      # label -> node
+        self.paths = {}       # full path -> node
+        self.compatible = {}  # compatible string -> [nodes]
+        self.phandles = {}    # phandle value -> node
+        self.roots = []       # (node, path) of every indexed subtree
+        self._query_index = None
+        self._reference_graph = None
+        if root is not None:
+            self.add_subtree(root)
+    
+    def add_subtree(self, node: DTSNode, path: Optional[str] = None):
+        """Index a node and all of its descendants.
+
+        ``path`` is the full path of ``node``; by default it is worked out
+        from the node's parents.
+        """
+        if path is None:
+            path = _node_path(node)
+        self.roots.append((node, path))
+        stack = [(node, path)]
+        while stack:
+            node, path = stack.pop()
+            self._add(node, path)
+            for child in reversed(node.children):
+                stack.append((child, _child_path(path, child.name)))
+    
+    def add_node(self, parent: DTSNode, node: DTSNode):
+        """Add a node (with its subtree) below parent and index it."""
+        parent.add_child(node)
+        self.add_subtree(node, _child_path(_node_path(parent), node.name))
+    
+    def _add(self, node: DTSNode, path: Optional[str]):
+        """Index a single node."""
+        self._query_index = None
+        self._reference_graph = None
+        if path is not None:
+            self.paths[path] = node
+        for label in node.labels:
+            self.labels[label] = node
+        properties = node.properties
+        if 'compatible' in properties:
+            compatible = decode_property_value(properties['compatible'])
+            if isinstance(compatible, tuple):
+                for name in compatible:
+                    if isinstance(name, str):
+                        self.compatible.setdefault(name, []).append(node)
+        for name in ('phandle', 'linux,phandle'):
+            if name in properties:
+                phandle = decode_property_value(properties[name])
+                if isinstance(phandle, array) and len(phandle) == 1:
+                    self.phandles[phandle[0]] = node
+    
+    def find_label(self, label: str) -> Optional[DTSNode]:
+        """Return the node carrying a label."""
+        return self.labels.get(label)
+    
+    def find_path(self, path: str) -> Optional[DTSNode]:
+        """Return the node at a full path."""
+        return self.paths.get(path)
+    
+    def find_compatible(self, compatible: str) -> List[DTSNode]:
+        """Return all nodes listing a compatible string."""
+        return self.compatible.get(compatible, [])
+    
+    def find_phandle(self, phandle: int) -> Optional[DTSNode]:
+        """Return the node with a phandle value."""
+        return self.phandles.get(phandle)
+    
+    def resolve(self, reference: str) -> Optional[DTSNode]:
+        """Resolve a reference such as ``&label``, ``&{/path}``, ``label`` or ``/path``."""
+        if reference.startswith('&{') and reference.endswith('}'):
+            return self.paths.get(reference[2:-1])
+        reference = reference.lstrip('&')
+        if reference.startswith('/'):
+            return self.paths.get(reference)
+        return self.labels.get(reference)
+    
+    def query(self, selector: str) -> List[DTSNode]:
+        """Return the nodes matching a selector, in document order."""
+        return DTSQuery(selector).run(self.query_index())
+    
+    def query_index(self) -> 'DTSQueryIndex':
+        """Return the tables for selector queries, (re)building them if nodes were added."""
+        if self._query_index is None:
+            self._query_index = DTSQueryIndex(self)
+        return self._query_index
+    
+    def reference_graph(self) -> 'DTSReferenceGraph':
+        """Return the graph of references between nodes, (re)building it if nodes were added."""
+        if self._reference_graph is None:
+            self._reference_graph = DTSReferenceGraph(self.query_index())
+        return self._reference_graph
+
+def _child_path(path: Optional[str], name: str) -> Optional[str]:
+    """Return the full path of a child, or None outside the "/" tree."""
+    if name == '/':
+        return '/'
+    if path is None:
+        return None
+    return path + name if path == '/' else path + '/' + name
+
+def _node_path(node: DTSNode) -> Optional[str]:
+    """Work out the full path of a node from its parents."""
+    names = []
+    while node is not None and node.name != '/':
+        names.append(node.name)
+        node = node.parent
+    if node is None:
+        return None
+    return '/' + '/'.join(reversed(names))
+
+def _glob_regex(pattern: str):
+    """Compile a shell-style glob (``*``, ``?``, ``[...]``) to a regex."""
+    return re.compile(fnmatch.translate(pattern), re.DOTALL)
+
+def _path_regex(pattern: str):
+    """Compile a path glob: ``*`` and ``?`` stay within one node name, ``**`` spans any number."""
+    parts = []
+    for m in re.finditer(r'/\*\*|\*\*|\*|\?|[^*?/]+|/', pattern):
+        token = m.group()
+        if token == '/**':
+            parts.append('(?:/.*)?')
+        elif token == '**':
+            parts.append('.*')
+        elif token == '*':
+            parts.append('[^/]*')
+        elif token == '?':
+            parts.append('[^/]')
+        else:
+            parts.append(re.escape(token))
+    return re.compile(''.join(parts), re.DOTALL)
+
+def _has_magic(pattern: str) -> bool:
+    """Whether a glob holds wildcards."""
+    return any(c in pattern for c in '*?[')
+
+class DTSQueryIndex:
+    """Tables answering ``DTSQuery`` selectors without walking the trees.
+
+    Every node of the "/" trees is entered under its full path. ``&label``
+    and ``&{/path}`` override blocks, and the nodes below them, are entered
+    under the path of the node they reference, and nodes sharing a path are
+    merged as dtc merges them: the first one stands for the path and the
+    properties of later ones override its own, minus those removed with
+    ``/delete-property/``. Nodes removed with ``/delete-node/`` stay in the
+    index; ``DTSTreeMerger`` builds the tree without them. Blocks whose
+    target cannot be found are left out.
+
+    Entries are indexed by sorted path, label, node name, property name and
+    ``compatible`` string, so a query only looks at nodes one of its terms
+    selects. Override blocks left out are kept in ``unplaced``.
+    """
+    def __init__(self, tree_index: DTSTreeIndex):
+        self.nodes = []        # One node per path, in document order
+        self.by_path = {}      # full path -> node
+        self.path_of = {}      # node (including merged ones) -> full path
+        self.overlays = {}     # node -> later nodes merged into it, in order
+        self.order = {}        # node -> position in document order
+        self.labels = {}       # label -> [nodes]
+        self.names = {}        # node name -> [nodes]
+        self.properties = {}   # property name -> [nodes]
+        self.compatible = {}   # compatible string -> [nodes]
+        
+        blocks = []
+        visited = set()
+        for root, path in tree_index.roots:
+            blocks.extend(self._place(root, path, visited))
+        
+        # Place override blocks once their target has a path; blocks may
+        # target labels defined in other blocks, so repeat until none is left
+        while blocks:
+            pending = []
+            for block in blocks:
+                path = self._target_path(tree_index, block)
+                if path is None:
+                    pending.append(block)
+                else:
+                    self._place(block, path, visited)
+            if len(pending) == len(blocks):
+                break
+            blocks = pending
+        self.unplaced = blocks
+        
+        self.paths = sorted(self.by_path)
+        for node in self.nodes:
+            group = [node] + self.overlays.get(node, [])
+            self.names.setdefault(node.name, []).append(node)
+            for label in dict.fromkeys(label for member in group for label in member.labels):
+                self.labels.setdefault(label, []).append(node)
+            for name in self.merged_properties(node):
+                self.properties.setdefault(name, []).append(node)
+            compatible = self.value(node, 'compatible')
+            if isinstance(compatible, tuple):
+                for name in dict.fromkeys(compatible):
+                    if isinstance(name, str):
+                        self.compatible.setdefault(name, []).append(node)
+    
+    def _place(self, node: DTSNode, path: Optional[str], visited: set) -> List[DTSNode]:
+        """Enter a subtree under a path; return the override blocks found outside the "/" tree."""
+        blocks = []
+        stack = [(node, path)]
+        while stack:
+            node, path = stack.pop()
+            if id(node) in visited:
+                continue
+            if path is None:
+                if node.references:
+                    # Placed later, under the path of its target
+                    blocks.append(node)
+                    continue
+            else:
+                visited.add(id(node))
+                self.path_of[node] = path
+                first = self.by_path.get(path)
+                if first is None:
+                    self.by_path[path] = node
+                    self.order[node] = len(self.nodes)
+                    self.nodes.append(node)
+                else:
+                    self.overlays.setdefault(first, []).append(node)
+            for child in reversed(node.children):
+                stack.append((child, _child_path(path, child.name)))
+        return blocks
+    
+    def _target_path(self, tree_index: DTSTreeIndex, block: DTSNode) -> Optional[str]:
+        """Path of the node an override block references, once that node is placed."""
+        for reference in block.references:
+            if reference.startswith('&{') and reference.endswith('}'):
+                if reference[2:-1] in self.by_path:
+                    return reference[2:-1]
+                continue
+            target = tree_index.resolve(reference)
+            if target is not None and target in self.path_of:
+                return self.path_of[target]
+        return None
+    
+    def value(self, node: DTSNode, name: str):
+        """Decoded value of a property after merging, or None if the node lacks it."""
+        deleted = '/delete-property/ ' + name
+        for member in reversed([node] + self.overlays.get(node, [])):
+            if name in member.properties:
+                return member.get_typed(name)
+            if deleted in member.properties:
+                return None
+        return None
+    
+    def merged_properties(self, node: DTSNode) -> Dict[str, Any]:
+        """Raw properties of a node after merging the nodes sharing its path."""
+        properties = {}
+        for member in [node] + self.overlays.get(node, []):
+            for name, value in member.properties.items():
+                if not name.startswith(_DELETE_PREFIXES):
+                    properties[name] = value
+                elif name.startswith('/delete-property/ '):
+                    properties.pop(name.partition(' ')[2], None)
+        return properties
+    
+    def describe(self, node: DTSNode, properties: bool = True) -> Dict[str, Any]:
+        """JSON-ready summary of a matched node: path, name, labels and merged properties."""
+        group = [node] + self.overlays.get(node, [])
+        result = {
+            'path': self.path_of.get(node),
+            'name': node.name,
+            'labels': list(dict.fromkeys(label for member in group for label in member.labels)),
+        }
+        if properties:
+            result['properties'] = dict(display_properties(self.merged_properties(node)))
+        return result
+
+# Terms of the selector language, see DTSQuery
+_QUERY_TERM_RE = re.compile(r'''
+    \s*(?:
+        (?P<path>/[^\s\[]*)
+      | &(?P<label>[^\s\[]+)
+      | \[\s*(?P<prop>[^\s\]!=]+)\s*
+        (?:(?P<op>!?=)\s*(?:"(?P<quoted>(?:\\.|[^"\\])*)"|(?P<value>[^\]]*?)))?\s*\]
+      | (?P<name>[^\s\[&/]+)
+    )\s*
+''', re.VERBOSE)
+
+class DTSQuery:
+    """A compiled selector over parsed trees.
+
+    A selector is a sequence of terms, all of which a node must match:
+
+    - ``/soc/i2c@*`` -- a path glob; ``*`` matches within one node name and
+      ``**`` any number of levels (``/soc/**`` is /soc and everything below)
+    - ``&uart*`` -- a label glob
+    - ``i2c*`` -- a node name glob, tried with and without the unit address
+    - ``[status]`` -- the node has the property (the name may be a glob)
+    - ``[compatible=arm,gic*]`` -- one of the strings of a string list
+      matches the glob; cells and bytes compare by value, so ``[reg=<0x1000 0x100>]``
+      and ``[#address-cells=2]`` work too. Values may be quoted.
+    - ``[status!=okay]`` -- the node has the property and it does not match
+
+    For example ``[compatible=arm,gic*] [status=okay]`` or ``/soc/** &i2c*``.
+    Raises ValueError for a malformed selector.
+    """
+    def __init__(self, selector: str):
+        self.selector = selector
+        self.terms = []  # (kind, key, op, value)
+        if not selector.strip():
+            raise ValueError("Empty query")
+        pos = 0
+        while pos < len(selector):
+            m = _QUERY_TERM_RE.match(selector, pos)
+            if not m or m.end() == pos:
+                raise ValueError(f"Invalid query at position {pos}: {selector[pos:]!r}")
+            pos = m.end()
+            if m.group('path') is not None:
+                self.terms.append(('path', m.group('path'), None, None))
+            elif m.group('label') is not None:
+                self.terms.append(('label', m.group('label'), None, None))
+            elif m.group('prop') is not None:
+                value = m.group('value')
+                if m.group('quoted') is not None:
+                    value = _unescape(m.group('quoted'))
+                self.terms.append(('property', m.group('prop'), m.group('op'), value))
+            elif m.group('name') is not None:
+                self.terms.append(('name', m.group('name'), None, None))
+    
+    def run(self, index: DTSQueryIndex) -> List[DTSNode]:
+        """Return the nodes matching every term, in document order.
+
+        Each term selects its candidates from one of the index tables and
+        the smallest selection is narrowed down by the others. Property
+        values are only compared for the nodes left, and a value term only
+        selects by itself when the query has no other kind of term.
+        """
+        selections = []
+        predicates = []
+        for kind, key, op, value in self.terms:
+            if kind == 'property' and op is not None:
+                if key == 'compatible' and op == '=':
+                    selections.append(self._from_keys(index.compatible, value))
+                    continue
+                names = [key] if not _has_magic(key) else \
+                    [name for name in index.properties if _glob_regex(key).match(name)]
+                predicates.append((names, op == '=', _value_matcher(value)))
+            elif kind == 'property':
+                selections.append(self._from_keys(index.properties, key))
+            elif kind == 'label':
+                selections.append(self._from_keys(index.labels, key))
+            elif kind == 'name':
+                regex = _glob_regex(key)
+                selections.append([node for name, nodes in index.names.items()
+                                   if regex.match(name) or regex.match(name.split('@', 1)[0])
+                                   for node in nodes])
+            else:
+                selections.append(self._from_paths(index, key))
+        if not selections:
+            selections.append([node for name in predicates[0][0] for node in index.properties.get(name, ())])
+        
+        selections.sort(key=len)
+        matches = list(dict.fromkeys(selections[0]))
+        for selection in selections[1:]:
+            if not matches:
+                break
+            selected = set(selection)
+            matches = [node for node in matches if node in selected]
+        for names, wanted, value_matches in predicates:
+            matches = [node for node in matches
+                       if any(value is not None and value_matches(value) == wanted
+                              for value in (index.value(node, name) for name in names))]
+        matches.sort(key=index.order.__getitem__)
+        return matches
+    
+    @staticmethod
+    def _from_keys(table: Dict[str, List[DTSNode]], pattern: str) -> List[DTSNode]:
+        """Nodes listed under the keys of a table matching a glob."""
+        if not _has_magic(pattern):
+            return table.get(pattern, [])
+        regex = _glob_regex(pattern)
+        return [node for key, nodes in table.items() if regex.match(key) for node in nodes]
+    
+    @staticmethod
+    def _from_paths(index: DTSQueryIndex, pattern: str) -> List[DTSNode]:
+        """Nodes whose path matches a path glob, looked up by its literal prefix."""
+        if not _has_magic(pattern):
+            node = index.by_path.get(pattern.rstrip('/') or '/')
+            return [node] if node is not None else []
+        prefix = re.split(r'[*?]', pattern, 1)[0]
+        if pattern[len(prefix):].startswith('**') and prefix.endswith('/') and prefix != '/':
+            # "/soc/**" also matches "/soc" itself
+            prefix = prefix[:-1]
+        regex = _path_regex(pattern)
+        matches = []
+        for path in index.paths[bisect.bisect_left(index.paths, prefix):]:
+            if not path.startswith(prefix):
+                break
+            if regex.fullmatch(path):
+                matches.append(index.by_path[path])
+        return matches
+
+def _value_matcher(pattern: str):
+    """Return a function telling whether a decoded property value matches a query value."""
+    regex = _glob_regex(pattern)
+    stripped = pattern.strip()
+    text = _glob_regex(stripped)
+    data = decode_property_value(stripped if stripped.startswith('[') else f'[{stripped}]')
+    cells = decode_property_value(stripped if stripped.startswith('<') else f'<{stripped}>')
+    if isinstance(cells, array):
+        cells = cells.tolist()
+    
+    def matches(value) -> bool:
+        if isinstance(value, tuple) and all(isinstance(item, str) for item in value):
+            return any(regex.match(item) for item in value)
+        if value is True:
+            return stripped in ('', 'true')
+        if isinstance(value, str):
+            # Values the decoder could not type compare as text
+            return text.match(' '.join(value.split())) is not None
+        if isinstance(value, bytes):
+            return data == value
+        if isinstance(value, array):
+            return cells == value.tolist()
+        # Cells holding references, e.g. <&clkc 1>
+        return cells == value
+    return matches
+
+# A label or path reference in a property value, skipping quoted strings
+_REFERENCE_USE_RE = re.compile(r'"(?:\\.|[^"\\])*"|&\{([^}]*)\}|&([A-Za-z_]\w*)')
+
+class DTSReferenceGraph:
+    """Graph of the ``&label`` and ``&{/path}`` references between nodes.
+
+    Built over a DTSQueryIndex, so a node and the override blocks merged
+    into it are one vertex; vertices are numbered in document order, as in
+    ``index.nodes``. Edges come from the merged property values (including
+    ``<&name>;`` inclusions) and are stored in compressed sparse row form:
+    the edges of vertex ``v`` are ``offsets[v]`` to ``offsets[v + 1]`` in
+    ``sources``, ``targets``, ``edge_properties`` and ``edge_references``, and
+    ``reverse_offsets``/``reverse_edges`` list the same edges by target.
+    References that name no node are kept apart as dangling, with override
+    blocks whose target does not exist. Building the graph and every check
+    take time linear in the number of nodes and references. Phandles given
+    as plain numbers, as in device tree blobs, are not followed.
+    """
+    def __init__(self, index: DTSQueryIndex):
+        self.index = index
+        self.nodes = index.nodes
+        self.offsets = array('I', [0])
+        self.sources = array('I')
+        self.targets = array('I')
+        self.edge_properties = []  # Property naming each edge
+        self.edge_references = []  # Reference text of each edge (&label or &{/path})
+        self.dangling = {}         # vertex -> [(property, reference)] naming no node
+        self.used_labels = set()
+        
+        order = index.order
+        for vertex, node in enumerate(self.nodes):
+            for member in [node] + index.overlays.get(node, []):
+                for reference in member.references:
+                    if not reference.startswith('&{'):
+                        self.used_labels.add(reference[1:])
+            for name, value in index.merged_properties(node).items():
+                if type(value) is not str or '&' not in value:
+                    continue
+                for m in _REFERENCE_USE_RE.finditer(value):
+                    path, label = m.groups()
+                    if path is not None:
+                        target = index.by_path.get(path)
+                        reference = '&{' + path + '}'
+                    elif label is not None:
+                        self.used_labels.add(label)
+                        targets = index.labels.get(label)
+                        target = targets[-1] if targets else None
+                        reference = '&' + label
+                    else:
+                        continue
+                    if target is None:
+                        self.dangling.setdefault(vertex, []).append((name, reference))
+                    else:
+                        self.sources.append(vertex)
+                        self.targets.append(order[target])
+                        self.edge_properties.append(name)
+                        self.edge_references.append(reference)
+            self.offsets.append(len(self.targets))
+        
+        # Override blocks DTSQueryIndex could not place reference nothing
+        blocks = [(None, reference) for block in index.unplaced for reference in block.references]
+        if blocks:
+            self.dangling[-1] = blocks
+        
+        # The same edges sorted by target (a counting sort)
+        count = len(self.nodes)
+        self.reverse_offsets = array('I', [0]) * (count + 1)
+        for target in self.targets:
+            self.reverse_offsets[target + 1] += 1
+        for vertex in range(count):
+            self.reverse_offsets[vertex + 1] += self.reverse_offsets[vertex]
+        self.reverse_edges = array('I', [0]) * len(self.targets)
+        cursor = self.reverse_offsets[:-1]
+        for edge, target in enumerate(self.targets):
+            self.reverse_edges[cursor[target]] = edge
+            cursor[target] += 1
+    
+    def vertex(self, node: DTSNode) -> Optional[int]:
+        """The vertex of a node (or of the node a block is merged into), or None if it has no path."""
+        path = self.index.path_of.get(node)
+        return self.index.order[self.index.by_path[path]] if path is not None else None
+    
+    def links(self, node: DTSNode) -> List[Tuple[str, str, Optional[DTSNode]]]:
+        """The (property, reference, target) of every reference a node makes; target is None if dangling."""
+        vertex = self.vertex(node)
+        if vertex is None:
+            return []
+        links = [(self.edge_properties[edge], self.edge_references[edge], self.nodes[self.targets[edge]])
+                 for edge in range(self.offsets[vertex], self.offsets[vertex + 1])]
+        links.extend((name, reference, None) for name, reference in self.dangling.get(vertex, ()))
+        return links
+    
+    def backlinks(self, node: DTSNode) -> List[Tuple[str, str, DTSNode]]:
+        """The (property, reference, source) of every reference to a node."""
+        vertex = self.vertex(node)
+        if vertex is None:
+            return []
+        return [(self.edge_properties[edge], self.edge_references[edge], self.nodes[self.sources[edge]])
+                for edge in self.reverse_edges[self.reverse_offsets[vertex]:self.reverse_offsets[vertex + 1]]]
+    
+    def unused_labels(self) -> List[Tuple[str, DTSNode]]:
+        """The (label, node) of every label no property or override block references, by label."""
+        return [(label, nodes[-1]) for label, nodes in sorted(self.index.labels.items())
+                if label not in self.used_labels]
+    
+    def cycles(self) -> List[List[DTSNode]]:
+        """Groups of nodes referencing each other in a cycle, in document order.
+
+        These are the strongly connected components with more than one node,
+        or with a node referencing itself, found with an iterative version of
+        Tarjan's algorithm.
+        """
+        offsets, targets = self.offsets, self.targets
+        count = len(self.nodes)
+        number = array('i', [-1]) * count  # Visiting order, -1 while unvisited
+        low = array('i', [0]) * count
+        on_stack = bytearray(count)
+        stack = []
+        components = []
+        visited = 0
+        for root in range(count):
+            if number[root] != -1:
+                continue
+            number[root] = low[root] = visited
+            visited += 1
+            stack.append(root)
+            on_stack[root] = 1
+            work = [[root, offsets[root]]]  # Vertex and its next edge
+            while work:
+                frame = work[-1]
+                vertex, edge = frame
+                if edge < offsets[vertex + 1]:
+                    frame[1] = edge + 1
+                    target = targets[edge]
+                    if number[target] == -1:
+                        number[target] = low[target] = visited
+                        visited += 1
+                        stack.append(target)
+                        on_stack[target] = 1
+                        work.append([target, offsets[target]])
+                    elif on_stack[target] and number[target] < low[vertex]:
+                        low[vertex] = number[target]
+                    continue
+                
+                work.pop()
+                if work and low[vertex] < low[work[-1][0]]:
+                    low[work[-1][0]] = low[vertex]
+                if low[vertex] == number[vertex]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        component.append(member)
+                        if member == vertex:
+                            break
+                    if len(component) > 1 or vertex in targets[offsets[vertex]:offsets[vertex + 1]]:
+                        components.append(sorted(component))
+        components.sort()
+        return [[self.nodes[vertex] for vertex in component] for component in components]
+    
+    def report(self) -> Dict[str, list]:
+        """JSON-ready results of every check: dangling references, unused labels and cycles."""
+        path_of = self.index.path_of
+        dangling = []
+        for vertex, references in sorted(self.dangling.items()):
+            path = path_of[self.nodes[vertex]] if vertex >= 0 else None
+            dangling.extend({'path': path, 'property': name, 'reference': reference}
+                            for name, reference in references)
+        return {
+            'dangling': dangling,
+            'unused_labels': [{'label': label, 'path': path_of.get(node)} for label, node in self.unused_labels()],
+            'cycles': [[path_of[node] for node in cycle] for cycle in self.cycles()],
+        }
+    
+    def describe_links(self, node: DTSNode) -> List[Dict[str, Any]]:
+        """JSON-ready references a node makes: property, reference and target path (None if dangling)."""
+        return [{'property': name, 'reference': reference,
+                 'path': self.index.path_of[target] if target is not None else None}
+                for name, reference, target in self.links(node)]
+
+class DTSParseCache:
+    """On-disk cache of parsed trees, keyed by file content hash and parser version.
+
+    Each entry holds one file's unresolved tree, stored as flat node records
+    so that loading it skips tokenizing entirely, plus the file's include
+    directives. Entries are pickled, so the cache directory must be trusted.
+    Once the entries exceed ``max_bytes`` the least recently used ones (by
+    modification time, refreshed on every hit) are evicted; with
+    ``max_bytes`` None nothing is evicted until ``trim`` is called with a
+    limit. A ``read_only`` cache only loads entries, so several processes
+    can share one that was filled beforehand.
+    """
+    def __init__(self, cache_dir: str, max_bytes: Optional[int] = 256 * 1024 * 1024, read_only: bool = False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        if read_only:
+            self._size = 0
+            return
+        os.makedirs(cache_dir, exist_ok=True)
+        # Without a limit the size is never compared, so skip scanning the directory
+        self._size = sum(size for _, _, size in self._entries()) if max_bytes is not None else 0
+    
+    @staticmethod
+    def key(content: bytes) -> str:
+        """Cache key for a file's raw content."""
+        digest = hashlib.sha256(f"dts-parse-v{PARSER_VERSION}\0".encode())
+        digest.update(content)
+        return digest.hexdigest()
+    
+    def load(self, key: str) -> Optional[Tuple[DTSNode, List[str]]]:
+        """Return the cached (root, includes) for a key, or None on a miss."""
+        path = os.path.join(self.cache_dir, key + '.pickle')
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+            if not self.read_only:
+                os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Unreadable or truncated entry; treat it as a miss
+            return None
+        if entry.get('version') != PARSER_VERSION:
+            return None
+        return _unflatten_tree(entry['nodes']), entry['includes']
+    
+    def store(self, key: str, root: DTSNode, includes: List[str]):
+        """Store a parsed tree and its include directives under a key."""
+        if self.read_only:
+            return
+        entry = {'version': PARSER_VERSION, 'includes': list(includes), 'nodes': _flatten_tree(root)}
+        path = os.path.join(self.cache_dir, key + '.pickle')
+        # Write to a temporary file first so readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._size += os.path.getsize(path)
+        if self.max_bytes is not None and self._size > self.max_bytes:
+            self.trim()
+    
+    def _entries(self):
+        """Yield (mtime, path, size) for every cache entry."""
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pickle'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, entry.path, stat.st_size
+    
+    def trim(self, max_bytes: Optional[int] = None):
+        """Remove least recently used entries until the cache fits max_bytes (or the given limit)."""
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = sorted(self._entries())
+        self._size = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self._size <= max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+def _flatten_tree(root: DTSNode) -> list:
+    """Flatten a tree into preorder (parent index, name, labels, references, properties) records."""
+    records = []
+    stack = [(root, -1)]
+    while stack:
+        node, parent_index = stack.pop()
+        index = len(records)
+        properties = node._properties
+        if properties is not None and any(isinstance(value, memoryview) for value in properties.values()):
+            # Values read from a blob point into it; store copies
+            properties = {name: bytes(value) if isinstance(value, memoryview) else value
+                          for name, value in properties.items()}
+        records.append((parent_index, node.name, node._labels, node._references, properties))
+        for child in reversed(node.children):
+            stack.append((child, index))
+    return records
+
+def _unflatten_tree(records: list) -> DTSNode:
+    """Rebuild a tree from the records produced by _flatten_tree."""
+    nodes = []
+    for parent_index, name, labels, references, properties in records:
+        parent = nodes[parent_index] if parent_index >= 0 else None
+        node = DTSNode(name, parent)
+        node._labels = labels
+        node._references = references
+        if properties is not None:
+            node.properties = properties
+        if parent is not None:
+            parent.add_child(node)
+        nodes.append(node)
+    return nodes[0]
+
+# Flattened device tree (DTB) format constants
+_FDT_MAGIC = b'\xd0\x0d\xfe\xed'
+_FDT_BEGIN_NODE = 1
+_FDT_END_NODE = 2
+_FDT_PROP = 3
+_FDT_NOP = 4
+_FDT_END = 9
+_FDT_VERSION = 17
+_FDT_LAST_COMPATIBLE_VERSION = 16
+_FDT_HEADER = struct.Struct('>10I')
+_FDT_RESERVE_ENTRY = struct.Struct('>QQ')
+_FDT_TOKEN = struct.Struct('>I')
+_FDT_PROP_HEADER = struct.Struct('>II')
+
+def is_dtb(data) -> bool:
+    """Whether raw file content is a flattened device tree blob."""
+    return data[:4] == _FDT_MAGIC
+
+class DTBReader:
+    """Reader for flattened device tree blobs (.dtb files).
+
+    Builds the same tree shape as DTSParser: a "root" node holding the "/"
+    node. Property values are ``memoryview`` slices of the blob rather than
+    copies; decode them with ``decode_property_value`` or format them with
+    ``format_property_value``. Labels are restored from the ``__symbols__``
+    node of blobs compiled with ``dtc -@``.
+    """
+    def __init__(self, data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        if len(data) < _FDT_HEADER.size or not is_dtb(data):
+            raise ValueError("Not a device tree blob")
+        (_, self.total_size, self.off_struct, self.off_strings, self.off_reserve, self.version,
+         self.last_compatible_version, self.boot_cpuid, self.size_strings,
+         self.size_struct) = _FDT_HEADER.unpack_from(data)
+        if self.version < 16 or self.last_compatible_version > _FDT_VERSION:
+            raise ValueError(f"Unsupported device tree blob version {self.version}")
+        if self.total_size > len(data):
+            raise ValueError("Truncated device tree blob")
+        if self.version < 17:
+            self.size_struct = self.off_strings - self.off_struct
+        self.data = data
+        self.reservations = []  # (address, size) memory reservations
+    
+    @classmethod
+    def open(cls, path: str) -> 'DTBReader':
+        """Memory-map a .dtb file and return a reader over it."""
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    
+    def read(self) -> DTSNode:
+        """Walk the structure block and return the root of the tree."""
+        data = self.data
+        view = memoryview(data)
+        find = data.find
+        unpack_token = _FDT_TOKEN.unpack_from
+        unpack_prop = _FDT_PROP_HEADER.unpack_from
+        names = {}  # Strings block offset -> property name
+        
+        self.reservations = []
+        pos = self.off_reserve
+        while True:
+            address, size = _FDT_RESERVE_ENTRY.unpack_from(data, pos)
+            if not address and not size:
+                break
+            self.reservations.append((address, size))
+            pos += _FDT_RESERVE_ENTRY.size
+        
+        root = DTSNode("root")
+        stack = [root]
+        pos = self.off_struct
+        end = pos + self.size_struct
+        while pos < end:
+            token, = unpack_token(data, pos)
+            pos += 4
+            if token == _FDT_PROP:
+                length, name_offset = unpack_prop(data, pos)
+                pos += 8
+                name = names.get(name_offset)
+                if name is None:
+                    start = self.off_strings + name_offset
+                    name = names[name_offset] = data[start:find(b'\0', start)].decode('utf-8', 'replace')
+                stack[-1].add_property(name, view[pos:pos + length])
+                pos = (pos + length + 3) & ~3
+            elif token == _FDT_BEGIN_NODE:
+                name_end = find(b'\0', pos)
+                if name_end < 0:
+                    raise ValueError(f"Unterminated node name at offset {pos}")
+                node = DTSNode(data[pos:name_end].decode('utf-8', 'replace') or '/', stack[-1])
+                stack[-1].add_child(node)
+                stack.append(node)
+                pos = (name_end + 4) & ~3
+            elif token == _FDT_END_NODE:
+                if len(stack) == 1:
+                    raise ValueError(f"Unbalanced end of node at offset {pos - 4}")
+                stack.pop()
+            elif token == _FDT_END:
+                break
+            elif token != _FDT_NOP:
+                raise ValueError(f"Unknown token {token:#x} at offset {pos - 4}")
+        
+        self._restore_labels(root)
+        return root
+    
+    @staticmethod
+    def _restore_labels(root: DTSNode):
+        """Label nodes as listed in the /__symbols__ node, if there is one."""
+        symbols = next((child for top in root.children if top.name == '/'
+                        for child in top.children if child.name == '__symbols__'), None)
+        if symbols is None:
+            return
+        paths = DTSTreeIndex(root).paths
+        for label, value in symbols.properties.items():
+            target = paths.get(bytes(value).rstrip(b'\0').decode('utf-8', 'replace'))
+            if target is not None and label not in target.labels:
+                target.add_label(label)
+
+class DTSTreeMerger:
+    """Merges parsed trees into a single "/" tree, as dtc does.
+
+    Takes one tree or a list of trees (e.g. a file and the files it
+    includes, included files first) from DTSParser, MultiFileDTSParser or
+    DTBReader. Their "/" nodes are merged and ``&label``/``&{/path}``
+    override blocks are applied to their targets in order; later
+    properties win. Blocks coming before the node they reference are
+    applied once it exists. ``/delete-node/`` and ``/delete-property/``
+    remove what was merged before them: within a node they apply where they
+    appear among its properties, before its own child nodes are merged, and
+    top-level ``/delete-node/ &label;`` statements apply once the rest of
+    their file is merged. Labels of deleted nodes are forgotten. The merged
+    tree in ``root`` is made of new nodes sharing the sources' property
+    values. A block or deletion whose target never appears raises
+    ValueError, or unless ``strict`` is skipped and its reference listed in
+    ``unresolved``.
+    """
+    def __init__(self, trees, strict: bool = True):
+        self.root = DTSNode('/')
+        self.labels = {}     # label -> merged node
+        self.strict = strict
+        self._children = {}  # id(merged node) -> {child name: child}
+        self._pending = []   # (block, reference) whose target is not merged yet
+        self.unresolved = []  # References skipped without strict, in order
+        for source in ([trees] if isinstance(trees, DTSNode) else trees):
+            self._merge_tree(source)
+        
+        while self._pending:
+            pending, self._pending = self._pending, []
+            for block, reference in pending:
+                self._merge_block(block, reference)
+            if len(self._pending) == len(pending):
+                break
+        if self._pending and strict:
+            raise ValueError(f"Reference {self._pending[0][1]} does not point to any node")
+        self.unresolved.extend(reference for _, reference in self._pending)
+    
+    def _merge_tree(self, source: DTSNode):
+        """Merge the "/" nodes and override blocks found in a tree, in order."""
+        stack = [source]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, tuple):
+                # Top-level deletions of a container, once its blocks are merged
+                self._delete(*node)
+            elif node.name == '/':
+                self._merge(node, self.root)
+            elif node.references:
+                for reference in node.references:
+                    self._merge_block(node, reference)
+            else:
+                # Container such as the parser's "root" or a combined view
+                if node.properties:
+                    stack.append((node.properties, self.root))
+                stack.extend(reversed(node.children))
+    
+    def _merge_block(self, block: DTSNode, reference: str):
+        """Merge an override block into its target, or keep it for later if there is none yet."""
+        try:
+            target = self.target(reference)
+        except ValueError:
+            self._pending.append((block, reference))
+            return
+        self._merge(block, target)
+    
+    def _merge(self, source: DTSNode, target: DTSNode):
+        """Merge a node's labels, properties and children into a merged node."""
+        stack = [(source, target)]
+        while stack:
+            source, target = stack.pop()
+            for label in source.labels:
+                if label not in target.labels:
+                    target.add_label(label)
+                self.labels[label] = target
+            for name, value in source.properties.items():
+                if name.startswith(_DELETE_PREFIXES):
+                    self._delete((name,), target)
+                elif name != '__node_inclusion__':
+                    target.add_property(name, value)
+            pairs = [(child, self.child(target, child.name)) for child in source.children]
+            stack.extend(reversed(pairs))
+    
+    def _delete(self, names, target: DTSNode):
+        """Apply the deletion markers among some property names to a merged node."""
+        for name in names:
+            directive, _, argument = name.partition(' ')
+            if directive == '/delete-property/':
+                target.remove_property(argument)
+            elif directive == '/delete-node/':
+                if argument.startswith('&'):
+                    try:
+                        node = self.target(argument)
+                    except ValueError:
+                        if self.strict:
+                            raise
+                        self.unresolved.append(argument)
+                        continue
+                else:
+                    node = self._children.get(id(target), {}).get(argument)
+                if node is not None and node is not self.root:
+                    self._remove(node)
+    
+    def _remove(self, node: DTSNode):
+        """Remove a merged node and forget its subtree's labels and children."""
+        node.parent.remove_child(node)
+        del self._children[id(node.parent)][node.name]
+        removed = set()
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            removed.add(id(node))
+            self._children.pop(id(node), None)
+            stack.extend(node.children)
+        for label in [label for label, node in self.labels.items() if id(node) in removed]:
+            del self.labels[label]
+    
+    def child(self, parent: DTSNode, name: str) -> DTSNode:
+        """Return the merged child of a node with a name, creating it if needed."""
+        children = self._children.setdefault(id(parent), {})
+        child = children.get(name)
+        if child is None:
+            child = children[name] = DTSNode(name, parent)
+            parent.add_child(child)
+        return child
+    
+    def target(self, reference: str) -> DTSNode:
+        """Return the merged node a ``&label`` or ``&{/path}`` reference points to."""
+        if reference.startswith('&{'):
+            node = self.root
+            for name in filter(None, reference[2:-1].split('/')):
+                node = self._children.get(id(node), {}).get(name)
+                if node is None:
+                    break
+        else:
+            node = self.labels.get(reference.lstrip('&'))
+        if node is None:
+            raise ValueError(f"Reference {reference} does not point to any node")
+        return node
+
+def diff_trees(old: DTSNode, new: DTSNode, path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Compare two trees and return their differences by path.
+
+    Children are matched by name (nodes repeating a name are paired in
+    order) and subtrees with equal ``subtree_hash`` are skipped without
+    looking inside, so comparing mostly equal trees, or comparing against
+    the same baseline again, is cheap. Each difference is a dict with a
+    ``change`` (``added``, ``removed`` or ``changed``) and a ``path``, plus
+    ``property`` and ``old``/``new`` display values for property changes, or
+    ``old_labels``/``new_labels`` when a node's labels changed. An added or
+    removed node is reported once, not with its subtree. Use merged trees
+    (``DTSTreeMerger``) to compare what dtc would compile.
+    """
+    if path is None:
+        path = _node_path(new) or '/'
+    changes = []
+    stack = [(old, new, path)]
+    while stack:
+        old, new, path = stack.pop()
+        if old.subtree_hash() == new.subtree_hash():
+            continue
+        
+        if sorted(old.labels) != sorted(new.labels):
+            changes.append({'change': 'changed', 'path': path,
+                            'old_labels': list(old.labels), 'new_labels': list(new.labels)})
+        old_properties, new_properties = old.properties, new.properties
+        for name, value in old_properties.items():
+            if name not in new_properties:
+                changes.append({'change': 'removed', 'path': path, 'property': name,
+                                'old': format_property_value(value)})
+            elif value != new_properties[name]:
+                changes.append({'change': 'changed', 'path': path, 'property': name,
+                                'old': format_property_value(value),
+                                'new': format_property_value(new_properties[name])})
+        for name, value in new_properties.items():
+            if name not in old_properties:
+                changes.append({'change': 'added', 'path': path, 'property': name,
+                                'new': format_property_value(value)})
+        
+        # Pair children by name, in order among those sharing a name
+        old_children = {}
+        for child in old.children:
+            old_children.setdefault(child.name, []).append(child)
+        pairs = []
+        for child in new.children:
+            matches = old_children.get(child.name)
+            child_path = _child_path(path, child.name) or child.name
+            if matches:
+                pairs.append((matches.pop(0), child, child_path))
+            else:
+                changes.append({'change': 'added', 'path': child_path})
+        for matches in old_children.values():
+            for child in matches:
+                changes.append({'change': 'removed', 'path': _child_path(path, child.name) or child.name})
+        stack.extend(reversed(pairs))
+    return changes
+
+class DTBWriter:
+    """Writer for flattened device tree blobs (version 17).
+
+    Takes one tree or a list of trees (e.g. a file and the files it
+    includes, included files first) from DTSParser, MultiFileDTSParser or
+    DTBReader, and merges them with ``DTSTreeMerger``, so nodes and
+    properties removed with ``/delete-node/`` and ``/delete-property/`` are
+    left out, along with the labels of deleted nodes. A reference to a
+    deleted node raises ValueError, as it makes dtc fail.
+    Text values are encoded from their DTS syntax: ``&label`` references in
+    cell lists become phandles (adding ``phandle`` properties to their
+    targets) and references outside cells become path strings. Binary values
+    read from a DTB are written unchanged. With ``symbols`` a
+    ``/__symbols__`` node maps every label to its path, like ``dtc -@``.
+    """
+    def __init__(self, trees, boot_cpuid: int = 0, reservations=(), symbols: bool = False):
+        self.trees = [trees] if isinstance(trees, DTSNode) else list(trees)
+        self.boot_cpuid = boot_cpuid
+        self.reservations = list(reservations)
+        self.symbols = symbols
+    
+    def write(self, path: str):
+        """Write the blob to a file."""
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+    
+    def to_bytes(self) -> bytes:
+        """Return the blob."""
+        self._merger = DTSTreeMerger(self.trees)
+        self._root = self._merger.root
+        if self.symbols and self._merger.labels:
+            symbols = self._merger.child(self._root, '__symbols__')
+            for label, node in self._merger.labels.items():
+                symbols.add_property(label, _node_path(node).encode('utf-8') + b'\0')
+        self._encode_properties()
+        return self._serialize()
+    
+    def _encode_properties(self):
+        """Replace every property value of the merged tree by its binary encoding."""
+        nodes = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(node.children)
+        
+        # Phandles already assigned in the sources are kept
+        self._phandles = {}
+        for node in nodes:
+            phandle = decode_property_value(node.properties['phandle']) if 'phandle' in node.properties else None
+            if isinstance(phandle, array) and len(phandle) == 1:
+                self._phandles[id(node)] = phandle[0]
+        self._next_phandle = max(self._phandles.values(), default=0) + 1
+        
+        for node in nodes:
+            for name, value in list(node.properties.items()):
+                node.add_property(name, self._encode_value(value))
+    
+    def _encode_value(self, value) -> bytes:
+        """Encode a raw DTS value (or binary value, or True) as bytes."""
+        if value is True:
+            return b''
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return bytes(value)
+        parts = []
+        pos = 0
+        while pos < len(value):
+            m = _VALUE_COMPONENT_RE.match(value, pos)
+            if not m or m.end() == pos:
+                raise ValueError(f"Cannot encode property value {value!r}")
+            pos = m.end()
+            cells, string, data, ref = m.group('cells', 'string', 'bytes', 'ref')
+            if cells is not None:
+                bits = int(m.group('bits') or 32)
+                if bits not in _ARRAY_TYPECODES:
+                    raise ValueError(f"Unsupported cell size /bits/ {bits}")
+                cell_format = '>' + _ARRAY_TYPECODES[bits]
+                mask = (1 << bits) - 1
+                for token in _CELL_TOKEN_RE.findall(cells):
+                    cell = _decode_cell(token)
+                    if isinstance(cell, str):
+                        if not cell.startswith('&') or bits != 32:
+                            raise ValueError(f"Cannot encode cell {token!r}; macros must be preprocessed first")
+                        cell = self._phandle(self._merger.target(cell))
+                    parts.append(struct.pack(cell_format, cell & mask))
+            elif string is not None:
+                parts.append(_unescape(string).encode('utf-8') + b'\0')
+            elif data is not None:
+                parts.append(bytes.fromhex(data))
+            else:
+                parts.append(_node_path(self._merger.target(ref)).encode('utf-8') + b'\0')
+        return b''.join(parts)
+    
+    def _phandle(self, node: DTSNode) -> int:
+        """Return a node's phandle, giving it one if it has none yet."""
+        phandle = self._phandles.get(id(node))
+        if phandle is None:
+            phandle = self._phandles[id(node)] = self._next_phandle
+            self._next_phandle += 1
+            node.add_property('phandle', struct.pack('>I', phandle))
+        return phandle
+    
+    def _serialize(self) -> bytes:
+        """Lay out the header, reservation, structure and strings blocks."""
+        structure = bytearray()
+        strings = bytearray()
+        string_offsets = {}
+        
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                structure += _FDT_TOKEN.pack(_FDT_END_NODE)
+                continue
+            structure += _FDT_TOKEN.pack(_FDT_BEGIN_NODE)
+            structure += ('' if node is self._root else node.name).encode('utf-8') + b'\0'
+            structure += b'\0' * (-len(structure) % 4)
+            for name, value in node.properties.items():
+                offset = string_offsets.get(name)
+                if offset is None:
+                    offset = string_offsets[name] = len(strings)
+                    strings += name.encode('utf-8') + b'\0'
+                structure += _FDT_TOKEN.pack(_FDT_PROP)
+                structure += _FDT_PROP_HEADER.pack(len(value), offset)
+                structure += value
+                structure += b'\0' * (-len(structure) % 4)
+            stack.append(None)
+            stack.extend(reversed(node.children))
+        structure += _FDT_TOKEN.pack(_FDT_END)
+        
+        reserve = b''.join(_FDT_RESERVE_ENTRY.pack(address, size) for address, size in self.reservations)
+        reserve += _FDT_RESERVE_ENTRY.pack(0, 0)
+        off_reserve = _FDT_HEADER.size  # 40, already 8-byte aligned
+        off_struct = off_reserve + len(reserve)
+        off_strings = off_struct + len(structure)
+        total_size = off_strings + len(strings)
+        header = _FDT_HEADER.pack(int.from_bytes(_FDT_MAGIC, 'big'), total_size, off_struct, off_strings,
+                                  off_reserve, _FDT_VERSION, _FDT_LAST_COMPATIBLE_VERSION,
+                                  self.boot_cpuid, len(strings), len(structure))
+        return header + reserve + bytes(structure) + bytes(strings)
 
 class MultiFileDTSParser:
-    """Parser for handling multiple DTS files with cross-file references."""
-    def __init__(self):
+    """Parser for handling multiple DTS files with cross-file references.
+
+    With ``preprocess`` every source file is run through DTSPreprocessor
+    first, with ``include_dirs`` as its search path and ``defines`` as its
+    predefined macros.
+    """
+    def __init__(self, cache: Optional[DTSParseCache] = None, metrics: Optional[DTSMetrics] = None,
+                 preprocess: bool = False, include_dirs=(), defines=()):
         self.references = {}  # Global references across all files
         self.includes = {}    # Track include relationships
+        self.overlays = {}    # All &name blocks across files, in parse order
         self.parsed_files = {}  # Cache of parsed files
         self.root = DTSNode("multi_root")  # Root for combined tree
+        self.index = None  # DTSTreeIndex, built by resolve_all_references
+        self.cache = cache  # Optional on-disk cache of parsed files
+        self.include_graph = {}     # File -> normalized paths of the files it includes
+        self.file_blocks = {}       # File -> its &name block nodes, in parse order
+        self.file_inclusions = {}   # File -> references named by its <&name> inclusions
+        self.metrics = metrics      # Optional DTSMetrics to profile into
+        self.header_graph = {}      # File -> headers it includes, directly or through other headers
+        self.top_files = []         # Files passed to parse_file, in order
+        self.preprocessor = None    # DTSPreprocessor, if preprocessing
+        if preprocess:
+            self.preprocessor = DTSPreprocessor(include_dirs, defines, self._read_file, self._file_exists, metrics)
         
     def parse_file(self, filepath: str, base_dir: str = None) -> DTSNode:
         """Parse a DTS file and its includes, returning the parsed tree."""
@@ -253,36 +2598,26 @@ class MultiFileDTSParser:
         if base_dir and not os.path.isabs(filepath):
             filepath = os.path.join(base_dir, filepath)
         filepath = os.path.normpath(filepath)
-        
-        # Check if already parsed
+        if filepath not in self.top_files:
+            self.top_files.append(filepath)
+        return self._parse_tree(filepath)
+    
+    def _parse_tree(self, filepath: str) -> Optional[DTSNode]:
+        """Parse a normalized file path and, first, the files it includes."""
+        # Check if already parsed, or being parsed further up an include cycle
         if filepath in self.parsed_files:
             return self.parsed_files[filepath]
-        
-        # Read the file
-        try:
-            with open(filepath, 'r') as f:
-                content = f.read()
-        except FileNotFoundError:
-            print(f"Warning: Could not find file {filepath}")
+        if filepath in self.include_graph:
             return None
         
-        # Parse the file
-        base_dir = os.path.dirname(filepath)
-        parser = DTSParser(content, self.references, self.includes)
-        node = parser.parse()
-        
-        # Update references
-        self.references.update(parser.references)
+        node = self._parse_path(filepath)
+        if node is None:
+            return None
         
-        # Process includes if any
-        for include_file in parser.includes:
-            # Resolve relative path
-            include_path = os.path.join(base_dir, include_file)
-            include_path = os.path.normpath(include_path)
-            
-            # Parse included file if not already parsed
+        # Parse included files if not already parsed
+        for include_path in self.include_graph[filepath]:
             if include_path not in self.parsed_files:
-                self.parse_file(include_path, base_dir)
+                self._parse_tree(include_path)
         
         # Cache the parsed result
         self.parsed_files[filepath] = node
@@ -290,83 +2625,862 @@ class MultiFileDTSParser:
         # Add to the multi-root
         self.root.add_child(node)
         
+        # Keep the lookup tables current once they exist
+        if self.index is not None:
+            self.index.add_subtree(node)
+        
+        return node
+    
+    def _parse_path(self, filepath: str) -> Optional[DTSNode]:
+        """Read and parse one file, or load it from the cache, and register it."""
+        with _phase(self.metrics, 'read'):
+            data = self._read_file(filepath)
+        if data is None:
+            return None
+        if self.metrics is not None:
+            self.metrics.count('files')
+            self.metrics.count('bytes_in', len(data))
+        
+        # Blobs are read directly; they are cheap to load and have no includes
+        if is_dtb(data):
+            with _phase(self.metrics, 'parse_dtb'):
+                node = DTBReader(data).read()
+            if self.metrics is not None:
+                self.metrics.count_tree(node)
+            file_includes = []
+            sources = headers = []
+        elif self.preprocessor is not None:
+            with _phase(self.metrics, 'decode'):
+                content = str(data, 'utf-8', 'replace')
+            self._release(data)
+            with _phase(self.metrics, 'preprocess'):
+                content, sources, headers = self.preprocessor.preprocess(filepath, content)
+            node, file_includes = self._parse_source(None, content)
+        else:
+            node, file_includes = self._parse_source(data)
+            sources = headers = []
+        
+        self._register_file(filepath, node)
+        
+        # Resolve include paths relative to the including file
+        base_dir = os.path.dirname(filepath)
+        include_paths = [os.path.normpath(os.path.join(base_dir, include_file)) for include_file in file_includes]
+        self.include_graph[filepath] = include_paths + [path for path in sources if path not in include_paths]
+        self.header_graph[filepath] = headers
         return node
     
+    def _parse_source(self, data, content: Optional[str] = None) -> Tuple[DTSNode, List[str]]:
+        """Parse DTS source, unless an identical file is in the on-disk cache.
+
+        ``data`` is the raw source (bytes or a memory map, which is closed as
+        soon as it is no longer needed), or None when ``content`` holds the
+        decoded source instead.
+        """
+        cached = None
+        if self.cache is not None:
+            with _phase(self.metrics, 'cache_load'):
+                cache_key = self.cache.key(data if data is not None else content.encode('utf-8'))
+                cached = self.cache.load(cache_key)
+            if self.metrics is not None:
+                self.metrics.count('cache_hits' if cached is not None else 'cache_misses')
+        if cached is not None:
+            self._release(data)
+            node, file_includes = cached
+            for include_file in file_includes:
+                self.includes[include_file] = True
+            return node, file_includes
+        
+        if content is None:
+            with _phase(self.metrics, 'decode'):
+                content = str(data, 'utf-8', 'replace')
+            self._release(data)
+        parser = DTSParser(content, self.references, self.includes, metrics=self.metrics)
+        node = parser.parse(resolve_references=False)
+        if self.cache is not None:
+            with _phase(self.metrics, 'cache_store'):
+                self.cache.store(cache_key, node, parser.file_includes)
+        return node, parser.file_includes
+    
+    def _read_file(self, filepath: str) -> Optional[bytes]:
+        """Return a file's raw content, or None if it does not exist.
+
+        Files are memory-mapped rather than read, so sources are decoded
+        straight from the page cache without an intermediate bytes copy,
+        and the property values of device tree blobs can point into the file.
+        """
+        try:
+            with open(filepath, 'rb') as f:
+                try:
+                    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except (ValueError, OSError):
+                    # Empty files and pipes cannot be mapped
+                    return f.read()
+        except FileNotFoundError:
+            print(f"Warning: Could not find file {filepath}")
+            return None
+    
+    @staticmethod
+    def _release(data):
+        """Unmap a source file once it is decoded; blobs stay mapped while their trees live."""
+        if isinstance(data, mmap.mmap):
+            data.close()
+    
+    def _file_exists(self, filepath: str) -> bool:
+        """Whether a file exists, for the preprocessor's include search."""
+        return os.path.isfile(filepath)
+    
+    def file_trees(self, filepath: str) -> List[DTSNode]:
+        """Return the trees of a file and of every file it includes, included files first."""
+        trees = []
+        seen = set()
+        stack = [(os.path.normpath(filepath), False)]
+        while stack:
+            path, expanded = stack.pop()
+            if expanded:
+                if path in self.parsed_files:
+                    trees.append(self.parsed_files[path])
+                continue
+            if path in seen:
+                continue
+            seen.add(path)
+            stack.append((path, True))
+            stack.extend((include_path, False) for include_path in reversed(self.include_graph.get(path, ())))
+        return trees
+    
+    def _register_file(self, filepath: str, root: DTSNode):
+        """Record the &name blocks and <&name> inclusions of a newly parsed tree."""
+        blocks = []
+        inclusions = set()
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node.references:
+                blocks.append(node)
+            if '__node_inclusion__' in node.properties:
+                inclusions.add(node.properties['__node_inclusion__'])
+            stack.extend(reversed(node.children))
+        self.file_blocks[filepath] = blocks
+        self.file_inclusions[filepath] = inclusions
+        for block in blocks:
+            for reference in block.references:
+                self.references[reference] = block
+                self.overlays.setdefault(reference, []).append(block)
+    
     def resolve_all_references(self):
-        """Resolve all references across all parsed files."""
-        for filepath, node in self.parsed_files.items():
-            parser = DTSParser("", self.references)
-            parser._resolve_references(node)
+        """Resolve all references across all parsed files in a single pass."""
+        parser = DTSParser("", self.references, overlays=self.overlays, metrics=self.metrics)
+        with _phase(self.metrics, 'resolve'):
+            parser._resolve_references(self.root)
         
-        # Also resolve references in the multi-root
-        parser = DTSParser("", self.references)
-        parser._resolve_references(self.root)
+        # Build the lookup tables over the resolved trees
+        with _phase(self.metrics, 'index'):
+            self._build_index()
         
         return self.root
+    
+    def _build_index(self):
+        """(Re)build the lookup tables over all parsed files."""
+        self.index = DTSTreeIndex()
+        for node in self.parsed_files.values():
+            self.index.add_subtree(node)
+    
+    @staticmethod
+    def _includers(*graphs) -> Dict[str, List[str]]:
+        """Invert include graphs: included path -> files including it."""
+        includers = {}
+        for graph in graphs:
+            for filepath, include_paths in graph.items():
+                for include_path in include_paths:
+                    includers.setdefault(include_path, []).append(filepath)
+        return includers
+    
+    def _file_order(self) -> Tuple[List[str], List[str]]:
+        """The parsed files in the orders parsing them from scratch would give.
+
+        Returns the order files are registered in (each before the files it
+        includes) and the order their trees are added to the root in (each
+        after the files it includes), following ``top_files``.
+        """
+        registered = []
+        added = []
+        seen = set()
+        for top_file in self.top_files:
+            stack = [(top_file, False)]
+            while stack:
+                filepath, expanded = stack.pop()
+                if expanded:
+                    added.append(filepath)
+                    continue
+                if filepath in seen or filepath not in self.parsed_files:
+                    continue
+                seen.add(filepath)
+                registered.append(filepath)
+                stack.append((filepath, True))
+                stack.extend((include_path, False) for include_path in reversed(self.include_graph[filepath]))
+        return registered, added
+    
+    def reparse(self, changed_files) -> List[str]:
+        """Re-parse changed files and the files affected by them, then re-resolve.
+
+        A changed file is parsed again, dropped if it was deleted, or picked
+        up if it was created and a parsed file includes it. Resolving consumes
+        the <&name> inclusions of a tree, so every file whose inclusions name
+        a label defined by a re-parsed file, before or after the change, is
+        re-parsed too; when preprocessing, so are the files including a
+        re-parsed file or changed header, whose macros change how they expand.
+        The files are then put back in the order parsing them from scratch
+        would give, and only the re-parsed trees are resolved again, so the
+        result is the same as that of a fresh parser. Returns the files that
+        were re-parsed or newly parsed, in parse order.
+        """
+        changed = [os.path.normpath(path) for path in changed_files]
+        if self.preprocessor is not None:
+            self.preprocessor.invalidate(changed)
+        includers = self._includers(self.include_graph, self.header_graph) if self.preprocessor is not None else {}
+        included = {include_path for include_paths in self.include_graph.values() for include_path in include_paths}
+        
+        pending = [path for path in changed
+                   if path in self.parsed_files or path in included or path in self.top_files]
+        for path in changed:
+            pending.extend(includers.get(path, ()))
+        reparsed = set()
+        while pending:
+            filepath = pending.pop()
+            if filepath in reparsed:
+                continue
+            reparsed.add(filepath)
+            
+            # Parse the file again; a deleted file has been warned about by _read_file
+            old_blocks = self.file_blocks.pop(filepath, ())
+            self.file_inclusions.pop(filepath, None)
+            self.include_graph.pop(filepath, None)
+            self.header_graph.pop(filepath, None)
+            self.parsed_files.pop(filepath, None)
+            node = self._parse_path(filepath)
+            if node is not None:
+                self.parsed_files[filepath] = node
+            
+            # Queue the files using its labels, including it, or newly included by it
+            labels = {reference for block in old_blocks for reference in block.references}
+            labels.update(reference for block in self.file_blocks.get(filepath, ())
+                          for reference in block.references)
+            dependents = list(includers.get(filepath, ()))
+            if labels:
+                dependents.extend(other for other, used in self.file_inclusions.items()
+                                  if not used.isdisjoint(labels))
+            dependents.extend(include_path for include_path in self.include_graph.get(filepath, ())
+                              if include_path not in self.parsed_files)
+            pending.extend(dependent for dependent in dependents if dependent not in reparsed)
+        
+        # Restore the order of a fresh parse, dropping files no longer included
+        registered, added = self._file_order()
+        for filepath in set(self.parsed_files).difference(added):
+            self.include_graph.pop(filepath, None)
+            self.header_graph.pop(filepath, None)
+        self.parsed_files = {filepath: self.parsed_files[filepath] for filepath in added}
+        self.file_blocks = {filepath: self.file_blocks[filepath] for filepath in registered}
+        self.file_inclusions = {filepath: self.file_inclusions[filepath] for filepath in registered}
+        self.root.children = [self.parsed_files[filepath] for filepath in added]
+        
+        # Rebuild the reference tables from the per-file blocks, in parse order
+        self.references = {}
+        self.overlays = {}
+        for blocks in self.file_blocks.values():
+            for block in blocks:
+                for reference in block.references:
+                    self.references[reference] = block
+                    self.overlays.setdefault(reference, []).append(block)
+        
+        # Resolve only the re-parsed trees; the others are unaffected
+        affected = [filepath for filepath in added if filepath in reparsed]
+        parser = DTSParser("", self.references, overlays=self.overlays, metrics=self.metrics)
+        resolved = set()
+        with _phase(self.metrics, 'resolve'):
+            for filepath in affected:
+                parser._resolve_references(self.parsed_files[filepath], resolved)
+        
+        if self.index is not None:
+            with _phase(self.metrics, 'index'):
+                self._build_index()
+        
+        return affected
+
+def watch(multi_parser: MultiFileDTSParser, on_change, interval: float = 1.0):
+    """Poll the files of a parser and re-parse whatever changes, until interrupted.
+
+    After each update ``on_change`` is called with the list of affected files.
+    Include files that did not exist are watched too, so creating one is noticed.
+    """
+    def snapshot():
+        paths = set(multi_parser.include_graph)
+        for graph in (multi_parser.include_graph, multi_parser.header_graph):
+            for include_paths in graph.values():
+                paths.update(include_paths)
+        state = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                state[path] = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                state[path] = None
+        return state
+    
+    state = snapshot()
+    while True:
+        time.sleep(interval)
+        current = snapshot()
+        changed = [path for path in current if current[path] != state.get(path)]
+        if changed:
+            affected = multi_parser.reparse(changed)
+            on_change(affected)
+            current = snapshot()
+        state = current
+
+def find_batch_files(directory: str) -> Tuple[List[str], List[str]]:
+    """Return the top-level files (.dts and .dtb) and the .dtsi files below a directory, sorted."""
+    top_level = []
+    includes = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith(('.dts', '.dtb')):
+                top_level.append(os.path.join(dirpath, filename))
+            elif filename.endswith('.dtsi'):
+                includes.append(os.path.join(dirpath, filename))
+    return top_level, includes
+
+# Cache a batch worker process stores the warmed includes in, set by _batch_init
+_batch_cache: Optional[DTSParseCache] = None
+
+def _batch_init(cache_dir: str):
+    """Open the batch cache once per worker process, without eviction while warming.
+
+    A per-worker size limit would evict entries other workers just stored;
+    run_batch enforces the limit once after the batch instead.
+    """
+    global _batch_cache
+    _batch_cache = DTSParseCache(cache_dir, max_bytes=None)
+
+def _batch_warm(filepath: str, options: dict) -> Optional[str]:
+    """Parse one include file into the shared cache.
+
+    Returns None, or a warning NDJSON record if the file cannot be read or
+    parsed on its own. That is not a failure: the file may only parse with
+    what its includers define, and they report their own errors.
+    """
+    warnings = io.StringIO()
+    try:
+        with redirect_stdout(warnings):
+            MultiFileDTSParser(_batch_cache, **options)._parse_path(filepath)
+    except (OSError, ValueError) as e:
+        return json.dumps({'file': filepath, 'status': 'warning',
+                           'warnings': warnings.getvalue().splitlines() +
+                                       [f"Warning: cannot parse {filepath} on its own: {type(e).__name__}: {e}"]})
+    return None
+
+def _batch_file(filepath: str, cache_dir: str, options: dict, profile: bool) -> Tuple[str, bool, Optional[dict]]:
+    """Parse one top-level file in a batch worker.
+
+    Returns the file's NDJSON record, whether it succeeded and, if
+    ``profile``, a snapshot of the worker's metrics for it.
+    The record holds the file merged with its includes, as dtc would
+    compile it, or the error that stopped it, plus the warnings printed on
+    the way (stdout carries the records).
+    """
+    metrics = DTSMetrics() if profile else None
+    start = time.perf_counter()
+    warnings = io.StringIO()
+    try:
+        with redirect_stdout(warnings):
+            multi_parser = MultiFileDTSParser(DTSParseCache(cache_dir, read_only=True), metrics, **options)
+            if multi_parser.parse_file(filepath) is None:
+                raise FileNotFoundError(f"Could not read {filepath}")
+            multi_parser.resolve_all_references()
+            merger = DTSTreeMerger(multi_parser.file_trees(filepath), strict=False)
+            for reference in merger.unresolved:
+                print(f"Warning: Reference {reference} does not point to any node, skipped")
+            tree = merger.root
+        record = {
+            'file': filepath,
+            'status': 'ok',
+            'includes': [path for path in multi_parser.parsed_files if path != os.path.normpath(filepath)],
+            'warnings': warnings.getvalue().splitlines(),
+            'seconds': round(time.perf_counter() - start, 6),
+        }
+        # Splice the tree in as it is encoded rather than building it as a dict
+        line = json.dumps(record)[:-1] + ', "tree": ' + ''.join(iter_json(tree, indent=None)) + '}'
+        ok = True
+    except Exception as e:
+        line = json.dumps({'file': filepath, 'status': 'error', 'error': f"{type(e).__name__}: {e}",
+                           'warnings': warnings.getvalue().splitlines(),
+                           'seconds': round(time.perf_counter() - start, 6)})
+        ok = False
+    return line, ok, metrics.snapshot() if metrics is not None else None
+
+def run_batch(directory: str, output, jobs: Optional[int] = None, cache_dir: Optional[str] = None,
+              cache_size: int = 256 * 1024 * 1024, metrics: Optional[DTSMetrics] = None, **options) -> Tuple[int, int]:
+    """Parse every top-level file below a directory on a process pool, streaming NDJSON.
+
+    The .dtsi files are parsed into a DTSParseCache first, in parallel, so
+    the workers load the includes they share instead of each parsing them
+    again; the workers only read the cache. Nothing is evicted during the
+    batch; a ``cache_dir`` that is kept is trimmed to ``cache_size``
+    afterwards. Each top-level file then yields
+    one JSON line, written to ``output`` as soon as it completes, so the
+    lines come in completion order. A file that fails gets a record with
+    ``"status": "error"`` and the batch carries on; an include file that
+    cannot be parsed on its own gets a ``"status": "warning"`` record from
+    the warm-up, which does not count as a failure. ``options`` are passed
+    to MultiFileDTSParser. Returns the number of files and of failures.
+    """
+    top_level, includes = find_batch_files(directory)
+    failures = 0
+    kept = cache_dir is not None
+    cache_context = tempfile.TemporaryDirectory(prefix='dts-batch-') if cache_dir is None else nullcontext(cache_dir)
+    with cache_context as cache_dir, ProcessPoolExecutor(max_workers=jobs, initializer=_batch_init,
+                                                         initargs=(cache_dir,)) as executor:
+        with _phase(metrics, 'batch_warm'):
+            for line in executor.map(partial(_batch_warm, options=options), includes, chunksize=16):
+                if line is not None:
+                    output.write(line + '\n')
+        
+        futures = {executor.submit(_batch_file, filepath, cache_dir, options, metrics is not None): filepath
+                   for filepath in top_level}
+        for future in as_completed(futures):
+            try:
+                line, ok, snapshot = future.result()
+            except Exception as e:
+                # The worker process itself died
+                line, ok, snapshot = json.dumps({'file': futures[future], 'status': 'error',
+                                                 'error': f"{type(e).__name__}: {e}"}), False, None
+            failures += not ok
+            if snapshot is not None:
+                metrics.merge(snapshot)
+            output.write(line + '\n')
+            output.flush()
+        
+        if kept:
+            DTSParseCache(cache_dir, max_bytes=None).trim(cache_size)
+    return len(top_level), failures
 
 class DTSVisualizer:
-    """Visualizes a DTS tree structure."""
-    def __init__(self, root: DTSNode):
+    """Visualizes a DTS tree structure.
+
+    ``max_depth`` limits how many levels below the root are shown (None for
+    all of them) and ``show_properties`` can hide properties to show only
+    the node structure. Rendering and export times are recorded in
+    ``metrics``, if given.
+    """
+    def __init__(self, root: DTSNode, max_depth: Optional[int] = None, show_properties: bool = True,
+                 metrics: Optional[DTSMetrics] = None):
         self.root = root
+        self.max_depth = max_depth
+        self.show_properties = show_properties
+        self.metrics = metrics
         self.console = Console()
         
     def visualize(self):
         """Visualize the DTS tree structure using Rich."""
-        tree = Tree(f"[bold]{self.root.name}[/bold]")
-        
-        self._add_node_to_tree(self.root, tree)
-        
-        self.console.print("\n[bold cyan]Device Tree Visualization[/bold cyan]")
-        self.console.print(Panel(tree, expand=False, border_style="green"))
-        
-    def export_json(self, output_file: str):
-        """Export the DTS tree as JSON."""
-        tree_dict = self.root.to_dict()
+        with _phase(self.metrics, 'render'):
+            tree = Tree(f"[bold]{self.root.name}[/bold]")
+            
+            self._add_node_to_tree(self.root, tree)
+            
+            self.console.print("\n[bold cyan]Device Tree Visualization[/bold cyan]")
+            self.console.print(Panel(tree, expand=False, border_style="green"))
+    
+    def iter_lines(self):
+        """Yield the tree as plain text lines, one per node or property.
+
+        Lines are produced while the tree is walked, so the first ones are
+        available straight away however large the tree is.
+        """
+        yield self.root.name
+        # Stack of [entries, prefix, index]; entries are a node's properties then children
+        stack = [[self._entries(self.root, 0), '', 0]]
+        while stack:
+            frame = stack[-1]
+            entries, prefix, index = frame
+            if index == len(entries):
+                stack.pop()
+                continue
+            frame[2] = index + 1
+            last = index == len(entries) - 1
+            connector = '└── ' if last else '├── '
+            entry = entries[index]
+            if isinstance(entry, DTSNode):
+                depth = len(stack)
+                children = self._entries(entry, depth)
+                line = prefix + connector + self._node_text(entry)
+                if entry.children and not self._expands(depth):
+                    line += f" [+{len(entry.children)} children]"
+                yield line
+                if children:
+                    stack.append([children, prefix + ('    ' if last else '│   '), 0])
+            else:
+                name, value = entry
+                yield f"{prefix}{connector}{name} = {value}"
+    
+    def stream(self, file=None):
+        """Write the tree as plain text to a file (stdout by default), line by line."""
+        file = file or sys.stdout
+        lines = self.iter_lines()
+        if self.metrics is not None:
+            lines = self.metrics.time_chunks('render', lines, counter=None)
+        try:
+            for line in lines:
+                file.write(line + '\n')
+            file.flush()
+        except BrokenPipeError:
+            # The reader went away (e.g. piped into head); stop writing quietly
+            if file is sys.stdout:
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    
+    def page(self):
+        """Show the tree as plain text in $PAGER (less by default), feeding it line by line."""
+        if not sys.stdout.isatty():
+            self.stream()
+            return
+        pager = subprocess.Popen(os.environ.get('PAGER') or 'less', shell=True,
+                                 stdin=subprocess.PIPE, text=True)
+        lines = self.iter_lines()
+        if self.metrics is not None:
+            lines = self.metrics.time_chunks('render', lines, counter=None)
+        try:
+            for line in lines:
+                pager.stdin.write(line + '\n')
+            pager.stdin.close()
+        except BrokenPipeError:
+            # The pager was closed before the whole tree was shown
+            pass
+        pager.wait()
         
+    def export_json(self, output_file: str, compact: bool = False, links=None):
+        """Export the DTS tree as JSON, streaming it to the file as it is encoded.
+
+        ``links`` is passed on to ``iter_json``.
+        """
+        chunks = iter_json(self.root, indent=None if compact else 2, links=links)
+        if self.metrics is not None:
+            chunks = self.metrics.time_chunks('export_json', chunks)
         with open(output_file, 'w') as f:
-            json.dump(tree_dict, f, indent=2)
+            for chunk in chunks:
+                f.write(chunk)
             
         self.console.print(f"[green]Exported JSON to {output_file}[/green]")
     
+    def export_dtb(self, output_file: str, trees: Optional[List[DTSNode]] = None, symbols: bool = False):
+        """Compile the tree (or the given trees, merged in order) to a device tree blob."""
+        try:
+            with _phase(self.metrics, 'export_dtb'):
+                blob = DTBWriter(trees or self.root, symbols=symbols).to_bytes()
+        except ValueError as e:
+            # Like dtc, write nothing rather than a blob that differs from the source
+            self.console.print(f"[red]Error: cannot compile {output_file}: {e}[/red]")
+            return
+        with open(output_file, 'wb') as f:
+            f.write(blob)
+        if self.metrics is not None:
+            self.metrics.count('bytes_out', len(blob))
+        
+        self.console.print(f"[green]Exported DTB to {output_file}[/green]")
+    
+    def _expands(self, depth: int) -> bool:
+        """Whether the children of a node at this depth are shown."""
+        return self.max_depth is None or depth < self.max_depth
+    
+    def _entries(self, node: DTSNode, depth: int) -> list:
+        """The properties and child nodes shown below a node."""
+        entries = list(display_properties(node.properties).items()) if self.show_properties else []
+        if self._expands(depth):
+            entries.extend(node.children)
+        return entries
+    
+    @staticmethod
+    def _node_text(node: DTSNode) -> str:
+        """Plain text for a node: its name, labels and references."""
+        text = node.name
+        if node.labels:
+            text += f" ({', '.join(node.labels)})"
+        if node.references:
+            text += f" {', '.join(node.references)}"
+        return text
+    
     def _add_node_to_tree(self, node: DTSNode, tree: Tree):
-        """Recursively add nodes to the tree."""
-        for child in node.children:
-            # Prepare node representation
-            node_text = f"[bold blue]{child.name}[/bold blue]"
-            
-            # Add labels if any
-            if child.labels:
-                labels_str = ", ".join(child.labels)
-                node_text += f" [dim]({labels_str})[/dim]"
-            
-            # Add references if any
-            if child.references:
-                refs_str = ", ".join(child.references)
-                node_text += f" [bold magenta]{refs_str}[/bold magenta]"
-            
-            # Create branch for this node
-            branch = tree.add(node_text)
-            
-            # Add properties
-            if child.properties:
-                props_branch = branch.add("[italic]Properties[/italic]")
-                for name, value in child.properties.items():
-                    props_branch.add(f"[green]{name}[/green] = [yellow]{value}[/yellow]")
+        """Add the descendants of a node to the tree, walking it iteratively."""
+        stack = [(node, tree, 0)]
+        while stack:
+            node, tree, depth = stack.pop()
+            if not self._expands(depth):
+                if node.children:
+                    tree.add(f"[dim]... {len(node.children)} more nodes[/dim]")
+                continue
+            branches = []
+            for child in node.children:
+                # Prepare node representation
+                node_text = f"[bold blue]{child.name}[/bold blue]"
+                
+                # Add labels if any
+                if child.labels:
+                    labels_str = ", ".join(child.labels)
+                    node_text += f" [dim]({labels_str})[/dim]"
+                
+                # Add references if any
+                if child.references:
+                    refs_str = ", ".join(child.references)
+                    node_text += f" [bold magenta]{refs_str}[/bold magenta]"
+                
+                # Create branch for this node
+                branch = tree.add(node_text)
+                
+                # Add properties
+                if child.properties and self.show_properties:
+                    props_branch = branch.add("[italic]Properties[/italic]")
+                    for name, value in display_properties(child.properties).items():
+                        props_branch.add(f"[green]{name}[/green] = [yellow]{value}[/yellow]")
+                
+                branches.append((child, branch, depth + 1))
             
-            # Process children recursively
-            self._add_node_to_tree(child, branch)
+            # Process children in order once their siblings are added
+            stack.extend(reversed(branches))
+
+def _show(visualizer: DTSVisualizer, args):
+    """Display a tree in the output mode selected on the command line."""
+    if args.pager:
+        visualizer.page()
+    elif args.plain:
+        visualizer.stream()
+    else:
+        visualizer.visualize()
+
+def _query(args, multi_parser: MultiFileDTSParser):
+    """Print, and optionally export, the nodes matching the --query selector."""
+    query_index = multi_parser.index.query_index()
+    try:
+        matches = DTSQuery(args.query).run(query_index)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    results = [query_index.describe(node, not args.no_properties) for node in matches]
+    
+    print(f"Found {len(results)} node(s) matching {args.query}")
+    for result in results:
+        labels = f" ({', '.join(result['labels'])})" if result['labels'] else ''
+        print(f"{result['path']}{labels}")
+        for name, value in result.get('properties', {}).items():
+            print(f"    {name}" if value is True else f"    {name} = {value}")
+    
+    if args.output == "json":
+        output_file = args.output_file or "query.json"
+        with open(output_file, 'w') as f:
+            json.dump(results, f, indent=None if args.compact else 2)
+        print(f"Exported {len(results)} node(s) to {output_file}")
+    elif args.output == "dtb":
+        print("Error: DTB export needs a whole tree and cannot be combined with --query")
+
+def _format_change(change: Dict[str, Any]) -> str:
+    """One line of --diff output: + added, - removed, ~ changed."""
+    line = f"{'+-~'[('added', 'removed', 'changed').index(change['change'])]} {change['path']}"
+    if 'old_labels' in change:
+        return f"{line}: labels {', '.join(change['old_labels']) or '(none)'} -> {', '.join(change['new_labels']) or '(none)'}"
+    if 'property' not in change:
+        return line
+    values = ['true' if change[key] is True else change[key] for key in ('old', 'new') if key in change]
+    if change['change'] == 'changed':
+        return f"{line}: {change['property']} {values[0]} -> {values[1]}"
+    return f"{line}: {change['property']}" + ('' if values[0] == 'true' else f" = {values[0]}")
+
+def _diff(args, multi_parser: MultiFileDTSParser, baseline: DTSNode):
+    """Print, and optionally export, how the parsed files differ from the --diff baseline."""
+    if args.combined:
+        targets = [("combined", [multi_parser.root])]
+    else:
+        targets = [(dts_file, multi_parser.file_trees(dts_file))
+                   for dts_file in args.dts_files if os.path.normpath(dts_file) in multi_parser.parsed_files]
+    
+    for name, trees in targets:
+        with _phase(multi_parser.metrics, 'diff'):
+            changes = diff_trees(baseline, DTSTreeMerger(trees, strict=False).root)
+        print(f"{len(changes)} difference(s) between {args.diff} and {name}")
+        for change in changes:
+            print(_format_change(change))
+        
+        if args.output == "json":
+            output_file = args.output_file or f"{os.path.splitext(name)[0]}-diff.json"
+            with open(output_file, 'w') as f:
+                json.dump(changes, f, indent=None if args.compact else 2)
+            print(f"Exported {len(changes)} difference(s) to {output_file}")
+        elif args.output == "dtb":
+            print("Error: DTB export cannot be combined with --diff")
+
+def _render(args, multi_parser: MultiFileDTSParser, baseline: Optional[DTSNode] = None):
+    """Visualize and export the parsed files as selected on the command line."""
+    options = {'max_depth': args.max_depth, 'show_properties': not args.no_properties,
+               'metrics': multi_parser.metrics}
+    
+    if baseline is not None:
+        _diff(args, multi_parser, baseline)
+        return
+    if args.query:
+        _query(args, multi_parser)
+        return
+    
+    # Each node's outgoing references, for JSON exports
+    links = multi_parser.index.reference_graph().describe_links if args.links else None
+    
+    # Only show the selected subtree, looked up across all files
+    if args.path:
+        node = multi_parser.index.resolve(args.path)
+        if node is None:
+            print(f"Error: No node matches {args.path}")
+            return
+        visualizer = DTSVisualizer(node, **options)
+        _show(visualizer, args)
+        if args.output == "json":
+            output_file = args.output_file or "subtree.json"
+            visualizer.export_json(output_file, compact=args.compact, links=links)
+        elif args.output == "dtb":
+            print("Error: DTB export needs a whole tree and cannot be combined with --path")
+        return
+    
+    # Visualize based on mode
+    if args.combined:
+        # Combined visualization
+        print("Creating combined visualization...")
+        visualizer = DTSVisualizer(multi_parser.root, **options)
+        _show(visualizer, args)
+        
+        # Handle exports for combined view
+        if args.output == "json":
+            output_file = args.output_file or "combined_dts.json"
+            visualizer.export_json(output_file, compact=args.compact, links=links)
+        elif args.output == "dtb":
+            output_file = args.output_file or "combined.dtb"
+            visualizer.export_dtb(output_file, symbols=args.symbols)
+    else:
+        # Individual visualizations
+        for dts_file in args.dts_files:
+            filepath = os.path.normpath(dts_file)
+            if filepath in multi_parser.parsed_files:
+                print(f"Visualizing {dts_file}...")
+                node = multi_parser.parsed_files[filepath]
+                visualizer = DTSVisualizer(node, **options)
+                _show(visualizer, args)
+                
+                # Handle exports for individual files
+                if args.output == "json":
+                    output_file = args.output_file or f"{os.path.splitext(dts_file)[0]}.json"
+                    visualizer.export_json(output_file, compact=args.compact, links=links)
+                elif args.output == "dtb":
+                    # The blob holds the file merged with everything it includes
+                    output_file = args.output_file or f"{os.path.splitext(dts_file)[0]}.dtb"
+                    if os.path.normpath(output_file) == filepath:
+                        output_file = f"{os.path.splitext(dts_file)[0]}-out.dtb"
+                    visualizer.export_dtb(output_file, multi_parser.file_trees(filepath), symbols=args.symbols)
+
+def _batch(args, metrics: Optional[DTSMetrics], preprocess: bool) -> int:
+    """Run --batch, writing the NDJSON records to --output-file or stdout; return the exit code."""
+    with open(args.output_file, 'w') if args.output_file else nullcontext(sys.stdout) as output:
+        total, failures = run_batch(args.batch, output, args.jobs, args.cache_dir, args.cache_size * 1024 * 1024,
+                                    metrics, preprocess=preprocess, include_dirs=args.include_dir,
+                                    defines=args.define)
+    # Keep stdout for the records
+    print(f"Processed {total} file(s), {failures} failed", file=sys.stderr)
+    if metrics is not None:
+        _print_profile(metrics)
+    return 1 if failures else 0
+
+def _validate(args, multi_parser: MultiFileDTSParser) -> bool:
+    """Print the reference checks of the parsed files; return False if a reference dangles.
+
+    Unused labels are common in SoC files (they are there for boards to
+    use), so they are only counted here; the JSON report lists them.
+    """
+    with _phase(multi_parser.metrics, 'validate'):
+        report = multi_parser.index.reference_graph().report()
+    
+    for entry in report['dangling']:
+        where = f"{entry['path']}: {entry['property']}" if entry['path'] is not None else "override block"
+        print(f"error: {where} references {entry['reference']}, which does not exist")
+    for cycle in report['cycles']:
+        print(f"note: reference cycle among: {', '.join(cycle)}")
+    print(f"{len(report['dangling'])} dangling reference(s), {len(report['unused_labels'])} unused label(s), "
+          f"{len(report['cycles'])} cycle(s)")
+    
+    if args.output == "json":
+        output_file = args.output_file or "validation.json"
+        with open(output_file, 'w') as f:
+            json.dump(report, f, indent=None if args.compact else 2)
+        print(f"Exported validation report to {output_file}")
+    return not report['dangling']
+
+def _print_profile(metrics: DTSMetrics):
+    """Print the phase timings and counters collected with --profile to stderr."""
+    snapshot = metrics.snapshot()
+    total = sum(phase['seconds'] for phase in snapshot['phases'].values())
+    
+    table = Table(title="Profile", title_justify="left")
+    table.add_column("Phase")
+    table.add_column("Seconds", justify="right")
+    table.add_column("Calls", justify="right")
+    table.add_column("Share", justify="right")
+    for name, phase in snapshot['phases'].items():
+        share = phase['seconds'] / total if total else 0.0
+        table.add_row(name, f"{phase['seconds']:.4f}", str(phase['calls']), f"{share:.1%}")
+    
+    counters = Table(title="Counters", title_justify="left")
+    counters.add_column("Counter")
+    counters.add_column("Total", justify="right")
+    for name, value in snapshot['counters'].items():
+        counters.add_row(name, f"{value:,}")
+    
+    console = Console(stderr=True)
+    console.print(table)
+    console.print(counters)
 
 def main():
     parser = argparse.ArgumentParser(description="Visualize DTS files as tree structures")
-    parser.add_argument("dts_files", nargs='+', help="Path(s) to the DTS file(s) to visualize")
-    parser.add_argument("--output", "-o", choices=["json"], help="Export format (json)")
+    parser.add_argument("dts_files", nargs='*', help="Path(s) to the DTS or DTB file(s) to visualize")
+    parser.add_argument("--output", "-o", choices=["json", "dtb"], help="Export format (json, or dtb for a compiled blob)")
     parser.add_argument("--output-file", "-f", help="Output file path for exports")
     parser.add_argument("--combined", "-c", action="store_true", help="Create a combined visualization of all files")
+    parser.add_argument("--compact", action="store_true", help="Write JSON exports without indentation")
+    parser.add_argument("--symbols", action="store_true", help="Add a /__symbols__ node with all labels to DTB exports")
+    parser.add_argument("--max-depth", type=int, help="Only show this many levels below the root")
+    parser.add_argument("--path", help="Only show the subtree at a path or label (e.g. /soc or &uart0)")
+    parser.add_argument("--query", "-q", help="Only list the nodes matching a selector (e.g. '[compatible=arm,gic*] [status=okay]')")
+    parser.add_argument("--diff", metavar="BASELINE", help="Show how the files differ from a baseline DTS or DTB file")
+    parser.add_argument("--validate", action="store_true",
+                        help="Check references: report dangling references (exit status 1), unused labels and cycles")
+    parser.add_argument("--links", action="store_true", help="Add each node's references to JSON exports")
+    parser.add_argument("--no-properties", action="store_true", help="Show nodes without their properties")
+    parser.add_argument("--plain", action="store_true", help="Print the tree as plain text while it is walked")
+    parser.add_argument("--pager", action="store_true", help="Show the plain text tree in $PAGER")
+    parser.add_argument("--preprocess", action="store_true", help="Run the files through the C preprocessor first, as kernel builds do")
+    parser.add_argument("--include-dir", "-I", action="append", default=[], metavar="DIR",
+                        help="Search DIR for #include files; implies --preprocess (repeatable)")
+    parser.add_argument("--define", "-D", action="append", default=[], metavar="NAME[=VALUE]",
+                        help="Define a preprocessor macro; implies --preprocess (repeatable)")
+    parser.add_argument("--cache-dir", help="Directory for an on-disk cache of parsed files")
+    parser.add_argument("--cache-size", type=int, default=256, help="Maximum cache size in MB (default: 256)")
+    parser.add_argument("--watch", "-w", action="store_true", help="Re-parse and re-render when the files change")
+    parser.add_argument("--profile", action="store_true", help="Print time spent per phase and node/byte counts to stderr")
+    parser.add_argument("--watch-interval", type=float, default=1.0, help="Seconds between checks in watch mode (default: 1)")
+    parser.add_argument("--batch", metavar="DIR",
+                        help="Parse every .dts/.dtb file below DIR in parallel, writing one JSON line per file (NDJSON)")
+    parser.add_argument("--jobs", "-j", type=int, help="Worker processes for --batch (default: one per CPU)")
     args = parser.parse_args()
+    if not args.dts_files and not args.batch:
+        parser.error("the following arguments are required: dts_files")
     
     try:
-        # Create multi-file parser
-        multi_parser = MultiFileDTSParser()
+        # Create multi-file parser, with the on-disk cache if requested
+        metrics = DTSMetrics() if args.profile else None
+        preprocess = args.preprocess or bool(args.include_dir or args.define)
+        if args.batch:
+            return _batch(args, metrics, preprocess)
+        cache = DTSParseCache(args.cache_dir, args.cache_size * 1024 * 1024) if args.cache_dir else None
+        multi_parser = MultiFileDTSParser(cache, metrics, preprocess, args.include_dir, args.define)
         
         # Parse all provided files
         for dts_file in args.dts_files:
@@ -377,31 +3491,39 @@ def main():
         print("Resolving references across all files...")
         multi_parser.resolve_all_references()
         
-        # Visualize based on mode
-        if args.combined:
-            # Combined visualization
-            print("Creating combined visualization...")
-            visualizer = DTSVisualizer(multi_parser.root)
-            visualizer.visualize()
+        if args.validate:
+            ok = _validate(args, multi_parser)
+            if metrics is not None:
+                _print_profile(metrics)
+            return 0 if ok else 1
+        
+        # The merged baseline is kept, so its subtree hashes are only computed once
+        baseline = None
+        if args.diff:
+            print(f"Parsing baseline {args.diff}...")
+            baseline_parser = MultiFileDTSParser(cache, metrics, preprocess, args.include_dir, args.define)
+            baseline_parser.parse_file(args.diff)
+            baseline_parser.resolve_all_references()
+            baseline = DTSTreeMerger(baseline_parser.file_trees(args.diff), strict=False).root
+        
+        _render(args, multi_parser, baseline)
+        if metrics is not None:
+            _print_profile(metrics)
+        
+        # Re-parse and re-render whenever one of the files changes
+        if args.watch:
+            print(f"Watching {len(multi_parser.include_graph)} file(s) for changes (Ctrl+C to stop)...")
             
-            # Handle exports for combined view
-            if args.output == "json":
-                output_file = args.output_file or "combined_dts.json"
-                visualizer.export_json(output_file)
-        else:
-            # Individual visualizations
-            for dts_file in args.dts_files:
-                filepath = os.path.normpath(dts_file)
-                if filepath in multi_parser.parsed_files:
-                    print(f"Visualizing {dts_file}...")
-                    node = multi_parser.parsed_files[filepath]
-                    visualizer = DTSVisualizer(node)
-                    visualizer.visualize()
-                    
-                    # Handle exports for individual files
-                    if args.output == "json":
-                        output_file = args.output_file or f"{os.path.splitext(dts_file)[0]}.json"
-                        visualizer.export_json(output_file)
+            def on_change(affected):
+                print(f"Re-parsed {len(affected)} file(s): {', '.join(affected)}")
+                _render(args, multi_parser, baseline)
+                if metrics is not None:
+                    _print_profile(metrics)
+            
+            try:
+                watch(multi_parser, on_change, args.watch_interval)
+            except KeyboardInterrupt:
+                pass
         
     except Exception as e:
         print(f"Error: {str(e)}")
@@ -0,0 +1,89 @@
+"""Tests for the ASGI front end's upload budget."""
+
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip('flask')
+
+from web_dashboard.app import BoundedExecutor, DashboardASGI, app
+
+async def settled(task):
+    """Whether a task finishes once the loop has had a chance to run it."""
+    for _ in range(10):
+        await asyncio.sleep(0)
+    return task.done()
+
+def test_slow_uploads_only_hold_what_they_sent():
+    async def scenario():
+        executor = BoundedExecutor(max_bytes=100)
+        async with executor.reserve() as slow_a, executor.reserve() as slow_b:
+            await slow_a(40)
+            await slow_b(40)
+            async with executor.reserve() as fast:
+                await asyncio.wait_for(fast(10), 1)
+                # A chunk past the budget waits until memory is freed
+                late = asyncio.ensure_future(fast(20))
+                assert not await settled(late)
+                await slow_b(0)
+            assert await settled(late)
+    asyncio.run(scenario())
+
+def test_oldest_upload_cannot_deadlock():
+    async def scenario():
+        executor = BoundedExecutor(max_bytes=100)
+        first, second = executor.reserve(), executor.reserve()
+        take_first, take_second = await first.__aenter__(), await second.__aenter__()
+        await take_first(60)
+        await take_second(30)
+        waiting = asyncio.ensure_future(take_second(30))
+        assert not await settled(waiting)
+        # The oldest upload goes over the budget instead of waiting for the other
+        await asyncio.wait_for(take_first(30), 1)
+        assert not waiting.done()
+        await first.__aexit__(None, None, None)
+        assert await settled(waiting)
+        await second.__aexit__(None, None, None)
+    asyncio.run(scenario())
+
+def upload_scope(length):
+    return {
+        'type': 'http', 'method': 'POST', 'path': '/api/visualize', 'query_string': b'',
+        'http_version': '1.1', 'headers': [(b'content-type', b'multipart/form-data; boundary=x'),
+                                           (b'content-length', str(length).encode())],
+    }
+
+def multipart(source: bytes) -> bytes:
+    return (b'--x\r\nContent-Disposition: form-data; name="dts_file"; filename="t.dts"\r\n\r\n' +
+            source + b'\r\n--x--\r\n')
+
+def test_fast_upload_passes_a_stalled_one():
+    async def scenario():
+        asgi = DashboardASGI(app, BoundedExecutor(max_bytes=1024 * 1024))
+        
+        # The slow client announces most of the budget, sends a little and stalls
+        stalled = asyncio.Event()
+        async def slow_receive():
+            if not stalled.is_set():
+                stalled.set()
+                return {'type': 'http.request', 'body': multipart(b'/ { };')[:40], 'more_body': True}
+            await asyncio.Event().wait()
+        async def ignore(message):
+            pass
+        slow = asyncio.ensure_future(asgi(upload_scope(2 * 1024 * 1024), slow_receive, ignore))
+        await stalled.wait()
+        
+        body = multipart(b'/dts-v1/;\n/ { fast { }; };\n')
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        async def fast_receive():
+            return messages.pop(0)
+        sent = []
+        async def send(message):
+            sent.append(message)
+        await asyncio.wait_for(asgi(upload_scope(len(body)), fast_receive, send), 10)
+        slow.cancel()
+        assert sent[0]['status'] == 200
+        response = json.loads(b''.join(message.get('body', b'') for message in sent[1:]))
+        assert response['data']['children'][0]['children'][0]['name'] == 'fast'
+    asyncio.run(scenario())
@@ -0,0 +1,36 @@
+"""Tests for --batch: every problem ends up in an NDJSON record."""
+
+import io
+import json
+
+from dts_visualizer.dts_visualizer import run_batch
+
+def run(directory):
+    output = io.StringIO()
+    total, failures = run_batch(str(directory), output, jobs=1)
+    records = {}
+    for line in output.getvalue().splitlines():
+        record = json.loads(line)
+        records[record['file'].rsplit('/', 1)[-1]] = record
+    return total, failures, records
+
+def test_dangling_override_is_a_warning(tmp_path):
+    (tmp_path / 'soc.dtsi').write_text('/ { u: uart { }; };\n')
+    (tmp_path / 'board.dts').write_text('/dts-v1/;\n#include "soc.dtsi"\n'
+                                        '&u { status = "okay"; };\n&nonexistent { x; };\n')
+    total, failures, records = run(tmp_path)
+    assert (total, failures) == (1, 0)
+    board = records['board.dts']
+    assert board['status'] == 'ok'
+    assert board['tree']['children'][0]['properties'] == {'status': '"okay"'}
+    assert any('&nonexistent' in warning for warning in board['warnings'])
+
+def test_unparsable_include_is_reported(tmp_path):
+    # Blob magic, then nothing: the reader rejects it
+    (tmp_path / 'broken.dtsi').write_bytes(b'\xd0\x0d\xfe\xed\x00')
+    (tmp_path / 'board.dts').write_text('/dts-v1/;\n/ { };\n')
+    total, failures, records = run(tmp_path)
+    assert (total, failures) == (1, 0)
+    assert records['broken.dtsi']['status'] == 'warning'
+    assert 'ValueError' in records['broken.dtsi']['warnings'][-1]
+    assert records['board.dts']['status'] == 'ok'
@@ -0,0 +1,80 @@
+"""Tests for reading and writing flattened device tree blobs."""
+
+import struct
+
+from dts_visualizer.dts_visualizer import DTBReader, DTBWriter, DTSParser
+
+SOURCE = '''/dts-v1/;
+/ {
+    compatible = "vendor,board";
+    #address-cells = <1>;
+    uart0: serial@1000 {
+        reg = <0x1000 0x100>;
+        clocks = <&clk 3>;
+        status = "okay";
+    };
+    clk: clock {
+        #clock-cells = <1>;
+    };
+    chosen {
+        stdout-path = &uart0;
+    };
+};
+'''
+
+def cells(*values):
+    return struct.pack(f'>{len(values)}I', *values)
+
+# The blob dtc compiles SOURCE to: clk gets phandle 1, &uart0 becomes its path
+TREE = ('', [('compatible', b'vendor,board\0'), ('#address-cells', cells(1))], [
+    ('serial@1000', [('reg', cells(0x1000, 0x100)), ('clocks', cells(1, 3)), ('status', b'okay\0')], []),
+    ('clock', [('#clock-cells', cells(1)), ('phandle', cells(1))], []),
+    ('chosen', [('stdout-path', b'/serial@1000\0')], []),
+])
+
+def assemble(tree, reservations=(), boot_cpuid=0):
+    """Lay out a blob by the specification, independently of DTBWriter."""
+    structure = bytearray()
+    strings = bytearray()
+    
+    def pad():
+        structure.extend(b'\0' * (-len(structure) % 4))
+    
+    def node(name, properties, children):
+        structure.extend(cells(1) + name.encode() + b'\0')
+        pad()
+        for prop, value in properties:
+            key = prop.encode() + b'\0'
+            if key not in strings:
+                strings.extend(key)
+            structure.extend(cells(3, len(value), strings.index(key)) + value)
+            pad()
+        for child in children:
+            node(*child)
+        structure.extend(cells(2))
+    
+    node(*tree)
+    structure.extend(cells(9))
+    reserve = b''.join(struct.pack('>QQ', *entry) for entry in list(reservations) + [(0, 0)])
+    off_struct = 40 + len(reserve)
+    off_strings = off_struct + len(structure)
+    header = struct.pack('>10I', 0xd00dfeed, off_strings + len(strings), off_struct, off_strings, 40,
+                         17, 16, boot_cpuid, len(strings), len(structure))
+    return header + reserve + bytes(structure) + bytes(strings)
+
+def test_writes_the_blob_dtc_would():
+    assert DTBWriter(DTSParser(SOURCE).parse()).to_bytes() == assemble(TREE)
+
+def test_round_trip_is_byte_exact():
+    blob = assemble(TREE, reservations=[(0x80000000, 0x100000)], boot_cpuid=1)
+    reader = DTBReader(blob)
+    tree = reader.read()
+    assert reader.reservations == [(0x80000000, 0x100000)]
+    assert DTBWriter(tree, reader.boot_cpuid, reader.reservations).to_bytes() == blob
+
+def test_rewriting_a_written_blob_is_stable():
+    blob = DTBWriter(DTSParser(SOURCE).parse(), symbols=True).to_bytes()
+    reader = DTBReader(blob)
+    tree = reader.read()
+    assert tree.children[0].children[-1].name == '__symbols__'
+    assert DTBWriter(tree, symbols=True).to_bytes() == blob
@@ -0,0 +1,43 @@
+"""Tests for the streaming JSON exporter: it must match json.dumps of to_dict()."""
+
+import json
+
+import pytest
+
+from dts_visualizer.dts_visualizer import DTBReader, DTBWriter, DTSNode, DTSParser, iter_json
+
+SOURCE = r'''/dts-v1/;
+/ {
+    model = "Board \"quoted\" \\ tab\t é ☃";
+    l1: node@0 {
+        reg = <0x0 0x1000>, <0x1 0x2000>;
+        bytes = [00 11 22];
+        empty;
+        ref = &l1;
+        deep { deeper { x = /bits/ 16 <1 2>; }; };
+    };
+    other { };
+};
+&l1 { status = "okay"; };
+'''
+
+@pytest.mark.parametrize('indent', [None, 0, 2, 4])
+@pytest.mark.parametrize('chunk_size', [1, 7, 65536])
+def test_matches_json_dumps(indent, chunk_size):
+    root = DTSParser(SOURCE).parse()
+    chunks = list(iter_json(root, indent=indent, chunk_size=chunk_size))
+    expected = json.dumps(root.to_dict(), indent=indent, separators=(',', ':') if indent is None else None)
+    assert ''.join(chunks) == expected
+
+def test_deep_tree():
+    root = node = DTSNode('root')
+    for depth in range(150):
+        child = DTSNode(f'n{depth}', node)
+        child.add_property('depth', f'<{depth}>')
+        node.add_child(child)
+        node = child
+    assert ''.join(iter_json(root)) == json.dumps(root.to_dict(), indent=2)
+
+def test_blob_values():
+    root = DTBReader(DTBWriter(DTSParser(SOURCE).parse()).to_bytes()).read()
+    assert ''.join(iter_json(root)) == json.dumps(root.to_dict(), indent=2)
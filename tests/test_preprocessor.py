@@ -0,0 +1,98 @@
+"""Tests for the built-in preprocessor: its output must match cpp's, as dtc builds run it."""
+
+import shutil
+import subprocess
+
+import pytest
+
+from dts_visualizer.dts_visualizer import (DTSParser, DTSPreprocessor, DTSTreeMerger, MultiFileDTSParser,
+                                           _pp_evaluate)
+
+FILES = {
+    'include/dt-bindings/irq.h': '''#ifndef _DT_IRQ_H
+#define _DT_IRQ_H
+#define IRQ_TYPE_LEVEL_HIGH 4
+#define GIC_SPI 0
+#define IRQ(n) GIC_SPI (n) IRQ_TYPE_LEVEL_HIGH
+#endif
+''',
+    'soc.dtsi': '''#include <dt-bindings/irq.h>
+#include <dt-bindings/irq.h>
+#define BASE 0x1000
+#define REG(off, size) <0x0 (BASE + (off)) 0x0 size>
+#define CAT(a, b) a##b
+/ {
+	soc {
+		uart0: serial@1000 {
+			reg = REG(0x0, 0x100);
+			interrupts = <IRQ(32)>;
+#ifdef HAS_DMA
+			dmas = <&dma 1>;
+#else
+			no-dma;
+#endif
+			CAT(clock, s) = <CAT(0x, 10)>;
+			label = "BASE stays" ; // BASE in a comment
+		};
+	};
+};
+''',
+    'board.dts': '''/dts-v1/;
+#define HAS_DMA
+#include "soc.dtsi"
+/* block comment
+   spanning lines #define NOPE 1 */
+#if defined(HAS_DMA) && (BASE > 0x800) || NOPE
+/ { model = "dma board"; };
+#elif 1
+/ { model = "other"; };
+#endif
+#undef HAS_DMA
+#ifndef HAS_DMA
+&uart0 { status = "okay"; rate = <SPEED>; };
+#endif
+''',
+}
+
+@pytest.fixture
+def tree(tmp_path):
+    for name, content in FILES.items():
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+    return tmp_path
+
+def cpp(directory, filepath, *defines):
+    if shutil.which('cpp') is None:
+        pytest.skip('cpp is not installed')
+    command = ['cpp', '-nostdinc', '-undef', '-x', 'assembler-with-cpp', '-P', '-I', 'include']
+    command += [f'-D{define}' for define in defines] + [filepath]
+    return subprocess.run(command, cwd=directory, capture_output=True, text=True, check=True).stdout
+
+def tokens(text):
+    return text.split()
+
+def test_file_matches_cpp(tree, monkeypatch):
+    monkeypatch.chdir(tree)
+    preprocessor = DTSPreprocessor(['include'], ['SPEED=115200', 'HAS_DMA'])
+    text, sources, headers = preprocessor.preprocess('soc.dtsi', FILES['soc.dtsi'])
+    assert tokens(text) == tokens(cpp(tree, 'soc.dtsi', 'SPEED=115200', 'HAS_DMA'))
+    assert sources == []
+    assert headers == ['include/dt-bindings/irq.h']
+
+def test_merged_tree_matches_cpp(tree, monkeypatch):
+    # DTS includes stay separate files here, so compare the merged trees
+    monkeypatch.chdir(tree)
+    parser = MultiFileDTSParser(preprocess=True, include_dirs=['include'], defines=['SPEED=115200'])
+    parser.parse_file('board.dts')
+    parser.resolve_all_references()
+    merged = DTSTreeMerger(parser.file_trees('board.dts')).root
+    expected = DTSTreeMerger(DTSParser(cpp(tree, 'board.dts', 'SPEED=115200')).parse()).root
+    assert merged.to_dict() == expected.to_dict()
+
+@pytest.mark.parametrize('expression, value', [
+    ('1 + 2 * 3', 7), ('-7 / 2', -3), ('-7 % 2', -1), ('1 ? 2 : 3', 2), ('0 ? 2 : 0 ? 4 : 5', 5),
+    ('(1 << 4) | 1', 17), ('0x10 > 010', 1), ("'a'", 97), ('~0 & 0xff', 255), ('UNDEFINED == 0', 1),
+])
+def test_if_arithmetic_matches_c(expression, value):
+    assert _pp_evaluate(expression) == value
@@ -0,0 +1,33 @@
+"""Tests for <&name> node inclusion."""
+
+from dts_visualizer.dts_visualizer import DTSParser, DTSTreeIndex, iter_json
+
+def parse(source):
+    return DTSParser(source).parse()
+
+def assert_acyclic(node, path=()):
+    assert all(node is not ancestor for ancestor in path)
+    for child in node.children:
+        assert_acyclic(child, path + (node,))
+
+def test_inclusion_shares_block_children():
+    root = parse('/ { top { <&blk>; own = <1>; }; };\n&blk { own = <2>; extra; sub { x = <3>; }; };\n')
+    top = root.children[0].children[0]
+    assert top.properties == {'own': '<1>', 'extra': True}
+    assert [child.name for child in top.children] == ['sub']
+    assert top.children[0] is root.children[1].children[0]
+
+def test_self_inclusion_is_skipped(capsys):
+    root = parse('/ { foo: foo { b = <0>; }; };\n&foo { a = <1>; child { <&foo>; }; };\n')
+    assert 'would include the node in itself' in capsys.readouterr().out
+    assert_acyclic(root)
+    assert not root.children[1].children[0].children
+    assert '"child"' in ''.join(iter_json(root))
+    DTSTreeIndex(root)
+
+def test_mutual_inclusion_is_skipped(capsys):
+    root = parse('/ { top { <&a>; }; };\n&a { x { <&b>; }; };\n&b { y { <&a>; }; };\n')
+    assert 'would include the node in itself' in capsys.readouterr().out
+    assert_acyclic(root)
+    ''.join(iter_json(root))
+    DTSTreeIndex(root)
@@ -0,0 +1,95 @@
+"""Tests for incremental re-parsing: reparse() must give the tree a fresh parser gives."""
+
+import os
+
+import pytest
+
+from dts_visualizer.dts_visualizer import MultiFileDTSParser, iter_json
+
+BOARD = '#include "soc.dtsi"\n/dts-v1/;\n/ { y { <&u>; }; };\n'
+SOC = '/ { u: uart { status = "disabled"; }; };\n&u { a = <1>; };\n'
+
+def write(directory, name, text):
+    with open(os.path.join(directory, name), 'w') as f:
+        f.write(text)
+
+def parse(path, **options):
+    parser = MultiFileDTSParser(**options)
+    parser.parse_file(path)
+    parser.resolve_all_references()
+    return parser
+
+def state(parser):
+    """Everything reparse() has to keep in step with a fresh parse."""
+    return (''.join(iter_json(parser.root, indent=None)), list(parser.parsed_files),
+            list(parser.file_blocks), sorted(parser.references),
+            {name: len(blocks) for name, blocks in parser.overlays.items()})
+
+def assert_fresh(parser, path, **options):
+    assert state(parser) == state(parse(path, **options))
+
+@pytest.fixture
+def board(tmp_path):
+    write(tmp_path, 'board.dts', BOARD)
+    write(tmp_path, 'soc.dtsi', SOC)
+    return str(tmp_path / 'board.dts')
+
+def node_y(parser, path):
+    root = parser.parsed_files[os.path.normpath(path)]
+    return next(child for child in root.children[0].children if child.name == 'y')
+
+def test_edited_block(board):
+    parser = parse(board)
+    soc = os.path.join(os.path.dirname(board), 'soc.dtsi')
+    write(os.path.dirname(board), 'soc.dtsi', SOC.replace('<1>', '<2>'))
+    affected = parser.reparse([soc])
+    assert affected == [soc, board]
+    assert node_y(parser, board).properties == {'a': '<2>'}
+    assert_fresh(parser, board)
+
+def test_added_block(board):
+    directory = os.path.dirname(board)
+    write(directory, 'soc.dtsi', '/ { u: uart { }; };\n')
+    parser = parse(board)
+    assert node_y(parser, board).properties == {}
+    write(directory, 'soc.dtsi', SOC.replace('<1>', '<2>'))
+    parser.reparse([os.path.join(directory, 'soc.dtsi')])
+    assert node_y(parser, board).properties == {'a': '<2>'}
+    assert_fresh(parser, board)
+
+def test_deleted_and_recreated_include(board, capsys):
+    directory = os.path.dirname(board)
+    soc = os.path.join(directory, 'soc.dtsi')
+    parser = parse(board)
+    os.remove(soc)
+    assert parser.reparse([soc]) == [board]
+    assert soc not in parser.parsed_files
+    assert capsys.readouterr().out.count('Could not find file') == 1
+    assert_fresh(parser, board)
+    
+    write(directory, 'soc.dtsi', SOC)
+    parser.reparse([soc])
+    assert node_y(parser, board).properties == {'a': '<1>'}
+    assert_fresh(parser, board)
+
+def test_dropped_and_added_include(board):
+    directory = os.path.dirname(board)
+    parser = parse(board)
+    write(directory, 'board.dts', BOARD.replace('#include "soc.dtsi"\n', ''))
+    parser.reparse([board])
+    assert list(parser.parsed_files) == [board]
+    assert_fresh(parser, board)
+    
+    write(directory, 'board.dts', BOARD)
+    parser.reparse([board])
+    assert_fresh(parser, board)
+
+def test_changed_header_when_preprocessing(tmp_path):
+    write(tmp_path, 'rate.h', '#define RATE 1\n')
+    write(tmp_path, 'board.dts', '#include "rate.h"\n/dts-v1/;\n/ { clk { rate = <RATE>; }; };\n')
+    board = str(tmp_path / 'board.dts')
+    parser = parse(board, preprocess=True)
+    write(tmp_path, 'rate.h', '#define RATE 2\n')
+    assert parser.reparse([str(tmp_path / 'rate.h')]) == [board]
+    assert parser.parsed_files[board].children[0].children[0].properties == {'rate': '<2>'}
+    assert_fresh(parser, board, preprocess=True)
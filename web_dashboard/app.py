@@ -7,16 +7,44 @@ import os
 import sys
 import json
 import io
-import tempfile
-from flask import Flask, render_template, request, jsonify, redirect, url_for, send_file
+import asyncio
+import itertools
+import codecs
+import re
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from flask import Flask, Request, Response, g, render_template, request, jsonify, send_file
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.exceptions import BadRequest, ClientDisconnected, HTTPException, RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from werkzeug.wsgi import get_content_length
 
 # Add parent directory to sys.path to import dts_visualizer
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from dts_visualizer.dts_visualizer import MultiFileDTSParser, DTSVisualizer, DTSNode, DTSParser
+from dts_visualizer.dts_visualizer import MultiFileDTSParser, DTSVisualizer, DTSNode, DTSParseCache, DTSMetrics, DTBWriter, DTSTreeIndex, DTSQuery, DTSTreeMerger, DTSReferenceGraph, diff_trees, display_properties, iter_json
 
 # Create a subclass of MultiFileDTSParser that can parse strings
 class InMemoryMultiFileDTSParser(MultiFileDTSParser):
-    """A subclass of MultiFileDTSParser that can parse strings directly."""
+    """A subclass of MultiFileDTSParser that parses strings and uploaded bundles.
+    
+    Files are read from ``files``, a mapping of virtual paths to raw content,
+    so includes are resolved against the other files of the same upload.
+    Uploads using the C preprocessor are preprocessed, searching the root of
+    the upload and every directory named ``include`` for ``#include <...>``.
+    """
+    
+    def __init__(self, files=None, job=None, metrics=None):
+        files = {os.path.normpath(path): content for path, content in (files or {}).items()}
+        super().__init__(metrics=metrics, preprocess=uses_preprocessor(files), include_dirs=include_dirs(files))
+        self.files = files
+        self.job = job  # ParseJob to report progress to, if parsing in the background
     
     def parse_string(self, content: str, virtual_path: str) -> DTSNode:
         """Parse a DTS string content, using a virtual filepath for reference."""
@@ -26,20 +54,36 @@ class InMemoryMultiFileDTSParser(MultiFileDTSParser):
         if virtual_path in self.parsed_files:
             return self.parsed_files[virtual_path]
         
-        # Parse the content
-        parser = DTSParser(content, self.references, self.includes)
-        node = parser.parse()
-        
-        # Update references
-        self.references.update(parser.references)
-        
-        # Cache the parsed result
-        self.parsed_files[virtual_path] = node
+        self.files[virtual_path] = content.encode('utf-8')
+        return self.parse_file(virtual_path)
+    
+    def parse_bundle(self) -> DTSNode:
+        """Parse every DTS file of the bundle and return them under one root.
         
-        # Add to the multi-root
-        self.root.add_child(node)
+        Each file's tree is placed under a node named after its path, in
+        upload order. Includes are parsed along with the file including them.
+        """
+        for path in self.files:
+            if path.endswith(DTS_SUFFIXES):
+                self.parse_file(path)
         
-        return node
+        bundle = DTSNode("bundle")
+        for path in self.files:
+            if path in self.parsed_files:
+                file_node = DTSNode(path, bundle)
+                file_node.add_child(self.parsed_files[path])
+                bundle.add_child(file_node)
+        return bundle
+    
+    def _read_file(self, filepath: str):
+        """Return a file's content from the upload, or None if it is not part of it."""
+        if self.job is not None:
+            self.job.advance()
+        return self.files.get(filepath)
+    
+    def _file_exists(self, filepath: str) -> bool:
+        """Whether a file is part of the upload."""
+        return filepath in self.files
 
 # Create a subclass of DTSVisualizer that doesn't write to disk
 class InMemoryDTSVisualizer(DTSVisualizer):
@@ -52,14 +96,676 @@ class InMemoryDTSVisualizer(DTSVisualizer):
     def export_json(self, output_file=None):
         """Override to prevent console output when used from the web dashboard."""
         if output_file:
-            tree_dict = self.root.to_dict()
             with open(output_file, 'w') as f:
-                json.dump(tree_dict, f, indent=2)
+                for chunk in iter_json(self.root):
+                    f.write(chunk)
         return self.root.to_dict()
 
+class DashboardRequest(Request):
+    """A request whose form may already have been read by the ASGI front end.
+    
+    ``DashboardASGI`` decodes upload bodies as they arrive and passes the
+    result in the environ as ``easydt.form``, so views see the same
+    ``request.form`` and ``request.files`` as under a WSGI server.
+    """
+    
+    def _load_form_data(self):
+        streamed = self.environ.get('easydt.form')
+        if streamed is None:
+            return super()._load_form_data()
+        # Set the cached properties directly, as werkzeug does after parsing
+        self.__dict__['stream'] = io.BytesIO()
+        self.__dict__['form'], self.__dict__['files'] = streamed
+
+class ResultCache:
+    """Parsed trees addressed by a hash of the uploaded content.
+    
+    The most recently used ``max_trees`` results are kept in memory. When a
+    ``DTSParseCache`` is given as ``disk``, results are also written there so
+    they outlive eviction and server restarts. Query indexes, reference
+    graphs and merged trees are built on first use and kept with their
+    tree, so repeated queries and diffs against the same result reuse them.
+    """
+    
+    def __init__(self, max_trees=32, disk=None):
+        self.max_trees = max_trees
+        self.disk = disk
+        self._trees = OrderedDict()
+        self._derived = {}  # result id -> {kind: index, graph or merged tree}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def key(content: bytes) -> str:
+        """Result id for an upload's raw content."""
+        return DTSParseCache.key(b'web-result\0' + content)
+    
+    def add(self, result_id: str, node: DTSNode):
+        """Store a resolved tree under its id."""
+        self._remember(result_id, node)
+        if self.disk is not None:
+            self.disk.store(result_id, node, [])
+    
+    def get(self, result_id: str):
+        """Return a stored tree, or None if it is unknown or was evicted."""
+        if not RESULT_ID_RE.fullmatch(result_id):
+            return None
+        with self._lock:
+            node = self._trees.get(result_id)
+            if node is not None:
+                self._trees.move_to_end(result_id)
+                return node
+        if self.disk is not None:
+            entry = self.disk.load(result_id)
+            if entry is not None:
+                node = entry[0]
+                self._remember(result_id, node)
+                return node
+        return None
+    
+    def query_index(self, result_id: str):
+        """Return the DTSQueryIndex of a stored tree, or None if it is unknown or was evicted."""
+        return self._derive(result_id, 'query', lambda node: DTSTreeIndex(node).query_index())
+    
+    def reference_graph(self, result_id: str):
+        """Return the DTSReferenceGraph of a stored tree, or None if it is unknown or was evicted."""
+        return self._derive(result_id, 'references', lambda node: DTSReferenceGraph(self.query_index(result_id)))
+    
+    def index_paths(self, result_id: str):
+        """Return the index path of every node of a stored tree, or None if it is unknown or was evicted."""
+        return self._derive(result_id, 'paths', index_paths)
+    
+    def merged_tree(self, result_id: str):
+        """Return a stored tree merged as dtc would compile it, or None if it is unknown or was evicted.
+        
+        Its subtree hashes are cached on it, so diffing against the same
+        result again only hashes the other side.
+        """
+        return self._derive(result_id, 'merged', lambda node: DTSTreeMerger(node, strict=False).root)
+    
+    def _derive(self, result_id: str, kind: str, build):
+        """Return something built from a stored tree, building it on first use."""
+        node = self.get(result_id)
+        if node is None:
+            return None
+        with self._lock:
+            derived = self._derived.get(result_id, {}).get(kind)
+        if derived is None:
+            derived = build(node)
+            with self._lock:
+                if result_id in self._trees:
+                    self._derived.setdefault(result_id, {})[kind] = derived
+        return derived
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._trees)
+    
+    def _remember(self, result_id: str, node: DTSNode):
+        with self._lock:
+            self._trees[result_id] = node
+            self._trees.move_to_end(result_id)
+            while len(self._trees) > self.max_trees:
+                evicted, _ = self._trees.popitem(last=False)
+                self._derived.pop(evicted, None)
+
+class ParseCancelled(Exception):
+    """Raised inside a parse job once it has been cancelled."""
+
+class ParseJob:
+    """An upload being parsed in the background."""
+    
+    def __init__(self, files: dict, result_id: str):
+        self.id = uuid.uuid4().hex
+        self.files = files
+        self.result_id = result_id
+        self.state = 'queued'  # queued, parsing, resolving, done, failed or cancelled
+        self.error = None
+        self.files_parsed = 0
+        self.files_total = sum(1 for path in files if path.endswith(DTS_SUFFIXES)) or len(files)
+        self._cancelled = threading.Event()
+    
+    def advance(self):
+        """Count one more file read, stopping the job if it was cancelled."""
+        if self._cancelled.is_set():
+            raise ParseCancelled()
+        self.files_parsed = min(self.files_parsed + 1, self.files_total)
+    
+    def cancel(self):
+        """Ask the job to stop; it stops before the next file it reads."""
+        self._cancelled.set()
+        if self.state == 'queued':
+            self.state = 'cancelled'
+    
+    def to_dict(self) -> dict:
+        result = {
+            'id': self.id,
+            'state': self.state,
+            'files_parsed': self.files_parsed,
+            'files_total': self.files_total
+        }
+        if self.state == 'done':
+            node = result_cache.get(self.result_id)
+            result['tree_id'] = self.result_id
+            result['root'] = node_summary(node, '') if node is not None else None
+        elif self.state == 'failed':
+            result['error'] = self.error
+        return result
+
+class JobQueue:
+    """Parses uploads on a pool of worker threads, keeping the most recent jobs."""
+    
+    def __init__(self, max_workers=2, max_jobs=256):
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='parse-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def submit(self, files: dict, result_id: str) -> ParseJob:
+        """Queue an upload for parsing and return its job."""
+        job = ParseJob(files, result_id)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        self._executor.submit(self._run, job)
+        return job
+    
+    def get(self, job_id: str):
+        """Return a job, or None if it is unknown or was forgotten."""
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def _run(self, job: ParseJob):
+        if job.state == 'cancelled':
+            return
+        job.state = 'parsing'
+        try:
+            node = parse_upload(job.files, job)
+            result_cache.add(job.result_id, node)
+            job.state = 'done'
+        except ParseCancelled:
+            job.state = 'cancelled'
+        except Exception as e:
+            job.error = str(e)
+            job.state = 'failed'
+        finally:
+            # The parsed result is cached; the raw upload is no longer needed
+            job.files = None
+
+class BoundedExecutor:
+    """Runs blocking calls for the ASGI front end on a few threads, with backpressure.
+    
+    Calls wait on the event loop for a free worker rather than in the pool's
+    queue, so a request whose client has gone is dropped before it runs.
+    ``reserve`` keeps the request bodies held in memory to about
+    ``max_bytes``: each chunk is accounted for as it arrives, and once the
+    budget is spent an upload is not read further until memory is freed,
+    which slows its client down through flow control instead of buffering
+    it. Only bytes actually received count, so slow uploads do not hold back
+    fast ones; the oldest upload may always go over the budget, so uploads
+    waiting on each other cannot deadlock.
+    """
+    
+    def __init__(self, max_workers=2, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='asgi-parse')
+        self._workers = asyncio.Semaphore(max_workers)
+        self._reserved = 0
+        self._released = asyncio.Condition()
+        self._uploads = OrderedDict()  # Token of each upload holding budget -> bytes held, oldest first
+        self._tokens = itertools.count()
+    
+    async def run(self, function, *args):
+        """Run a blocking function on a worker once one is free."""
+        async with self._workers:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+    
+    @asynccontextmanager
+    async def reserve(self):
+        """Account one request body against the budget until the block exits.
+
+        Yields ``take(size)``, to await for every chunk received; it returns
+        once the chunk fits in the budget.
+        """
+        token = next(self._tokens)
+        self._uploads[token] = 0
+        
+        async def take(size: int):
+            async with self._released:
+                await self._released.wait_for(
+                    lambda: self._reserved + size <= self.max_bytes or next(iter(self._uploads)) == token)
+                self._reserved += size
+                self._uploads[token] += size
+        
+        try:
+            yield take
+        finally:
+            async with self._released:
+                self._reserved -= self._uploads.pop(token)
+                self._released.notify_all()
+
+class DashboardASGI:
+    """ASGI front end of the dashboard, for uvicorn or another ASGI server.
+    
+    Request bodies are received on the event loop before the Flask app sees
+    them, so a slow client holds no thread while it sends. Uploads to
+    /api/visualize are decoded part by part as they arrive and their view,
+    which parses them, runs on ``executor``; all other requests run on the
+    loop's default thread pool, so browsing stays responsive while large
+    uploads are parsed. Response bodies are sent in chunks of about
+    ``CHUNK_BYTES``, generated on a thread as the client reads them.
+    """
+    
+    UPLOAD_PATHS = ('/api/visualize',)
+    CHUNK_BYTES = 64 * 1024
+    
+    def __init__(self, flask_app: Flask, executor: BoundedExecutor):
+        self.app = flask_app
+        self.executor = executor
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        
+        environ = wsgi_environ(scope)
+        limit = self.app.config['MAX_CONTENT_LENGTH']
+        length = get_content_length(environ)
+        mimetype, options = parse_options_header(environ.get('CONTENT_TYPE', ''))
+        try:
+            if limit is not None and length is not None and length > limit:
+                raise RequestEntityTooLarge()
+            if scope['method'] == 'POST' and scope['path'] in self.UPLOAD_PATHS and mimetype == 'multipart/form-data':
+                async with self.executor.reserve() as take:
+                    environ['easydt.form'] = await receive_form(receive, options.get('boundary', '').encode('latin-1'),
+                                                                limit, take)
+                    response = await self.executor.run(self._call, environ)
+            else:
+                environ['wsgi.input'] = io.BytesIO(await receive_body(receive, limit))
+                response = await asyncio.get_running_loop().run_in_executor(None, self._call, environ)
+        except ClientDisconnected:
+            return
+        except HTTPException as e:
+            await self._send_error(send, e)
+            return
+        await self._send_response(send, *response)
+    
+    def _call(self, environ: dict):
+        """Run the Flask app on a request, returning its status, headers and body iterable."""
+        started = []
+        body = self.app(environ, lambda status, headers, exc_info=None: started.extend((status, headers)))
+        return started[0], started[1], body
+    
+    async def _send_response(self, send, status: str, headers: list, body):
+        loop = asyncio.get_running_loop()
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            })
+            chunks = iter(body)
+            while True:
+                chunk = await loop.run_in_executor(None, self._next_chunk, chunks)
+                if not chunk:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            # Runs the app's call_on_close callbacks, such as the latency metrics
+            if hasattr(body, 'close'):
+                body.close()
+    
+    def _next_chunk(self, chunks) -> bytes:
+        """Join the next body chunks into one of about CHUNK_BYTES; b'' once the body is done."""
+        buffer = bytearray()
+        for chunk in chunks:
+            buffer += chunk
+            if len(buffer) >= self.CHUNK_BYTES:
+                break
+        return bytes(buffer)
+    
+    @staticmethod
+    async def _send_error(send, error: HTTPException):
+        body = json.dumps({'error': error.description}).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': error.code,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode('latin-1'))],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+    
+    @staticmethod
+    async def _lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+def wsgi_environ(scope: dict) -> dict:
+    """The WSGI environ of an ASGI HTTP request, with an empty body."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+async def receive_body(receive, limit) -> bytes:
+    """Receive a whole ASGI request body, of at most ``limit`` bytes."""
+    body = bytearray()
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ClientDisconnected()
+        body += message.get('body', b'')
+        if limit is not None and len(body) > limit:
+            raise RequestEntityTooLarge()
+        more_body = message.get('more_body', False)
+    return bytes(body)
+
+async def receive_form(receive, boundary: bytes, limit, take=None) -> tuple:
+    """Decode a multipart/form-data ASGI request body as it arrives into (form, files).
+    
+    Files are collected in memory as their data comes in, the way
+    ``read_upload`` expects them, and text fields are decoded from UTF-8
+    chunk by chunk. The body may hold at most ``limit`` bytes. ``take``,
+    from ``BoundedExecutor.reserve``, is awaited with the size of every
+    chunk before the next one is received.
+    """
+    if not boundary:
+        raise BadRequest('Missing multipart boundary')
+    decoder = MultipartDecoder(boundary, limit, max_parts=1000)
+    form, files = MultiDict(), MultiDict()
+    received = 0
+    part = text = content = None
+    while True:
+        try:
+            event = decoder.next_event()
+        except ValueError as e:
+            raise BadRequest(str(e))
+        if isinstance(event, NeedData):
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            chunk = message.get('body', b'')
+            received += len(chunk)
+            if limit is not None and received > limit:
+                raise RequestEntityTooLarge()
+            if take is not None:
+                await take(len(chunk))
+            decoder.receive_data(chunk)
+            if not message.get('more_body', False):
+                decoder.receive_data(None)
+        elif isinstance(event, Field):
+            part, text = event, []
+            decode = codecs.getincrementaldecoder('utf-8')('replace').decode
+        elif isinstance(event, File):
+            part, content = event, io.BytesIO()
+        elif isinstance(event, Data):
+            if isinstance(part, Field):
+                text.append(decode(event.data, final=not event.more_data))
+                if not event.more_data:
+                    form.add(part.name, ''.join(text))
+            else:
+                content.write(event.data)
+                if not event.more_data:
+                    content.seek(0)
+                    files.add(part.name, FileStorage(content, part.filename, part.name, headers=part.headers))
+        elif isinstance(event, Epilogue):
+            return form, files
+
+def read_upload(uploads) -> dict:
+    """Collect uploaded files into a {path: content} mapping, unpacking tar and zip archives."""
+    files = {}
+    remaining = MAX_BUNDLE_BYTES
+    for upload in uploads:
+        data = upload.read()
+        name = upload.filename.lower()
+        if name.endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        remaining -= info.file_size
+                        if remaining < 0:
+                            break
+                        files[info.filename] = archive.read(info)
+        elif name.endswith(TAR_SUFFIXES):
+            with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+                for member in archive:
+                    if member.isfile():
+                        remaining -= member.size
+                        if remaining < 0:
+                            break
+                        files[member.name] = archive.extractfile(member).read()
+        else:
+            remaining -= len(data)
+            files[upload.filename] = data
+        if remaining < 0:
+            raise ValueError(f'Upload is larger than {MAX_BUNDLE_BYTES // (1024 * 1024)}MB unpacked')
+    
+    # Archive paths are only used as names; keep them relative
+    return {os.path.normpath(path.lstrip('/')): content for path, content in files.items()}
+
+def uses_preprocessor(files: dict) -> bool:
+    """Whether an upload needs the C preprocessor: it has headers, macros or conditionals."""
+    return any(path.endswith('.h') or any(marker in content for marker in PREPROCESSOR_MARKERS)
+               for path, content in files.items())
+
+def include_dirs(files: dict) -> list:
+    """Search path of an upload: its root, then every directory named ``include`` in it."""
+    directories = ['']
+    for path in files:
+        parts = path.split(os.sep)[:-1]
+        for i, part in enumerate(parts):
+            directory = os.path.join(*parts[:i + 1])
+            if part == 'include' and directory not in directories:
+                directories.append(directory)
+    return directories
+
+def upload_key(files: dict) -> str:
+    """Result id for an upload; a single file is identified by its content alone."""
+    if len(files) == 1:
+        return ResultCache.key(next(iter(files.values())))
+    digest = io.BytesIO()
+    for path in sorted(files):
+        content = files[path]
+        digest.write(f"{path}\0{len(content)}\0".encode('utf-8'))
+        digest.write(content)
+    return ResultCache.key(digest.getvalue())
+
+def parse_upload(files: dict, job=None) -> DTSNode:
+    """Parse and resolve an upload, returning the tree to show for it."""
+    multi_parser = InMemoryMultiFileDTSParser(files, job, dts_metrics)
+    if len(multi_parser.files) == 1:
+        node = multi_parser.parse_file(next(iter(multi_parser.files)))
+    else:
+        node = multi_parser.parse_bundle()
+    if job is not None:
+        job.advance()
+        job.state = 'resolving'
+    multi_parser.resolve_all_references()
+    return node
+
+class LatencyHistogram:
+    """Prometheus-style histogram of request latencies by endpoint, method and status."""
+    
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    
+    def __init__(self):
+        self._series = {}  # (endpoint, method, status) -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+    
+    def observe(self, labels: tuple, seconds: float):
+        """Record one request."""
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.BUCKETS), 0.0, 0]
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    series[0][i] += 1
+            series[1] += seconds
+            series[2] += 1
+    
+    def render(self, name: str) -> list:
+        """Return the histogram in the Prometheus text format, as lines."""
+        lines = [f'# HELP {name} Request latency in seconds, until the response body is sent.',
+                 f'# TYPE {name} histogram']
+        with self._lock:
+            for (endpoint, method, status), (buckets, total, count) in sorted(self._series.items()):
+                labels = f'endpoint="{endpoint}",method="{method}",status="{status}"'
+                for bound, bucket_count in zip(self.BUCKETS, buckets):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {bucket_count}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f'{name}_sum{{{labels}}} {total}')
+                lines.append(f'{name}_count{{{labels}}} {count}')
+        return lines
+
+def render_metrics() -> str:
+    """All dashboard metrics in the Prometheus text exposition format."""
+    snapshot = dts_metrics.snapshot()
+    lines = [
+        '# HELP easydt_phase_seconds_total Time spent in each parsing and export phase.',
+        '# TYPE easydt_phase_seconds_total counter',
+    ]
+    lines += [f'easydt_phase_seconds_total{{phase="{name}"}} {phase["seconds"]}'
+              for name, phase in snapshot['phases'].items()]
+    lines += [
+        '# HELP easydt_phase_calls_total Number of times each phase ran.',
+        '# TYPE easydt_phase_calls_total counter',
+    ]
+    lines += [f'easydt_phase_calls_total{{phase="{name}"}} {phase["calls"]}'
+              for name, phase in snapshot['phases'].items()]
+    for name, value in snapshot['counters'].items():
+        lines += [f'# TYPE easydt_{name}_total counter', f'easydt_{name}_total {value}']
+    lines += [
+        '# HELP easydt_cached_results Parsed results held in memory.',
+        '# TYPE easydt_cached_results gauge',
+        f'easydt_cached_results {len(result_cache)}',
+    ]
+    lines += request_latency.render('easydt_request_duration_seconds')
+    return '\n'.join(lines) + '\n'
+
+def find_node_by_path(root: DTSNode, path: str):
+    """Find a node by its index path, e.g. "0/3/1" (child positions from the root)."""
+    node = root
+    for part in filter(None, path.split('/')):
+        if not part.isdigit() or int(part) >= len(node.children):
+            return None
+        node = node.children[int(part)]
+    return node
+
+def index_paths(root: DTSNode) -> dict:
+    """Map every node below root to its index path (see find_node_by_path)."""
+    paths = {root: ''}
+    stack = [(root, '')]
+    while stack:
+        node, path = stack.pop()
+        prefix = path + '/' if path else ''
+        for i, child in enumerate(node.children):
+            paths[child] = f"{prefix}{i}"
+            stack.append((child, paths[child]))
+    return paths
+
+def link_summary(paths: dict, name: str, reference: str, node) -> dict:
+    """Describe one reference between nodes, with a summary of the node at its other end (None if dangling)."""
+    path = paths.get(node) if node is not None else None
+    return {
+        'property': name,
+        'reference': reference,
+        'node': node_summary(node, path) if path is not None else None
+    }
+
+def node_summary(node: DTSNode, path: str) -> dict:
+    """Describe a node without its properties or children."""
+    return {
+        'name': node.name,
+        'path': path,
+        'labels': list(node.labels),
+        'references': list(node.references),
+        'property_count': len(node.properties),
+        'child_count': len(node.children)
+    }
+
 app = Flask(__name__)
+app.request_class = DashboardRequest
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
 
+# Result ids are hex sha256 digests of the upload
+RESULT_ID_RE = re.compile(r'[0-9a-f]{64}')
+
+# Files parsed from bundles, and archive types unpacked on upload
+DTS_SUFFIXES = ('.dts', '.dtsi', '.dtb')
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+MAX_BUNDLE_BYTES = 64 * 1024 * 1024
+
+# Directives that only the C preprocessor handles
+PREPROCESSOR_MARKERS = (b'#define', b'#if', b'#include <')
+
+# Uploads larger than this are parsed in the background
+BACKGROUND_BYTES = 1024 * 1024
+
+# Parsed trees for lazy browsing and downloads, addressed by result id
+result_cache = ResultCache()
+
+# Background parsing of large uploads
+job_queue = JobQueue()
+
+# ASGI application for --asgi (or e.g. `uvicorn app:asgi_app`), parsing streamed uploads on a bounded pool
+asgi_app = DashboardASGI(app, BoundedExecutor())
+
+# Phase timings and counters of all parses, and request latencies, for /metrics
+dts_metrics = DTSMetrics()
+request_latency = LatencyHistogram()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    """Observe the request's latency once its (possibly streamed) body has been sent."""
+    start = g.get('request_start')
+    if start is not None:
+        labels = (request.endpoint or 'unknown', request.method, str(response.status_code))
+        response.call_on_close(lambda: request_latency.observe(labels, time.perf_counter() - start))
+    return response
+
+def not_modified(result_id: str):
+    """Return a 304 response if the client already has this result, else None."""
+    if request.if_none_match.contains(result_id):
+        response = Response(status=304)
+        response.set_etag(result_id)
+        return response
+    return None
+
 @app.route('/')
 def index():
     """Render the dashboard home page"""
@@ -76,41 +782,196 @@ def api_visualize():
     if 'dts_file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
     
-    file = request.files['dts_file']
-    if file.filename == '':
+    uploads = [file for file in request.files.getlist('dts_file') if file.filename != '']
+    if not uploads:
         return jsonify({'error': 'No file selected'}), 400
     
     try:
-        # Read file directly from request into memory
-        file_content = file.read().decode('utf-8')
-        
-        # Parse the DTS file in memory
-        multi_parser = InMemoryMultiFileDTSParser()
-        # Create a virtual file path for reference
-        virtual_path = os.path.normpath(file.filename)
-        multi_parser.parse_string(file_content, virtual_path)
-        multi_parser.resolve_all_references()
-        
-        # Get the tree
-        node = multi_parser.parsed_files[virtual_path]
-        
-        # Export to dict in memory (no disk writes)
-        visualizer = InMemoryDTSVisualizer(node)
-        dts_data = visualizer.export_json_to_dict()
-        
-        return jsonify({
-            'success': True,
-            'data': dts_data
-        })
+        # Read the files, or the files inside uploaded archives, into memory
+        try:
+            files = read_upload(uploads)
+        except (ValueError, tarfile.TarError, zipfile.BadZipFile) as e:
+            return jsonify({'error': str(e)}), 400
+        if not files:
+            return jsonify({'error': 'No files in upload'}), 400
+        
+        # Identical uploads share one result, so only parse unseen content
+        result_id = upload_key(files)
+        lazy = request.form.get('mode') == 'lazy'
+        # The lazy and full responses differ, so each gets its own tag
+        etag = f'{result_id}-lazy' if lazy else result_id
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        node = result_cache.get(result_id)
+        if node is None:
+            # Hand large uploads to the job queue instead of tying up this request
+            if request.form.get('background') or sum(map(len, files.values())) > BACKGROUND_BYTES:
+                job = job_queue.submit(files, result_id)
+                return jsonify({'success': True, 'job': job.to_dict()}), 202
+            
+            node = parse_upload(files)
+            result_cache.add(result_id, node)
+        
+        # In lazy mode return only the root; the client fetches the rest
+        # node by node from /api/tree/<tree_id>/node
+        if lazy:
+            response = jsonify({
+                'success': True,
+                'tree_id': result_id,
+                'root': node_summary(node, '')
+            })
+            response.set_etag(etag)
+            return response
+        
+        # Stream the tree as compact JSON instead of building it as a dict first
+        def generate():
+            yield '{"success":true,"data":'
+            yield from dts_metrics.time_chunks('export_json', iter_json(node, indent=None))
+            yield '}'
+        
+        response = Response(generate(), mimetype='application/json')
+        response.set_etag(result_id)
+        return response
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/download-json', methods=['POST'])
+@app.route('/api/tree/<tree_id>/node')
+def api_tree_node(tree_id):
+    """API endpoint returning one node's properties and a page of child summaries"""
+    root = result_cache.get(tree_id)
+    if root is None:
+        return jsonify({'error': 'Unknown or expired tree'}), 404
+    
+    # Results never change, so the id is a valid tag for every node page
+    cached = not_modified(tree_id)
+    if cached is not None:
+        return cached
+    
+    path = request.args.get('path', '')
+    node = find_node_by_path(root, path)
+    if node is None:
+        return jsonify({'error': 'No node at this path'}), 404
+    
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    prefix = path.strip('/') + '/' if path.strip('/') else ''
+    children = node.children[offset:offset + limit]
+    
+    result = node_summary(node, path)
+    result['properties'] = dict(display_properties(node.properties))
+    
+    # References from and to the node, so the page can follow dependencies
+    if request.args.get('links') != '0':
+        graph = result_cache.reference_graph(tree_id)
+        paths = result_cache.index_paths(tree_id)
+        result['links'] = [link_summary(paths, *link) for link in graph.links(node)]
+        result['backlinks'] = [link_summary(paths, *link) for link in graph.backlinks(node)]
+    result['offset'] = offset
+    result['children'] = [node_summary(child, f"{prefix}{offset + i}") for i, child in enumerate(children)]
+    response = jsonify({'success': True, 'node': result})
+    response.set_etag(tree_id)
+    return response
+
+@app.route('/api/query')
+def api_query():
+    """API endpoint returning only the nodes of a stored tree that match a selector"""
+    tree_id = request.args.get('tree_id', '')
+    query_index = result_cache.query_index(tree_id)
+    if query_index is None:
+        return jsonify({'error': 'Unknown or expired tree'}), 404
+    
+    cached = not_modified(tree_id)
+    if cached is not None:
+        return cached
+    
+    try:
+        query = DTSQuery(request.args.get('q', ''))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    with dts_metrics.phase('query'):
+        matches = query.run(query_index)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    properties = request.args.get('properties', '1') != '0'
+    response = jsonify({
+        'success': True,
+        'query': query.selector,
+        'total': len(matches),
+        'offset': offset,
+        'nodes': [query_index.describe(node, properties) for node in matches[offset:offset + limit]],
+    })
+    response.set_etag(tree_id)
+    return response
+
+@app.route('/api/diff')
+def api_diff():
+    """API endpoint listing the differences between two stored trees by path"""
+    old_id = request.args.get('old', '')
+    new_id = request.args.get('new', '')
+    old = result_cache.merged_tree(old_id)
+    new = result_cache.merged_tree(new_id)
+    if old is None or new is None:
+        return jsonify({'error': 'Unknown or expired tree'}), 404
+    
+    # Both results are immutable, so together their ids tag the diff
+    diff_id = f'{old_id}.{new_id}'
+    cached = not_modified(diff_id)
+    if cached is not None:
+        return cached
+    
+    with dts_metrics.phase('diff'):
+        changes = diff_trees(old, new)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), 10000)
+    response = jsonify({
+        'success': True,
+        'total': len(changes),
+        'offset': offset,
+        'changes': changes[offset:offset + limit],
+    })
+    response.set_etag(diff_id)
+    return response
+
+@app.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+def api_job(job_id):
+    """API endpoint to poll a background parse job, or cancel it with DELETE"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    
+    if request.method == 'DELETE':
+        job.cancel()
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+@app.route('/api/download-json', methods=['GET', 'POST'])
 def api_download_json():
     """API endpoint to download DTS data as JSON"""
     try:
-        data = request.json
+        if request.method == 'GET':
+            data = {'tree_id': request.args.get('tree_id', '')}
+        else:
+            data = request.json
+        
+        # Stream a stored tree straight from the server
+        if data and 'tree_id' in data:
+            tree_id = data['tree_id']
+            node = result_cache.get(tree_id)
+            if node is None:
+                return jsonify({'error': 'Unknown or expired tree'}), 404
+            cached = not_modified(tree_id)
+            if cached is not None:
+                return cached
+            response = Response(
+                dts_metrics.time_chunks('export_json', iter_json(node)),
+                mimetype='application/json',
+                headers={'Content-Disposition': 'attachment; filename=dts_data.json'}
+            )
+            response.set_etag(tree_id)
+            return response
+        
         if not data or 'data' not in data:
             return jsonify({'error': 'No data provided'}), 400
         
@@ -132,9 +993,47 @@ def api_download_json():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def run_server(host='0.0.0.0', port=5000, debug=False):
+@app.route('/api/download-dtb')
+def api_download_dtb():
+    """API endpoint to download a stored tree compiled to a device tree blob"""
+    tree_id = request.args.get('tree_id', '')
+    node = result_cache.get(tree_id)
+    if node is None:
+        return jsonify({'error': 'Unknown or expired tree'}), 404
+    cached = not_modified(tree_id)
+    if cached is not None:
+        return cached
+    
+    try:
+        with dts_metrics.phase('export_dtb'):
+            blob = DTBWriter(node, symbols=True).to_bytes()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 422
+    
+    response = send_file(io.BytesIO(blob), as_attachment=True, download_name='dts_data.dtb',
+                         mimetype='application/octet-stream')
+    response.set_etag(tree_id)
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics: parse phase timings, counters and request latency histograms"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+def run_server(host='0.0.0.0', port=5000, debug=False, cache_dir=None, asgi=False):
     """Run the Flask server"""
-    if debug:
+    if cache_dir:
+        # Keep parsed results on disk as well as in memory
+        result_cache.disk = DTSParseCache(cache_dir)
+    
+    if asgi:
+        # ASGI mode with uvicorn: uploads stream in without holding a thread
+        try:
+            import uvicorn
+        except ImportError:
+            sys.exit("Error: --asgi needs uvicorn (pip install uvicorn)")
+        uvicorn.run(asgi_app, host=host, port=port, log_level='debug' if debug else 'info')
+    elif debug:
         # Development mode
         app.run(host=host, port=port, debug=True)
     else:
@@ -149,6 +1048,10 @@ if __name__ == '__main__':
     parser.add_argument('--host', default='0.0.0.0', help='Host to run the server on')
     parser.add_argument('--port', type=int, default=5000, help='Port to run the server on')
     parser.add_argument('--debug', action='store_true', help='Run in debug mode')
+    parser.add_argument('--cache-dir', default=os.environ.get('EASYDT_CACHE_DIR'),
+                        help='Directory to keep parsed results in across restarts')
+    parser.add_argument('--asgi', action='store_true',
+                        help='Serve with uvicorn, streaming uploads in instead of using a thread per request')
     
     args = parser.parse_args()
-    run_server(host=args.host, port=args.port, debug=args.debug) 
\ No newline at end of file
+    run_server(host=args.host, port=args.port, debug=args.debug, cache_dir=args.cache_dir, asgi=args.asgi) 
\ No newline at end of file